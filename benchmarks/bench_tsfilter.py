@@ -0,0 +1,56 @@
+"""Throughput of the in-process TS PID filter vs. the ffmpeg strip process.
+
+    python benchmarks/bench_tsfilter.py recording.ts [--mb 2000]
+
+Both read the same first N MB of the recording from memory; the filter output
+is discarded, ffmpeg's goes to the null device. Run it twice so the file is
+in the page cache for both.
+"""
+
+import argparse, os, subprocess, sys, time
+from pathlib import Path
+from tstriage.input_file import InputFile
+from tstriage.tsfilter import PidFilter
+
+CHUNK = 1024 * 1024
+
+
+def bench_filter(data: bytes) -> float:
+    pidFilter = PidFilter()
+    view = memoryview(data)
+    started = time.perf_counter()
+    for i in range(0, len(data), CHUNK):
+        pidFilter.filter(view[i:i + CHUNK])
+    elapsed = time.perf_counter() - started
+    print(f'PidFilter: kept {pidFilter.bytes_out / pidFilter.bytes_in:.1%}')
+    return elapsed
+
+
+def bench_ffmpeg_strip(path: Path, data: bytes) -> float:
+    cmd = InputFile(path).StripTsCmd('-', '-', ['jpn'])
+    started = time.perf_counter()
+    with subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL) as proc:
+        view = memoryview(data)
+        for i in range(0, len(data), CHUNK):
+            proc.stdin.write(view[i:i + CHUNK])
+        proc.stdin.close()
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('input', type=Path)
+    parser.add_argument('--mb', type=int, default=2000, help='MB to read from the start of the input')
+    args = parser.parse_args()
+    with args.input.open('rb') as f:
+        data = f.read(args.mb * 1024 * 1024)
+    data = data[:len(data) // 188 * 188]
+    size = len(data) / 1e9
+    print(f'{args.input.name}: {size:.2f} GB, {os.cpu_count()} CPUs')
+    for name, fn in (('PidFilter', lambda: bench_filter(data)), ('ffmpeg strip', lambda: bench_ffmpeg_strip(args.input, data))):
+        elapsed = fn()
+        print(f'{name:>12}: {elapsed:6.2f} s  {size / elapsed:6.2f} GB/s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
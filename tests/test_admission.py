@@ -0,0 +1,78 @@
+import subprocess, sys, threading
+import psutil
+import pytest
+from tstriage import admission
+from tstriage.admission import Admission, Load
+from tstriage.subprocess_utils import popen
+
+IDLE = Load(cpu=10, memory=40, diskIO=5, freeSpace=500)
+
+
+class _EPGStation:
+    def __init__(self, reserves):
+        self.reserves = reserves
+        self.calls = 0
+
+    def GetReserves(self):
+        self.calls += 1
+        return self.reserves
+
+
+def test_thresholds(tmp_path):
+    a = Admission(tmp_path, cpu=80, memory=85, diskIO=100, freeSpace=50)
+    assert a.Busy(IDLE, 0) is None
+    assert a.Busy(Load(cpu=95, memory=40, diskIO=5, freeSpace=500), 0) == 'CPU at 95%'
+    assert a.Busy(Load(cpu=10, memory=90, diskIO=5, freeSpace=500), 0) == 'memory at 90%'
+    assert a.Busy(Load(cpu=10, memory=40, diskIO=250, freeSpace=500), 0) == 'disk I/O at 250 MB/s'
+    assert a.Busy(Load(cpu=10, memory=40, diskIO=5, freeSpace=20), 0).startswith('20.0 GB free')
+    assert Admission(tmp_path).Busy(Load(cpu=100, memory=100, diskIO=1e4, freeSpace=0), 0) is None  # all checks off
+
+
+def test_recording_windows(tmp_path):
+    epg = _EPGStation([
+        {'id': 1, 'name': 'News', 'startAt': 100_000, 'endAt': 150_000},
+        {'id': 2, 'name': 'Skipped', 'startAt': 200_000, 'endAt': 250_000, 'isSkip': True},
+    ])
+    a = Admission(tmp_path, epgStation=epg, margin=20)
+    assert a.Busy(IDLE, 79) is None
+    assert a.Busy(IDLE, 80) == 'recording "News"'     # margin before the start
+    assert a.Busy(IDLE, 170) == 'recording "News"'    # margin after the end
+    assert a.Busy(IDLE, 171) is None
+    assert a.Busy(IDLE, 220) is None
+    assert epg.calls == 1  # cached for RESERVES_TTL
+
+
+def test_from_config(tmp_path):
+    assert Admission.FromConfig({'Destination': str(tmp_path)}, None) is None
+    a = Admission.FromConfig({'Destination': str(tmp_path), 'Admission': {'cpu': 80, 'nice': {'encode': 12}}}, _EPGStation([]))
+    assert a.cpu == 80 and a.epgStation is None
+    assert a.Priority('encode') == (12, 'best-effort')
+    assert a.Priority('analyze') == admission.DEFAULT_PRIORITY['analyze']
+
+
+def test_wait_until_admitted(tmp_path, monkeypatch):
+    a = Admission(tmp_path, cpu=80, poll=0)
+    loads = iter([Load(95, 0, 0, 1e3), Load(90, 0, 0, 1e3), IDLE])
+    monkeypatch.setattr(a, 'Sample', lambda: next(loads))
+    a.Wait('encoding "x"', threading.Event())
+    assert next(loads, None) is None
+
+    stop = threading.Event()
+    stop.set()
+    monkeypatch.setattr(a, 'Sample', lambda: Load(95, 0, 0, 1e3))
+    with pytest.raises(KeyboardInterrupt):
+        a.Wait('encoding "x"', stop)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='nice levels are priority classes on Windows')
+def test_children_run_at_stage_priority():
+    base = psutil.Process().nice()
+    with admission.priority((min(base + 5, 19), 'idle')):
+        with popen([sys.executable, '-c', 'import time; time.sleep(5)']) as child:
+            try:
+                assert psutil.Process(child.pid).nice() == min(base + 5, 19)
+            finally:
+                child.kill()
+    with popen([sys.executable, '-c', 'pass'], stdout=subprocess.DEVNULL) as child:
+        assert psutil.Process(child.pid).nice() == base
+        child.wait()
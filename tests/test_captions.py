@@ -0,0 +1,93 @@
+import pytest
+from tstriage import captions
+from tstriage.captions import CaptionDecoder, CaptionSink
+from tstriage.tsfilter import crc32_mpeg
+
+PMT_PID, VIDEO_PID, CAPTION_PID = 0x1F0, 0x100, 0x130
+
+
+def _packet(pid: int, payload: bytes, start: bool = False) -> bytes:
+    header = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, 0x10])
+    return (header + payload + b'\xff' * 184)[:188]
+
+
+def _section(table_id: int, body: bytes) -> bytes:
+    head = bytes([table_id, 0xB0 | ((len(body) + 4) >> 8), (len(body) + 4) & 0xFF])
+    return head + body + crc32_mpeg(head + body).to_bytes(4, 'big')
+
+
+def _psi() -> bytes:
+    pat = bytes([0x7F, 0xE1, 0xC1, 0x00, 0x00, 0x04, 0x00, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])
+    pmt = bytes([0x04, 0x00, 0xC1, 0x00, 0x00, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+    pmt += bytes([0x02, 0xE0 | (VIDEO_PID >> 8), VIDEO_PID & 0xFF, 0xF0, 0x00])
+    pmt += bytes([0x06, 0xE0 | (CAPTION_PID >> 8), CAPTION_PID & 0xFF, 0xF0, 0x03, 0x52, 0x01, 0x30])
+    return _packet(0, b'\x00' + _section(0x00, pat), start=True) + _packet(PMT_PID, b'\x00' + _section(0x02, pmt), start=True)
+
+
+def _pes(stream_id: int, seconds: float, payload: bytes = b'') -> bytes:
+    pts = round(seconds * 90000)
+    stamp = bytes([0x21 | ((pts >> 29) & 0x0E), (pts >> 22) & 0xFF, ((pts >> 14) & 0xFE) | 1, (pts >> 7) & 0xFF, ((pts << 1) & 0xFE) | 1])
+    length = 3 + 5 + len(payload) if stream_id == 0xBD else 0
+    return b'\x00\x00\x01' + bytes([stream_id]) + length.to_bytes(2, 'big') + b'\x80\x80\x05' + stamp + payload
+
+
+def _caption(seconds: float, text: bytes) -> bytes:
+    unit = b'\x1f\x20' + len(text).to_bytes(3, 'big') + text
+    statement = b'\x3f' + len(unit).to_bytes(3, 'big') + unit
+    group = bytes([0x01 << 2, 0x00, 0x00]) + len(statement).to_bytes(2, 'big') + statement + b'\x00\x00'
+    return _packet(CAPTION_PID, _pes(0xBD, seconds, b'\x80\xff\xf0' + group), start=True)
+
+
+def _video(seconds: float) -> bytes:
+    return _packet(VIDEO_PID, _pes(0xE0, seconds), start=True)
+
+
+def _filler(n: int) -> bytes:
+    return _packet(VIDEO_PID, b'\x00' * 184) * n
+
+
+# CS, 字幕 (kanji), です (hiragana via GR), APR, LS1 ABC, LS0 [字] (additional symbol), 〜
+TEXT = b'\x0c\x3b\x7a\x4b\x6b\xc7\xb9\x0d\x0eABC\x0f\x7a\x56\x21\x41'
+
+
+def test_decoder():
+    assert CaptionDecoder().decode(TEXT) == [None, '字幕です', 'ABC[字]〜']
+    # katakana designated to G1 and invoked into GR, then a repeated character
+    assert CaptionDecoder().decode(b'\x1b\x29\x31\x1b\x7e\xa3\x98\x43\xa6') == ['ィウウウ']
+
+
+def _write(sink: CaptionSink, data: bytes):
+    for i in range(0, len(data), 1000):  # chunks that split packets
+        sink.write(data[i:i + 1000])
+    sink.close()
+
+
+@pytest.fixture(params=[True, False], ids=['numpy', 'python'])
+def selection(request, monkeypatch):
+    if request.param:
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(captions, 'np', None)
+
+
+def test_sink_writes_ass_and_srt(tmp_path, selection):
+    stream = _psi() + _video(100.0) + _filler(10) + _caption(102.0, TEXT) + _filler(10) + _caption(105.5, b'\x0c')
+    _write(CaptionSink(tmp_path / 'show', [(len(stream), 30.0)]), stream)
+    srt = (tmp_path / 'show.srt').read_text(encoding='utf-8')
+    assert '00:00:02,000 --> 00:00:05,500' in srt
+    assert '字幕です\nABC[字]～' in srt  # wave dash mapped for Android fonts
+    assert (tmp_path / 'show.ass').exists()
+
+
+def test_sink_follows_clip_boundaries(tmp_path, selection):
+    first = _psi() + _video(100.0) + _caption(101.0, TEXT) + _filler(20)
+    second = _psi() + _filler(3) + _caption(499.0, TEXT) + _video(500.0) + _caption(502.0, TEXT)
+    sink = CaptionSink(tmp_path / 'show', [(len(first), 8.0), (len(second), 10.0)])
+    _write(sink, first + second)
+    # the first caption lasts until its clip ends; one sent before clip 2's first frame starts with the clip
+    assert [(s, e) for s, e, _ in sink.events] == [(1000, 8000), (8000, 10000), (10000, 18000)]
+
+
+def test_sink_without_captions(tmp_path, selection):
+    _write(CaptionSink(tmp_path / 'show'), _psi() + _video(1.0) + _filler(10))
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,63 @@
+import os, sys
+import pytest
+from tstriage import cli_config
+from tstriage.subprocess_utils import run_process
+
+
+@pytest.fixture
+def uv(tmp_path, monkeypatch):
+    """A fake `uv` that runs `uv run [options] python ...` with a project environment's bin first in PATH."""
+    if os.name == 'nt':
+        pytest.skip('shell script stand-in for uv')
+    project, envBin, bin = tmp_path / 'tsmarker', tmp_path / 'env' / 'bin', tmp_path / 'bin'
+    for folder in (project, envBin, bin):
+        folder.mkdir(parents=True)
+    (project / 'uv.lock').write_text('v1')
+    tool = envBin / 'tsmarker'
+    tool.write_text('#!/bin/sh\necho tsmarker 1.0\n')
+    calls = tmp_path / 'calls'
+    (bin / 'uv').write_text(f'#!/bin/sh\necho >> {calls}\nwhile [ "$1" != python ]; do shift; done\nshift\n'
+                            f'PATH={envBin}:$PATH exec {sys.executable} "$@"\n')
+    for script in (tool, bin / 'uv'):
+        script.chmod(0o755)
+    monkeypatch.setenv('PATH', f'{bin}{os.pathsep}{os.environ["PATH"]}')
+    monkeypatch.setattr(cli_config, 'CACHE_PATH', tmp_path / 'cli.json')
+    cli_config.resolve.cache_clear()
+    yield project, tool, lambda: len(calls.read_text().splitlines()) if calls.exists() else 0
+    cli_config.resolve.cache_clear()
+
+
+def test_uv_run_is_resolved_once(uv):
+    project, tool, calls = uv
+    cmd = f'uv run --frozen --directory {project} tsmarker --progress'
+    assert cli_config.resolve(cmd).argv == (str(tool), '--progress')
+    cli_config.resolve.cache_clear()  # a new tstriage process
+    assert cli_config.resolve(cmd).argv == (str(tool), '--progress')
+    assert calls() == 1
+
+    (project / 'uv.lock').write_text('v2')  # dependencies changed: let uv sync again
+    cli_config.resolve.cache_clear()
+    cli_config.resolve(cmd)
+    assert calls() == 2
+
+
+def test_other_commands_run_as_configured(uv):
+    project, _, calls = uv
+    assert cli_config.resolve('python -m tsmarker') == cli_config.Resolved(('python', '-m', 'tsmarker'))
+    assert cli_config.resolve(f'uv run --directory {project} missing-tool') == cli_config.Resolved(('uv', 'run', '--directory', str(project), 'missing-tool'))
+
+
+def test_resolved_tool_runs_in_the_uv_directory_and_environment(uv, tmp_path, monkeypatch):
+    project, tool, calls = uv
+    tool.write_text('#!/bin/sh\necho "$PWD $GREETING $KEPT"\n')
+    (project / '.env').write_text('# for tsmarker\nGREETING="hello world"\nexport KEPT=file\n')
+    monkeypatch.setenv('KEPT', 'shell')  # variables already set win, as with uv
+    cli_config.configure(tsmarker=f'uv run --directory {project} --env-file .env tsmarker')
+    try:
+        resolved = cli_config.resolve(cli_config._tsmarker_cmd)
+        assert (resolved.argv, resolved.cwd, resolved.env) == ((str(tool),), str(project.resolve()), {'GREETING': 'hello world', 'KEPT': 'file'})
+        result = run_process(cli_config.tsmarker(), capture_output=True, text=True)
+        assert result.stdout.split() == [str(project.resolve()), 'hello', 'world', 'shell']
+        assert calls() == 1
+    finally:
+        cli_config.configure(tsmarker='tsmarker')
@@ -0,0 +1,20 @@
+import os
+from tstriage import clip_reader
+from tstriage.clip_reader import ClipReader
+
+
+def test_reads_ranges_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(clip_reader, '_ALIGN', 4096)
+    data = os.urandom(200_000)
+    path = tmp_path / 'a.ts'
+    path.write_bytes(data)
+    ranges = [(1000, 90_000), (90_000, 90_000), (120_001, 200_000)]
+    with ClipReader(path, ranges) as reader:
+        assert reader.total == 89_000 + 79_999
+        chunks = list(iter(lambda: reader.read(10_000), b''))
+    assert b''.join(chunks) == data[1000:90_000] + data[120_001:200_000]
+    assert all(len(c) <= 10_000 for c in chunks)
+    # after the first read of a range, reads end on alignment boundaries
+    assert (1000 + len(chunks[0])) % 4096 == 0
+    with ClipReader(path, ranges) as reader:
+        assert reader.read() == data[1000:90_000] + data[120_001:200_000]
@@ -0,0 +1,48 @@
+import json
+from tstriage import clips
+from tstriage.clips import ClipManifest, WriteGroundTruth
+
+
+def _write(tmp_path, monkeypatch, program: set):
+    ptsmap = {str(float(t)): {'next_start_pos': t * 1000, 'prev_end_pos': t * 1000 - 188} for t in range(0, 50, 10)}
+    markermap = {f'[{float(s)}, {float(s + 10)}]': {'subtitles': 1.0 if s in program else 0.0} for s in range(0, 40, 10)}
+    (tmp_path / 'a.ptsmap').write_text(json.dumps(ptsmap))
+    (tmp_path / 'a.markermap').write_text(json.dumps(markermap))
+
+    def _program_clips(ptsmap_path, markermap_path, split_num, by_group, quiet):
+        with open(markermap_path) as f:
+            m = json.load(f)
+        method = '_groundtruth' if any('_groundtruth' in v for v in m.values()) else 'subtitles'
+        kept = sorted(json.loads(k) for k, v in m.items() if v[method] >= 0.5)
+        merged = []
+        for s, e in kept:
+            if merged and merged[-1][1] == s:
+                merged[-1][1] = e
+            else:
+                merged.append([s, e])
+        return {'groups': [merged], 'by_method': method}
+    monkeypatch.setattr(clips, 'ProgramClips', _program_clips)
+
+
+def test_build_and_round_trip(tmp_path, monkeypatch):
+    _write(tmp_path, monkeypatch, program={0, 10, 30})
+    manifest = ClipManifest.Build(tmp_path / 'a.ts', tmp_path / 'a.ptsmap', tmp_path / 'a.markermap')
+    assert manifest.Groups() == [[[0.0, 20.0], [30.0, 40.0]]]
+    assert [c.program for c in manifest.clips] == [True, True, False, True]
+    assert manifest.GroupBytes(0) == (20000 - 188) + (40000 - 188 - 30000)
+    assert manifest.Duration() == 30.0
+    manifest.Save(tmp_path / 'a.clips')
+    assert ClipManifest.Load(tmp_path / 'a.clips') == manifest
+
+
+def test_review_becomes_groundtruth(tmp_path, monkeypatch):
+    _write(tmp_path, monkeypatch, program={0, 10, 30})
+    original = ClipManifest.Build(tmp_path / 'a.ts', tmp_path / 'a.ptsmap', tmp_path / 'a.markermap')
+    reviewed = ClipManifest.Build(tmp_path / 'a.ts', tmp_path / 'a.ptsmap', tmp_path / 'a.markermap')
+    reviewed.clips[1].program = False
+    assert [(c.start, c.program) for c in reviewed.Changes(original)] == [(10.0, False)]
+    WriteGroundTruth(tmp_path / 'a.markermap', reviewed)
+    rebuilt = ClipManifest.Build(tmp_path / 'a.ts', tmp_path / 'a.ptsmap', tmp_path / 'a.markermap')
+    assert rebuilt.by_method == '_groundtruth'
+    assert rebuilt.Groups() == [[[0.0, 10.0], [30.0, 40.0]]]
+    assert not reviewed.Changes(rebuilt)
@@ -0,0 +1,68 @@
+import time
+from dataclasses import asdict
+from tstriage.duplicates import ContentHash, Episode, RecordingFingerprint
+from tstriage.history import History
+
+
+def _ts(path, seed: int, packets: int = 5000, skew: int = 0):
+    data = bytearray()
+    for i in range(packets):
+        body = ((i * 7 + seed) % 251).to_bytes(1, 'big') * 184
+        data += bytes([0x47, 0x01, 0x00, 0x10 | (i + skew) & 0x0F]) + body
+    path.write_bytes(bytes(data))
+    return path
+
+
+EPG = {'name': '【新】ドラマ #1[字][再]', 'description': '第1話 あらすじ', 'startAt': 0, 'endAt': 3_600_000}
+
+
+def test_content_hash(tmp_path):
+    a, copy, other = _ts(tmp_path / 'a.ts', 1), _ts(tmp_path / 'b.ts', 1, skew=5), _ts(tmp_path / 'c.ts', 2)
+    assert ContentHash(a) == ContentHash(copy)  # continuity counters differ, payloads do not
+    assert ContentHash(a) != ContentHash(other)
+
+
+def test_rebroadcast_matches_by_program(tmp_path):
+    first = RecordingFingerprint.Compute(_ts(tmp_path / 'a.ts', 1), EPG)
+    rerun = RecordingFingerprint.Compute(_ts(tmp_path / 'b.ts', 2), {**EPG, 'name': 'ドラマ #1', 'endAt': 3_630_000})
+    assert first.episode == rerun.episode == '1' and rerun.Matches(first)
+    other = RecordingFingerprint.Compute(_ts(tmp_path / 'c.ts', 3), {**EPG, 'description': '第2話'})
+    assert not other.Matches(first)
+    # a title alone (news, daily shows) is not enough
+    bare = RecordingFingerprint.Compute(_ts(tmp_path / 'd.ts', 4), {**EPG, 'description': ''})
+    assert bare.program is None and not bare.Matches(RecordingFingerprint.Compute(_ts(tmp_path / 'e.ts', 5), {**EPG, 'description': ''}))
+
+
+def test_generic_description_needs_a_discriminator(tmp_path):
+    weekly = {'name': 'ドラマ', 'description': '毎週お届けする人気ドラマ。', 'startAt': 0, 'endAt': 3_600_000}
+    first = RecordingFingerprint.Compute(_ts(tmp_path / 'a.ts', 1), {**weekly, 'programId': 1})
+    nextWeek = RecordingFingerprint.Compute(_ts(tmp_path / 'b.ts', 2), {**weekly, 'programId': 2})
+    assert first.program == nextWeek.program and not nextWeek.Matches(first)
+    sameEvent = RecordingFingerprint.Compute(_ts(tmp_path / 'c.ts', 3), {**weekly, 'programId': 1})
+    assert sameEvent.Matches(first)  # recorded twice, e.g. by two rules
+    copy = RecordingFingerprint.Compute(_ts(tmp_path / 'd.ts', 1, skew=5), weekly)
+    assert copy.Matches(first)       # same payloads
+    assert Episode('ドラマ', '第１２回 あらすじ') == '12'
+
+
+def test_history_fingerprints(tmp_path):
+    history = History(tmp_path / 'history.sqlite')
+    encoded = RecordingFingerprint.Compute(_ts(tmp_path / 'a.ts', 1), EPG)
+    history.AddFingerprint('a', **asdict(encoded))
+    rows = history.Fingerprints(encoded.program, since=time.time() - 60)
+    assert [(r['name'], r['episode']) for r in rows] == [('a', '1')]
+    assert history.Fingerprints(encoded.program, since=time.time() + 60) == []  # outside the window
+    assert history.Fingerprints('other', since=0) == []
+
+
+def test_history_keeps_one_fingerprint_per_recording(tmp_path):
+    import sqlite3
+    path = tmp_path / 'history.sqlite'
+    with sqlite3.connect(path) as conn:  # written before fingerprints were unique
+        conn.execute('CREATE TABLE fingerprints (added REAL NOT NULL, name TEXT NOT NULL, program TEXT, duration REAL, content TEXT NOT NULL)')
+        conn.executemany('INSERT INTO fingerprints VALUES (?, ?, ?, ?, ?)', [(1.0, 'a', None, 60.0, 'x'), (2.0, 'a', None, 60.0, 'x')])
+    conn.close()
+    history = History(path)
+    history.AddFingerprint('a', None, 60.0, 'y')  # re-encoded after Confirm
+    rows = history._conn.execute('SELECT name, content FROM fingerprints').fetchall()
+    assert [tuple(row) for row in rows] == [('a', 'y')]
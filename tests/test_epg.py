@@ -0,0 +1,40 @@
+import io, json
+import pytest
+from tstriage.epg import EPG, HeadPipe, IterEvents
+
+EVENTS = [
+    {'serviceId': 1024, 'name': 'ニュース', 'description': 'x' * 50},
+    {'serviceId': 1032, 'name': '\U0001F21Fドラマ\U0001F211 #1', 'description': 'EテレのA'},
+    {'serviceId': 1024, 'name': '\U0001F21Fドラマ\U0001F211 #1', 'description': '総合', 'extended': {'出演者': '[a, b]'}},
+]
+
+
+def test_iter_events(tmp_path):
+    path = tmp_path / 'show.epg'
+    path.write_text(json.dumps(EVENTS, ensure_ascii=False, indent=2), encoding='utf-8')
+    assert list(IterEvents(path, chunk_size=7)) == EVENTS
+    path.write_text('[]', encoding='utf-8')
+    assert list(IterEvents(path)) == []
+
+
+def test_info_matches_the_service(tmp_path):
+    path = tmp_path / '20240101_[新]ドラマ[字] #1.epg'
+    path.write_text(json.dumps(EVENTS, ensure_ascii=False), encoding='utf-8')
+    epg = EPG(path, 1024)
+    assert epg.Info()['description'] == '総合'
+    assert [e['name'] for e in epg.epg] == ['ニュース', EVENTS[2]['name']]  # other services are dropped
+    with pytest.raises(RuntimeError):
+        EPG(path, 2048).Info()
+
+
+def test_head_pipe():
+    pipe = io.BytesIO()
+    close = pipe.close
+    pipe.close = lambda: None  # keep the contents readable
+    head = HeadPipe(pipe, 5)
+    head.write(b'abc')
+    head.write(b'defg')
+    with pytest.raises(BrokenPipeError):
+        head.write(b'h')
+    assert pipe.getvalue() == b'abcde'
+    close()
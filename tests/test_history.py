@@ -0,0 +1,28 @@
+import sys, time
+from tstriage.history import History, Percentile, StageStats
+from tstriage.procstats import Meter
+from tstriage.subprocess_utils import run_process
+
+
+def test_percentile():
+    assert Percentile([5, 1, 3, 2, 4], 50) == 3
+    assert Percentile([5, 1, 3, 2, 4], 90) == 5
+    assert Percentile([7], 99) == 7
+
+
+def test_stage_stats(tmp_path):
+    history = History(tmp_path / 'history.sqlite')
+    for wall, channel in ((60, 'NHK'), (120, 'NHK'), (600, 'BS11')):
+        history.AddStage(started=time.time(), name='x', stage='encode', channel=channel, preset='drama',
+                         host='h', status='ok', wall=wall, cpu=wall / 2, read_bytes=1000, peak_rss=1)
+    history.AddStage(started=time.time(), name='x', stage='encode', channel='NHK', preset='drama',
+                     host='h', status='error', wall=1, cpu=0, read_bytes=0, peak_rss=0)
+    stats = StageStats(history.Stages(stage='encode'), by=('channel',))
+    assert [(s['channel'], s['count'], s['wall_p50']) for s in stats] == [('BS11', 1, 600), ('NHK', 2, 60)]
+
+
+def test_meter_tracks_children():
+    with Meter() as meter:
+        run_process([sys.executable, '-c', 'import time\nt = time.time()\nwhile time.time() - t < 1.2: pass'], check=True)
+    assert meter.usage().cpu > 0.3
+    assert meter.usage().peak_rss > 0
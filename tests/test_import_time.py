@@ -0,0 +1,30 @@
+import re, subprocess, sys
+import pytest
+
+# Cron and Jenkins start tstriage many times a day; keep its startup lean.
+BUDGET_US = {'tstriage.cli': 150_000, 'tstriage.runner': 250_000}
+# Stage code that only encode/analyze/... need, and what it drags in.
+HEAVY = ('tstriage.tasks', 'tstriage.pipeline', 'tstriage.duplicates', 'numpy', 'pysubs2', 'ffmpeg', 'rich.progress')
+# What only some commands need: run/encode/... need the runner, stats the history.
+LAZY = {'tstriage.cli': ('tstriage.runner', 'tstriage.history', 'sqlite3')}
+
+
+def _importtime(module: str) -> dict[str, int]:
+    """Cumulative import time in µs of every module imported by `import module`, in a fresh interpreter."""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        m = re.match(r'import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)', line)
+        if m:
+            times[m.group(3)] = int(m.group(1))
+    return times
+
+
+@pytest.mark.parametrize('module', BUDGET_US)
+def test_import_time(module):
+    _importtime(module)  # warm the bytecode cache
+    times = min((_importtime(module) for _ in range(3)), key=lambda t: t[module])
+    heavy = [m for m in HEAVY + LAZY.get(module, ()) if m in times]
+    assert not heavy, f'{module} imports {", ".join(heavy)} eagerly'
+    assert times[module] < BUDGET_US[module], f'{module} took {times[module] / 1000:.0f} ms to import'
@@ -109,3 +109,41 @@ def test_encode_ts_cmd_dual_mono():
     assert 'channelsplit' in cmd_str
     assert 'language=jpn' in cmd_str
     assert 'language=eng' in cmd_str
+
+
+def test_encode_ts_cmd_threads():
+    f = InputFile("test.ts")
+    preset = {'crf': 23, 'videoFilter': ''}
+    cmd = f.EncodeTsCmd("in.ts", "out.mkv", preset=preset, encoder="libx264", threads=16)
+    assert cmd[cmd.index('-threads') + 1] == '16'
+    cmd = f.EncodeTsCmd("in.ts", "out.mkv", preset=preset, encoder="h264_nvenc", threads=16)
+    assert '-threads' not in cmd
+
+
+def test_encode_ts_cmd_progress():
+    f = InputFile("test.ts")
+    cmd = f.EncodeTsCmd("-", "out.mkv", preset={'crf': 23}, encoder="libx264", progressUrl='pipe:1')
+    assert cmd.index('-progress') < cmd.index('-i')
+    assert cmd[cmd.index('-progress') + 1] == 'pipe:1'
+
+
+def test_encode_ts_cmd_strip():
+    f = InputFile("test.ts")
+    cmd = f.EncodeTsCmd("-", "out.mkv", preset={'crf': 23}, encoder="libx264", strip=True)
+    assert cmd[cmd.index('-c:a') + 1] == 'copy'
+    assert cmd.count('-map') == 2
+    assert 'language=jpn' in cmd
+    cmd = f.EncodeTsCmd("-", "out.mkv", preset={'crf': 23}, encoder="libx264", strip=True, fixAudio=True)
+    assert cmd[cmd.index('-af') + 1] == 'aresample=async=1'
+    assert cmd[cmd.index('-c:a') + 1] == 'aac'
+    assert 'aac_adtstoasc' not in cmd
+    # fixAudio is the strip pass's job; without strip=True the input is already fixed
+    assert '-af' not in f.EncodeTsCmd("-", "out.mkv", preset={'crf': 23}, encoder="libx264", fixAudio=True)
+
+
+def test_encode_ts_cmd_strip_dual_mono():
+    f = InputFile("test.ts")
+    cmd = f.EncodeTsCmd("-", "out.mkv", preset={'crf': 23}, encoder="libx264", strip=True, fixAudio=True,
+                        audio_config=[{'componentType': 2, 'langs': ['jpn', 'eng']}])
+    assert cmd[cmd.index('-filter_complex') + 1] == '[0:a]aresample=async=1,channelsplit=channel_layout=stereo[left][right]'
+    assert 'language=eng' in cmd
@@ -0,0 +1,84 @@
+import json, threading, time, urllib.error, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from tstriage.llmproxy import LLMProxy, TokenBucket
+
+
+class _Stub(BaseHTTPRequestHandler):
+    """OpenAI-style endpoint that answers with the number of requests it has seen."""
+    lock = threading.Lock()
+    calls = active = peak = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        cls = type(self)
+        with cls.lock:
+            cls.calls += 1
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+            n = cls.calls
+        time.sleep(body.get('sleep', 0))
+        with cls.lock:
+            cls.active -= 1
+        status = 500 if body.get('fail') else 200
+        data = json.dumps({'choices': [{'message': {'content': f'answer {n}'}}],
+                           'auth': self.headers.get('Authorization')}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def proxy(tmp_path):
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), type('Stub', (_Stub,), {'lock': threading.Lock()}))
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    proxy = LLMProxy(f'http://127.0.0.1:{stub.server_address[1]}/v1', tmp_path / 'cache', concurrency=2, rpm=0)
+    proxy.Serve()
+    yield proxy, stub.RequestHandlerClass
+    proxy.server.shutdown()
+    stub.shutdown()
+
+
+def _chat(proxy: LLMProxy, **body) -> tuple[int, dict]:
+    request = urllib.request.Request(proxy.url + '/chat/completions', data=json.dumps({'model': 'm', **body}).encode(),
+                                     headers={'Content-Type': 'application/json', 'Authorization': 'Bearer sk-test'})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, json.load(response)
+    except urllib.error.HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_identical_requests_are_answered_from_the_cache(proxy):
+    proxy, stub = proxy
+    assert _chat(proxy, prompt='a') == (200, {'choices': [{'message': {'content': 'answer 1'}}], 'auth': 'Bearer sk-test'})
+    assert _chat(proxy, prompt='a')[1]['choices'][0]['message']['content'] == 'answer 1'
+    assert _chat(proxy, prompt='b')[1]['choices'][0]['message']['content'] == 'answer 2'
+    assert stub.calls == 2
+    # errors are passed on and not cached
+    assert _chat(proxy, prompt='c', fail=True)[0] == 500
+    assert _chat(proxy, prompt='c', fail=True)[0] == 500
+    assert stub.calls == 4
+
+
+def test_concurrency_limit(proxy):
+    proxy, stub = proxy
+    threads = [threading.Thread(target=_chat, args=(proxy,), kwargs={'prompt': str(i), 'sleep': 0.2}) for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert stub.calls == 6 and stub.peak == 2
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=20, burst=2)
+    started = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    assert 0.15 < time.monotonic() - started < 1.0  # 2 at once, then 4 at 20/s
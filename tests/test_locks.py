@@ -0,0 +1,28 @@
+import subprocess, sys, textwrap
+from tstriage import locks
+from tstriage.locks import FileLock
+
+
+def test_lock_is_exclusive(tmp_path, monkeypatch):
+    monkeypatch.setattr(locks, 'LOCK_DIR', str(tmp_path))
+    first = FileLock.For('item', 'show')
+    assert first.acquire(blocking=False)
+    assert not FileLock.For('item', 'show').acquire(blocking=False)
+    assert FileLock.For('item', 'other').acquire(blocking=False)    # other keys are independent
+    assert FileLock.For('output', 'show').acquire(blocking=False)   # and so are other scopes
+    first.release()
+    with FileLock.For('item', 'show'):
+        pass
+
+
+def test_lock_is_seen_by_other_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(locks, 'LOCK_DIR', str(tmp_path))
+    check = textwrap.dedent(f'''
+        from tstriage import locks
+        locks.LOCK_DIR = {str(tmp_path)!r}
+        print(locks.FileLock.For('item', 'show').acquire(blocking=False))
+    ''')
+    with FileLock.For('item', 'show'):
+        held = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, check=True)
+    free = subprocess.run([sys.executable, '-c', check], capture_output=True, text=True, check=True)
+    assert (held.stdout.strip(), free.stdout.strip()) == ('False', 'True')
@@ -0,0 +1,30 @@
+import urllib.request
+from tstriage.metrics import Registry, serve
+
+
+def test_render():
+    registry = Registry()
+    items = registry.counter('tstriage_stage_items_total', 'Items finished')
+    fps = registry.gauge('tstriage_encoder_fps', 'Encode fps')
+    items.inc(stage='encode', status='ok')
+    items.inc(stage='encode', status='ok')
+    fps.set(59.94, encoder='h264_nvenc', item='a "quoted" name')
+    text = registry.render()
+    assert '# TYPE tstriage_stage_items_total counter' in text
+    assert 'tstriage_stage_items_total{stage="encode",status="ok"} 2' in text
+    assert 'tstriage_encoder_fps{encoder="h264_nvenc",item="a \\"quoted\\" name"} 59.94' in text
+    fps.remove(encoder='h264_nvenc', item='a "quoted" name')
+    assert 'tstriage_encoder_fps{' not in registry.render()
+
+
+def test_collector_and_endpoint():
+    registry = Registry()
+    queue = registry.gauge('tstriage_queue_items', 'Queue depth')
+    registry.collector(lambda: queue.set(3, state='toencode'))
+    server = serve('127.0.0.1', 0, registry=registry)
+    try:
+        with urllib.request.urlopen(f'http://127.0.0.1:{server.server_address[1]}/metrics') as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'tstriage_queue_items{state="toencode"} 3' in response.read().decode()
+    finally:
+        server.shutdown()
@@ -0,0 +1,34 @@
+from tstriage.history import History
+from tstriage.predictor import EncodePredictor, OutputGeometry
+from tstriage.video_info import VideoInfo
+
+INFO = VideoInfo(duration=1800, width=1440, height=1080, fps=30000 / 1001, sar=(4, 3), dar=(16, 9), soundTracks=1, serviceId=1024)
+
+
+def test_output_geometry():
+    assert OutputGeometry(INFO, {'videoFilter': 'bwdif=0'}) == (1440, 1080, INFO.fps)
+    w, h, fps = OutputGeometry(INFO, {'videoFilter': 'pullup,fps=24000/1001,scale=1280:720'})
+    assert (w, h) == (1280, 720)
+    assert abs(fps - 23.976) < 0.001
+    assert OutputGeometry(INFO, {'videoFilter': 'scale=-2:720'})[:2] == (1280, 720)
+    assert OutputGeometry(INFO, {'videoFilter': 'yadif=1'})[2] == INFO.fps * 2
+
+
+def test_priors_without_history():
+    predictor = EncodePredictor()
+    low = predictor.Estimate('hq', {'crf': 20}, 'libx264', 1800, INFO)
+    high = predictor.Estimate('lq', {'crf': 26}, 'libx264', 1800, INFO)
+    assert low.samples == 0
+    assert low.bytes > high.bytes
+    assert predictor.Estimate('hq', {'crf': 20}, 'h264_nvenc', 1800, INFO).seconds < low.seconds
+
+
+def test_estimate_from_history(tmp_path):
+    predictor = EncodePredictor(History(tmp_path / 'history.sqlite'))
+    preset = {'videoFilter': 'bwdif=0', 'crf': 24}
+    predictor.Record('a', 'drama', preset, 'libx264', 1800, INFO, bytes=900_000_000, seconds=1000)
+    predictor.Record('b', 'drama', preset, 'libx264', 1800, INFO, bytes=1_100_000_000, seconds=1000)
+    estimate = predictor.Estimate('drama', preset, 'libx264', 3600, INFO)
+    assert estimate.samples == 2
+    assert abs(estimate.bytes - 2_000_000_000) < 1e6
+    assert abs(estimate.seconds - 2000) < 1
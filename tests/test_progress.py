@@ -0,0 +1,41 @@
+import json
+from tstriage import _progress
+from tstriage._progress import Progress, SubprocessProgress
+
+
+class _Rich:
+    def __init__(self):
+        self.updates = []
+
+    def add_task(self, desc, total=None, unit='it'):
+        return 0
+
+    def update(self, task, **fields):
+        self.updates.append(fields)
+
+
+def test_child_coalesces_updates(capsys):
+    progress = Progress(use_protocol=True)
+    progress.add_task('scan', 10000, 'Scanning')
+    for n in range(1, 10001):
+        progress.update('scan', n)
+    lines = [json.loads(l[len('PROGRESS:'):]) for l in capsys.readouterr().err.splitlines()]
+    assert len(lines) < 10
+    assert lines[-1] == {'task': 'scan', 'n': 10000}  # the last update always goes out
+
+
+def test_parent_coalesces_updates(monkeypatch):
+    rich = _Rich()
+    progress = SubprocessProgress(None, ctx='show', stage='mark')
+    progress.progress = rich
+    progress.feed('PROGRESS:' + json.dumps({'task': 'scan', 'total': 5000, 'desc': 'Scanning'}))
+    for n in range(1, 5001):
+        progress.feed('PROGRESS:' + json.dumps({'task': 'scan', 'n': n}))
+    progress.feed('plain stderr')
+    assert len(rich.updates) < 10
+    assert rich.updates[-1] == {'completed': 5000}
+    assert progress.stderr_tail() == ['plain stderr']
+
+    monkeypatch.setattr(_progress, 'UPDATE_INTERVAL', 0)
+    progress.update('scan', 1)
+    assert rich.updates[-1] == {'completed': 1}
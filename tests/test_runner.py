@@ -0,0 +1,180 @@
+import json
+from pathlib import Path
+from tstriage.runner import Runner
+
+
+def _runner(tmp_path, retries=0) -> Runner:
+    (tmp_path / 'rec' / '_tstriage').mkdir(parents=True)
+    (tmp_path / 'dst').mkdir()
+    return Runner({'Presets': {}, 'EPGStation': 'http://localhost:8888', 'Encoder': 'libx264', 'History': '',
+                   'Uncategoried': str(tmp_path / 'rec'), 'Destination': str(tmp_path / 'dst'),
+                   'Retry': {'retries': retries, 'backoff': 0}}, quiet=True)
+
+
+def _item(r: Runner, name: str) -> Path:
+    return r.CreateActionItem({'path': str(r.nas.recorded / f'{name}.ts'), 'destination': str(r.nas.destination / 'show')}, '.toencode')
+
+
+def test_failed_item_is_quarantined_and_the_stage_goes_on(tmp_path):
+    r = _runner(tmp_path)
+    done = []
+
+    def work(item, progress):
+        if 'bad' in item['path']:
+            progress.feed('corrupt stream')
+            raise RuntimeError('ffmpeg failed')
+        done.append(item['path'])
+
+    assert r._ProcessItem(None, _item(r, 'bad'), '.toencode', 'encoding', work, '.toconfirm') is None
+    assert r._ProcessItem(None, _item(r, 'good'), '.toencode', 'encoding', work, '.toconfirm').name == 'good.toconfirm'
+    assert done == [str(r.nas.recorded / 'good.ts')]
+    with (r.nas.tstriageFolder / 'bad.toencode.error').open(encoding='utf-8') as f:
+        error = json.load(f)['error']
+    assert (error['stage'], error['type'], error['message'], error['stderr']) == ('encode', 'RuntimeError', 'ffmpeg failed', ['corrupt stream'])
+    assert r.failed == ['encode: bad']
+
+
+def test_transient_errors_are_retried(tmp_path):
+    r = _runner(tmp_path, retries=2)
+    calls = []
+
+    def flaky(item, progress):
+        calls.append(1)
+        if len(calls) < 3:
+            raise TimeoutError('EPGStation timed out')
+
+    assert r._ProcessItem(None, _item(r, 'show'), '.toencode', 'encoding', flaky, '.toconfirm') is not None
+    assert len(calls) == 3 and not r.failed
+
+    calls.clear()
+    r.retries = 1
+    assert r._ProcessItem(None, _item(r, 'other'), '.toencode', 'encoding', flaky, '.toconfirm') is None
+    with (r.nas.tstriageFolder / 'other.toencode.error').open(encoding='utf-8') as f:
+        assert json.load(f)['error']['attempts'] == 2
+
+
+def test_mark_trains_the_ensemble_once_per_folder(tmp_path, monkeypatch):
+    from tstriage import tasks
+    r = _runner(tmp_path)
+    for name, folder in (('a', 'drama/x'), ('b', 'drama/x'), ('c', 'anime/y')):
+        r.CreateActionItem({'path': str(r.nas.recorded / f'{name}.ts'), 'destination': str(r.nas.destination / 'genres' / folder)}, '.tomark')
+    trained = []
+    monkeypatch.setattr(tasks, 'EnsembleModel', lambda folder, quiet, workFolder: trained.append(folder) or workFolder / 'model.pkl')
+    monkeypatch.setattr(tasks, 'Mark', lambda item, ensembleModel, **kwargs: ensembleModel(tasks.EnsembleFolder(item), True))
+    r.Mark()
+    assert sorted(trained) == [r.nas.destination / 'genres']
+    assert len(list(r.nas.ActionItems('.tocut'))) == 3
+
+
+def test_item_locked_by_another_run_is_skipped(tmp_path, monkeypatch):
+    from tstriage import locks
+    monkeypatch.setattr(locks, 'LOCK_DIR', str(tmp_path / 'locks'))
+    r = _runner(tmp_path)
+    path = _item(r, 'show')
+    with locks.FileLock.For('item', 'show'):
+        assert r._ProcessItem(None, path, '.toencode', 'encoding', lambda item, progress: None, '.toconfirm') is None
+    assert path.exists()
+    assert r._ProcessItem(None, path, '.toencode', 'encoding', lambda item, progress: None, '.toconfirm').name == 'show.toconfirm'
+    assert r._ProcessItem(None, path, '.toencode', 'encoding', lambda item, progress: None, '.toconfirm') is None  # handed on meanwhile
+
+
+def test_clip_folder_lives_until_confirmed_and_upstream_waits_for_scratch(tmp_path):
+    from tstriage.scratch import ScratchStore
+    r = _runner(tmp_path)
+    path = r.CreateActionItem({'path': str(r.nas.recorded / 'show.ts'), 'destination': str(r.nas.destination / 'show')}, '.tocut')
+    clips = r.nas.tstriageFolder / 'show'
+
+    def cut(item, progress):
+        (clips / 'CM').mkdir(parents=True)
+        (clips / 'CM' / '0.ts').write_bytes(b'x' * 1000)
+        r.scratch.Track(item, clips, until='confirm')
+
+    encoding = r._ProcessItem(None, path, '.tocut', 'cutting', cut, '.toencode')
+    assert r._ScratchUsed() == 1000
+    r.scratch = ScratchStore(r.nas.tstriageFolder, budget=1000)
+    queued = r.CreateActionItem({'path': str(r.nas.recorded / 'next.ts'), 'destination': str(r.nas.destination / 'show')}, '.toanalyze')
+    assert r._ProcessItem(None, queued, '.toanalyze', 'analyzing', lambda item, progress: None, '.tomark') is None
+    assert queued.exists()
+
+    confirming = r._ProcessItem(None, encoding, '.toencode', 'encoding', lambda item, progress: None, '.toconfirm')
+    assert clips.exists()  # still to be reviewed
+    item = r.LoadActionItem(confirming)
+    r.scratch.Reclaim(item, 'confirm')
+    assert not clips.exists() and 'artifacts' not in item
+
+
+def test_scratch_usage_is_read_once_per_stage_and_only_when_limited(tmp_path, monkeypatch):
+    from tstriage import tasks
+    from tstriage.scratch import ScratchStore
+    r = _runner(tmp_path)
+    for name in ('a', 'b', 'c'):
+        r.CreateActionItem({'path': str(r.nas.recorded / f'{name}.ts'), 'destination': str(r.nas.destination / 'show')}, '.toanalyze')
+    reads = []
+    monkeypatch.setattr(r, '_ScratchUsed', lambda: reads.append(1) or 0)
+    monkeypatch.setattr(tasks, 'Analyze', lambda item, **kwargs: None)
+    r.Analyze()
+    assert not reads  # no Scratch limits
+    for path in r.nas.ActionItems('.tomark'):
+        path.rename(path.with_suffix('.toanalyze'))
+    r.scratch = ScratchStore(r.nas.tstriageFolder, budget=1e9)
+    r.Analyze()
+    assert len(reads) == 1 and len(list(r.nas.ActionItems('.tomark'))) == 3
+
+
+def test_child_killed_by_ctrl_c_puts_the_item_back(tmp_path, monkeypatch):
+    import os, signal, threading
+    import pytest
+    r = _runner(tmp_path)
+    path = _item(r, 'show')
+
+    def work(item, progress):
+        # The child dies of the SIGINT before the main thread has handled it.
+        threading.Timer(0.1, r._interrupted.set).start()
+        raise RuntimeError('Command failed: ffmpeg exited with 255')
+
+    with pytest.raises(KeyboardInterrupt):
+        r._ProcessItem(None, path, '.toencode', 'encoding', work, '.toconfirm')
+    assert path.exists() and not r.failed
+
+    if os.name != 'nt':
+        handler = signal.getsignal(signal.SIGINT)
+        monkeypatch.setattr(r, '_RunTask', lambda task: os.kill(os.getpid(), signal.SIGINT))
+        r.Run(['encode'])  # a new run starts uninterrupted, Ctrl+C sets the flag at once
+        assert r._interrupted.is_set() and signal.getsignal(signal.SIGINT) is handler
+        r.Run([])
+        assert not r._interrupted.is_set()
+
+
+def test_history_failure_does_not_fail_the_item(tmp_path):
+    r = _runner(tmp_path)
+
+    class _BrokenHistory:
+        def AddStage(self, **kwargs):
+            raise RuntimeError('database is locked')
+
+    r.history = _BrokenHistory()
+    assert r._ProcessItem(None, _item(r, 'show'), '.toencode', 'encoding', lambda item, progress: None, '.toconfirm').name == 'show.toconfirm'
+    assert not r.failed
+
+
+def test_permanent_os_errors_are_not_retried(tmp_path):
+    import errno
+    r = _runner(tmp_path, retries=3)
+    calls = []
+
+    def missing(item, progress):
+        calls.append(1)
+        raise FileNotFoundError(errno.ENOENT, 'No such file', item['path'])
+
+    assert r._ProcessItem(None, _item(r, 'show'), '.toencode', 'encoding', missing, '.toconfirm') is None
+    assert len(calls) == 1
+
+    calls.clear()
+
+    def stale(item, progress):
+        calls.append(1)
+        if len(calls) < 2:
+            raise OSError(errno.ESTALE, 'Stale file handle')
+
+    assert r._ProcessItem(None, _item(r, 'other'), '.toencode', 'encoding', stale, '.toconfirm') is not None
+    assert len(calls) == 2
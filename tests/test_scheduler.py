@@ -0,0 +1,68 @@
+import threading, time
+from pathlib import Path
+from tstriage.scheduler import EncoderScheduler, EncoderSlots, EncodeJob
+
+
+def _jobs(*estimates):
+    return [EncodeJob(path=Path(f'{i}.toencode'), item={}, estimate=e) for i, e in enumerate(estimates)]
+
+
+def test_from_config_defaults_to_single_encoder():
+    scheduler = EncoderScheduler.FromConfig({'Encoder': 'h264_nvenc'})
+    assert [e.encoder for e in scheduler.encoders] == ['h264_nvenc']
+    assert scheduler.maxJobs == 1
+
+
+def test_from_config_slots_and_threads():
+    scheduler = EncoderScheduler.FromConfig({
+        'Encoder': 'h264_nvenc',
+        'Scheduler': {'maxJobs': 2, 'encoders': {'h264_nvenc': {'slots': 1}, 'libx264': {'slots': 2, 'threads': 16}}},
+    })
+    assert scheduler.maxJobs == 2
+    assert scheduler.encoders[1] == EncoderSlots('libx264', slots=2, threads=16)
+
+
+def test_longest_first():
+    scheduler = EncoderScheduler([EncoderSlots('libx264')])
+    order = []
+    scheduler.Run(_jobs(10, 30, 20), lambda job, slot: order.append(job.estimate))
+    assert order == [30, 20, 10]
+
+
+def test_slot_limits():
+    scheduler = EncoderScheduler([EncoderSlots('h264_nvenc', slots=1), EncoderSlots('libx264', slots=2)], maxJobs=2)
+    lock = threading.Lock()
+    running: dict[str, int] = {}
+    peak = {'total': 0, 'h264_nvenc': 0}
+
+    def work(job, slot):
+        with lock:
+            running[slot.encoder] = running.get(slot.encoder, 0) + 1
+            peak['total'] = max(peak['total'], sum(running.values()))
+            peak['h264_nvenc'] = max(peak['h264_nvenc'], running.get('h264_nvenc', 0))
+        time.sleep(0.02)
+        with lock:
+            running[slot.encoder] -= 1
+
+    scheduler.Run(_jobs(*range(8)), work)
+    assert peak['total'] == 2
+    assert peak['h264_nvenc'] == 1
+
+
+def test_failure_stops_admission():
+    scheduler = EncoderScheduler([EncoderSlots('libx264', slots=2)])
+    started = []
+
+    def work(job, slot):
+        started.append(job.estimate)
+        if job.estimate == 5:
+            raise RuntimeError('boom')
+        time.sleep(0.05)
+
+    try:
+        scheduler.Run(_jobs(5, 4, 3, 2, 1), work)
+    except RuntimeError:
+        pass
+    else:
+        assert False, 'expected RuntimeError'
+    assert len(started) < 5
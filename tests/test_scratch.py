@@ -0,0 +1,26 @@
+from tstriage.scratch import ScratchStore
+
+
+def test_track_and_reclaim(tmp_path):
+    store = ScratchStore(tmp_path)
+    folder, file = tmp_path / 'show', tmp_path / 'show.tmp'
+    folder.mkdir()
+    (folder / 'a.ts').write_bytes(b'x' * 300)
+    file.write_bytes(b'x' * 200)
+    item = {}
+    store.Track(item, folder, until='confirm')
+    store.Track(item, file, until='cut')
+    assert ScratchStore.Used([item]) == 500
+
+    assert store.Reclaim(item, 'mark') == 0
+    assert store.Reclaim(item, 'encode') == 200  # cut is done
+    assert folder.exists() and not file.exists()
+    assert [a['path'] for a in item['artifacts']] == ['show']
+    assert store.Reclaim(item, 'confirm') == 300
+    assert not folder.exists() and 'artifacts' not in item
+
+
+def test_pressure(tmp_path):
+    assert ScratchStore(tmp_path).Pressure(10**12) is None
+    assert ScratchStore(tmp_path, budget=1e9).Pressure(10**9).startswith('intermediates take 1.0 GB')
+    assert ScratchStore(tmp_path, reserve=1e18).Pressure(0).endswith(f'free in {tmp_path}')
@@ -0,0 +1,42 @@
+import pysubs2
+from tstriage.segments import MergeSubtitles, PlanSegments, Segment, SegmentManifest
+
+
+def test_plan_segments_cuts_at_points():
+    points = [0.0, 100.0, 250.0, 400.0, 500.0, 700.0, 900.0, 1000.0]
+    clips = [[0.0, 400.0], [500.0, 1000.0]]
+    segments = PlanSegments(clips, points, 300)
+    assert segments == [[[0.0, 400.0]], [[500.0, 900.0]], [[900.0, 1000.0]]]
+    # every second is encoded exactly once
+    assert sum(e - s for seg in segments for s, e in seg) == sum(e - s for s, e in clips)
+    assert PlanSegments(clips, points, 10000) == [clips]
+
+
+def test_manifest_resume(tmp_path):
+    plan = SegmentManifest(output='show.mkv', preset='drama', encoder='libx264',
+                           segments=[Segment([[0.0, 400.0]]), Segment([[500.0, 1000.0]])], settings='abc')
+    path = SegmentManifest.PathFor(tmp_path, tmp_path / 'show.mkv')
+    plan.segments[0].done = True
+    plan.Save(path)
+    loaded = SegmentManifest.Load(path)
+    assert loaded == plan
+    fresh = SegmentManifest(output='show.mkv', preset='drama', encoder='libx264',
+                            segments=[Segment([[0.0, 400.0]]), Segment([[500.0, 1000.0]])], settings='abc')
+    assert loaded.Resumes(fresh)
+    fresh.preset = 'anime'
+    assert not loaded.Resumes(fresh)
+    fresh.preset = 'drama'
+    fresh.settings = 'changed'  # e.g. fixaudio or crop set since the parts were encoded
+    assert not loaded.Resumes(fresh)
+
+
+def test_merge_subtitles(tmp_path):
+    parts = [tmp_path / '000.mkv', tmp_path / '001.mkv', tmp_path / '002.mkv']
+    for part, text in ((parts[0], 'one'), (parts[2], 'three')):
+        subs = pysubs2.SSAFile()
+        subs.append(pysubs2.SSAEvent(start=1000, end=2000, text=text))
+        subs.save(str(part.with_suffix('.srt')))
+    MergeSubtitles(parts, [60.0, 30.0, 10.0], tmp_path / 'show')
+    merged = pysubs2.load(str(tmp_path / 'show.srt'))
+    assert [(e.start, e.text) for e in merged] == [(1000, 'one'), (91000, 'three')]
+    assert not (tmp_path / 'show.ass').exists()
@@ -0,0 +1,56 @@
+import json
+from tstriage.series import SeriesProfile
+
+# 30-minute episode: opening, CM, part A, CM, part B, CM
+LAYOUT = [(0.0, 90.0, True), (90.0, 150.0, False), (150.0, 900.0, True), (900.0, 990.0, False),
+          (990.0, 1740.0, True), (1740.0, 1800.0, False)]
+
+
+def _markermap(logo=None, subtitles=None, truth=True) -> dict:
+    markermap = {}
+    for i, (start, end, program) in enumerate(LAYOUT):
+        markers = {'logo': float(program if logo is None else logo[i]),
+                   'subtitles': float(program if subtitles is None else subtitles[i])}
+        if truth:
+            markers['_groundtruth'] = float(program)
+        markermap[json.dumps([start, end])] = markers
+    return markermap
+
+
+def _profile(tmp_path) -> SeriesProfile:
+    metadata = tmp_path / '_metadata'
+    metadata.mkdir()
+    for i in range(3):
+        # subtitles miss the opening in every episode; the logo is always right
+        with (metadata / f'ep{i}.markermap').open('w') as f:
+            json.dump(_markermap(subtitles=[0, 0, 1, 0, 1, 0]), f)
+    with (metadata / 'unconfirmed.markermap').open('w') as f:
+        json.dump(_markermap(truth=False), f)
+    profile = SeriesProfile.Learn(metadata)
+    profile.Save(SeriesProfile.PathFor(tmp_path))
+    return SeriesProfile.Load(SeriesProfile.PathFor(tmp_path))
+
+
+def test_learn(tmp_path):
+    profile = _profile(tmp_path)
+    assert profile.episodes == 3
+    assert profile.Best() == 'logo'
+    assert profile.accuracy['subtitles'] == 0.95
+    assert profile.cmBreaks == [3, 3] and profile.cmLength == [60.0, 90.0]
+
+
+def test_episode_fitting_the_profile_skips_speech(tmp_path):
+    profile = _profile(tmp_path)
+    markermap = _markermap(truth=False, subtitles=[0, 0, 1, 0, 1, 0])
+    assert profile.Disagreement(markermap) is None
+    assert profile.Apply(markermap) == 'logo'
+    assert [m['_ensemble'] for m in markermap.values()] == [1.0, 0.0, 1.0, 0.0, 1.0, 0.0]
+
+
+def test_episode_off_the_profile_needs_speech(tmp_path):
+    profile = _profile(tmp_path)
+    assert 'program share' in profile.Disagreement(_markermap(truth=False, logo=[1, 1, 1, 1, 1, 0]))
+    assert 'CM breaks' in profile.Disagreement(_markermap(truth=False, logo=[1, 0, 1, 1, 1, 0]))
+    wide = SeriesProfile(episodes=3, accuracy={'logo': 1.0}, programRatio=[0.5, 0.95], cmBreaks=[3, 3], cmLength=[60.0, 90.0])
+    assert 'CM breaks of 150' in wide.Disagreement(_markermap(truth=False, logo=[0, 0, 1, 0, 1, 0]))
+    assert SeriesProfile(episodes=1).Disagreement(_markermap()) is not None
@@ -0,0 +1,51 @@
+import os, subprocess
+from tstriage import cli_config
+from tstriage.stamps import StageStamp
+
+
+def _stamp(tmp_path, settings, tools=('tsmarker',)):
+    return StageStamp(tmp_path, tmp_path / 'show.ts', 'cut', [tmp_path / 'show.ts'], settings, tools)
+
+
+def test_stage_stamp(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_config, 'tool_version', lambda tool: f'{tool} 1.0')
+    (tmp_path / '_metadata').mkdir()
+    source, output = tmp_path / 'show.ts', tmp_path / 'show.clips'
+    source.write_bytes(b'ts')
+    output.write_text('{}')
+
+    assert _stamp(tmp_path, {'split': 1}).Current() is None  # never run
+    _stamp(tmp_path, {'split': 1}).Record([output], {'fixaudio': True})
+    assert (tmp_path / '_metadata' / 'show.cut.stamp').exists()
+    assert _stamp(tmp_path, {'split': 1}).Current() == {'fixaudio': True}
+
+    assert _stamp(tmp_path, {'split': 2}).Current() is None  # settings changed
+    monkeypatch.setattr(cli_config, 'tool_version', lambda tool: f'{tool} 2.0')
+    assert _stamp(tmp_path, {'split': 1}).Current() is None  # tool upgraded
+    monkeypatch.setattr(cli_config, 'tool_version', lambda tool: f'{tool} 1.0')
+
+    st = source.stat()
+    os.utime(source, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert _stamp(tmp_path, {'split': 1}).Current() is None  # input touched
+    _stamp(tmp_path, {'split': 1}).Record([output])
+    assert _stamp(tmp_path, {'split': 1}).Current() == {}
+
+    output.unlink()
+    assert _stamp(tmp_path, {'split': 1}).Current() is None  # output gone
+
+
+def test_tool_versions_are_asked_once(tmp_path, monkeypatch):
+    calls = []
+
+    def run(cmd, **kwargs):
+        calls.append(cmd)
+        return subprocess.CompletedProcess(cmd, 0, stdout='tsmarker 1.0\n', stderr='')
+
+    monkeypatch.setattr(cli_config.subprocess, 'run', run)
+    cli_config.configure(tsmarker='tsmarker')
+    try:
+        for _ in range(3):
+            _stamp(tmp_path, {'split': 1})
+        assert calls == [['tsmarker', '--version']]
+    finally:
+        cli_config.tool_version.cache_clear()
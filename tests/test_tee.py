@@ -0,0 +1,25 @@
+import hashlib, io, subprocess, sys
+import pytest
+from tstriage.tee import Tee
+
+
+def _consumer(code: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, '-c', code], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+
+@pytest.mark.parametrize('threaded', [False, True])
+def test_fanout_with_early_exit(threaded):
+    data = bytes(range(256)) * 40000  # ~10 MB
+    full = _consumer('import sys, hashlib; print(hashlib.md5(sys.stdin.buffer.read()).hexdigest())')
+    head = _consumer('import sys; sys.stdin.buffer.read(1000)')
+    Tee(full.stdin, head.stdin, broken_ok={head.stdin: None}, threaded=threaded).pump(io.BytesIO(data), buf_size=65536)
+    assert full.stdout.read().decode().strip() == hashlib.md5(data).hexdigest()
+    full.wait()
+    head.wait()
+
+
+def test_required_pipe_failure_raises():
+    dead = _consumer('import sys; sys.stdin.buffer.read(10)')
+    with pytest.raises(OSError):
+        Tee(dead.stdin, threaded=True).pump(io.BytesIO(b'x' * 50_000_000), buf_size=65536)
+    dead.wait()
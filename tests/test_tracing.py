@@ -0,0 +1,29 @@
+import json, sys
+from tstriage import tracing
+from tstriage.subprocess_utils import run_process
+
+
+def test_subprocess_span_nests_and_exports(tmp_path, monkeypatch):
+    monkeypatch.setattr(tracing, '_enabled', True)
+    monkeypatch.setattr(tracing, '_finished', [])
+    with tracing.span('item', item='show') as item:
+        run_process([sys.executable, '-c', 'import sys; sys.exit(3)'])
+    path = tracing.export(tmp_path)
+    spans = json.loads(path.read_text())['resourceSpans'][0]['scopeSpans'][0]['spans']
+    child = next(s for s in spans if s['name'] == 'subprocess')
+    parent = next(s for s in spans if s['name'] == 'item')
+    assert parent['spanId'] == item.span_id
+    assert child['parentSpanId'] == item.span_id and child['traceId'] == item.trace_id
+    attributes = {a['key']: a['value'] for a in child['attributes']}
+    assert attributes['exit_code'] == {'intValue': '3'}
+    assert 'peak_rss' in attributes and sys.executable in attributes['command']['stringValue']
+    assert child['status'] == {'code': 2, 'message': 'exit code 3'}
+
+
+def test_children_are_not_sampled_without_tracing(monkeypatch):
+    from tstriage import procstats
+    monkeypatch.setattr(tracing, '_enabled', False)
+    watched = []
+    monkeypatch.setattr(procstats.Meter, 'watch', staticmethod(lambda pid: watched.append(pid)))
+    assert run_process([sys.executable, '-c', 'pass']).returncode == 0
+    assert not watched
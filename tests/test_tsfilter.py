@@ -0,0 +1,64 @@
+import pytest
+np = pytest.importorskip('numpy')
+from tstriage.tsfilter import FilteredPipe, PidFilter, crc32_mpeg
+
+PMT_PID, VIDEO_PID, AUDIO_PID, CAPTION_PID, PCR_PID, EIT_PID = 0x1F0, 0x100, 0x110, 0x130, 0x1FF, 0x12
+
+
+def _packet(pid: int, payload: bytes, cc: int = 0, start: bool = False) -> bytes:
+    header = bytes([0x47, (0x40 if start else 0) | (pid >> 8), pid & 0xFF, 0x10 | (cc & 0x0F)])
+    return (header + payload + b'\xff' * 184)[:188]
+
+
+def _section(table_id: int, body: bytes) -> bytes:
+    head = bytes([table_id, 0xB0 | ((len(body) + 4) >> 8), (len(body) + 4) & 0xFF])
+    return head + body + crc32_mpeg(head + body).to_bytes(4, 'big')
+
+
+def _pat() -> bytes:
+    body = bytes([0x7F, 0xE1, 0xC1, 0x00, 0x00]) + bytes([0x00, 0x00, 0xE0, 0x10]) + bytes([0x04, 0x00, 0xE0 | (PMT_PID >> 8), PMT_PID & 0xFF])
+    return _packet(0, b'\x00' + _section(0x00, body), start=True)
+
+
+def _es(stream_type: int, pid: int, descriptors: bytes = b'') -> bytes:
+    return bytes([stream_type, 0xE0 | (pid >> 8), pid & 0xFF, 0xF0, len(descriptors)]) + descriptors
+
+
+def _pmt() -> bytes:
+    body = bytes([0x04, 0x00, 0xC1, 0x00, 0x00, 0xE0 | (PCR_PID >> 8), PCR_PID & 0xFF, 0xF0, 0x00])
+    body += _es(0x02, VIDEO_PID) + _es(0x0F, AUDIO_PID, b'\x52\x01\x10') + _es(0x06, CAPTION_PID, b'\x52\x01\x30')
+    return _packet(PMT_PID, b'\x00' + _section(0x02, body), start=True)
+
+
+def _stream() -> bytes:
+    out = _pat() + _pmt()
+    for i in range(50):
+        out += _packet(VIDEO_PID, bytes([i]) * 184, cc=i) + _packet(EIT_PID, b'\x00' * 184, cc=i)
+        out += _packet(AUDIO_PID, bytes([i]) * 184, cc=i) + _packet(CAPTION_PID, b'\x01' * 184, cc=i)
+        out += _packet(PCR_PID, b'', cc=i) + _packet(0x1FFF, b'', cc=i)
+    return out
+
+
+def _pids(data: bytes) -> list[int]:
+    return [((data[i + 1] & 0x1F) << 8) | data[i + 2] for i in range(0, len(data), 188)]
+
+
+def test_filter_keeps_av_and_rewrites_pmt():
+    out, sink = [], type('Sink', (), {'write': lambda self, d: out.append(d), 'close': lambda self: None})()
+    pipe = FilteredPipe(sink, PidFilter())
+    data = _stream()
+    for i in range(0, len(data), 1000):  # chunks that split packets
+        pipe.write(data[i:i + 1000])
+    pipe.close()
+    filtered = b''.join(out)
+    assert len(filtered) % 188 == 0
+    assert set(_pids(filtered)) == {0, PMT_PID, VIDEO_PID, AUDIO_PID, PCR_PID}
+    pmt = filtered[188:376]
+    length = ((pmt[6] & 0x0F) << 8) | pmt[7]
+    section = pmt[5:8 + length]
+    assert crc32_mpeg(section[:-4]) == int.from_bytes(section[-4:], 'big')
+    assert section[12:] .find(bytes([0x06, 0xE0 | (CAPTION_PID >> 8), CAPTION_PID & 0xFF])) == -1
+    pat = filtered[:188]
+    assert ((pat[6] & 0x0F) << 8 | pat[7]) == 5 + 4 + 4  # only the program entry is left
+    # video payload passes through untouched
+    assert filtered[2 * 188:3 * 188] == data[2 * 188:3 * 188]
@@ -1,8 +1,14 @@
-from importlib.metadata import version as _version
+def __getattr__(name):
+    # Looked up on first use: importlib.metadata alone costs tens of ms at startup.
+    if name != '__version__':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from importlib.metadata import version as _version
 
-try:
-    __version__ = _version("tstriage")
-except Exception:
-    import os
+    try:
+        value = _version("tstriage")
+    except Exception:
+        import os
 
-    __version__ = f"0.1.{os.getenv('BUILD_NUMBER', '0')}"
+        value = f"0.1.{os.getenv('BUILD_NUMBER', '0')}"
+    globals()['__version__'] = value
+    return value
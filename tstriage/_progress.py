@@ -12,9 +12,16 @@ import json, sys, time, logging
 from rich.progress import Progress as RichProgress, TaskID, ProgressColumn
 from rich.text import Text
 from rich import filesize as _filesize
+from .metrics import LAST_PROGRESS, SUBPROCESS_PROGRESS
 
 logger = logging.getLogger('tstriage.progress')
 
+# Progress updates are coalesced to at most one per task per interval on both
+# sides of the pipe: children emit fewer PROGRESS lines, and the parent touches
+# Rich and the metrics registry (both behind locks) less often, so the stderr
+# reader thread never stalls a chatty child.
+UPDATE_INTERVAL = 0.2
+
 
 class _UnitColumn(ProgressColumn):
     """Progress column that formats completed/total according to unit."""
@@ -41,11 +48,13 @@ class SubprocessProgress:
     Non-TTY mode (Jenkins): emits periodic plain-text progress lines.
     """
 
-    def __init__(self, progress: RichProgress | None = None, ctx: str = ""):
+    def __init__(self, progress: RichProgress | None = None, ctx: str = "", stage: str = ""):
         self.ctx = ctx
+        self.stage = stage
         self._tasks: dict[str, dict] = {}
         self._is_tty = sys.stderr.isatty()
         self._stderr: list[str] = []
+        self._failed_stderr: list[str] = []
         self._status_task = None
         self._last_log_ctx = ""
         # In non-TTY mode (Jenkins), use text fallback even if RichProgress is passed
@@ -71,20 +80,13 @@ class SubprocessProgress:
         info = self._tasks.get(task_id)
         if info is None:
             return
-        if self.progress is not None:
-            self.progress.update(info["rich_id"], completed=n)
-        else:
-            elapsed = time.time() - info["last_log_time"]
-            if elapsed >= 60:
-                pct = n / info["total"] * 100
-                self._log(f'{info["desc"]}: {n:.1f}/{info["total"]:.1f} ({pct:.0f}%)')
-                info["last_log_time"] = time.time()
-                info["last_log_n"] = n
+        self._push(info, n)
 
     def done(self, task_id: str):
         info = self._tasks.get(task_id)
         if info is None:
             return
+        SUBPROCESS_PROGRESS.remove(item=self.ctx, task=info["desc"])
         if self.progress is not None:
             self.progress.update(info["rich_id"], visible=False)
         else:
@@ -122,8 +124,18 @@ class SubprocessProgress:
         """Output collected stderr lines (call on command failure)."""
         for line in self._stderr:
             sys.stderr.write(line + '\n')
+        self._failed_stderr = list(self._stderr)
         self._stderr.clear()
 
+    def stderr_tail(self, lines: int = 50) -> list[str]:
+        """Last stderr lines of the command that failed (or of the one still running)."""
+        return (self._stderr or self._failed_stderr)[-lines:]
+
+    def _export(self, info: dict, n: float):
+        if info["total"]:
+            SUBPROCESS_PROGRESS.set(n / info["total"], item=self.ctx, task=info["desc"])
+        LAST_PROGRESS.set(time.time(), stage=self.stage)
+
     def _register(self, tid: str, data: dict) -> dict:
         info = {
             "desc": data.get("desc", tid),
@@ -141,6 +153,7 @@ class SubprocessProgress:
     def _update(self, tid: str, data: dict):
         info = self._tasks[tid]
         if data.get("status") == "done":
+            SUBPROCESS_PROGRESS.remove(item=self.ctx, task=info["desc"])
             if self.progress is not None:
                 self.progress.update(info["rich_id"], completed=info["total"],
                                      visible=False)
@@ -149,7 +162,14 @@ class SubprocessProgress:
             return
         if "n" not in data:
             return
-        n = data["n"]
+        self._push(info, data["n"])
+
+    def _push(self, info: dict, n: float):
+        now = time.monotonic()
+        if now - info.get("last_push", 0.0) < UPDATE_INTERVAL and n < (info["total"] or 0):
+            return
+        info["last_push"] = now
+        self._export(info, n)
         if self.progress is not None:
             self.progress.update(info["rich_id"], completed=n)
         else:
@@ -172,17 +192,24 @@ class Progress:
         self.use_protocol = use_protocol
         self._rich: RichProgress | None = None
         self._tasks: dict[str, int] = {}
+        self._totals: dict[str, float] = {}
+        self._last_emit: dict[str, float] = {}
         if not use_protocol:
             self._rich = RichProgress().__enter__()
 
     def add_task(self, task_id: str, total: float, desc: str, unit: str = "it"):
         if self.use_protocol:
+            self._totals[task_id] = total
             self._emit({"task": task_id, "total": total, "desc": desc, "unit": unit})
         elif self._rich is not None:
             self._tasks[task_id] = self._rich.add_task(desc, total=total)
 
     def update(self, task_id: str, n: float):
         if self.use_protocol:
+            now = time.monotonic()
+            if now - self._last_emit.get(task_id, 0.0) < UPDATE_INTERVAL and n < self._totals.get(task_id, n + 1):
+                return
+            self._last_emit[task_id] = now
             self._emit({"task": task_id, "n": n})
         elif self._rich is not None:
             self._rich.update(self._tasks[task_id], completed=n)
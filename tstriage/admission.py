@@ -0,0 +1,168 @@
+"""Admission control: hold stage jobs back while the box is busy or recording.
+
+With an `Admission` section, every item of Analyze, Mark, Cut and Encode
+waits before it is claimed until the host has room for it:
+
+  cpu        system-wide CPU use below this percentage
+  memory     memory use below this percentage
+  diskIO     disk reads plus writes below this many MB/s
+  freeSpace  at least this many GB free in Destination
+  recordings no EPGStation reservation recording now or starting within
+             `margin` seconds (nor ended less than `margin` seconds ago)
+
+Load is sampled over one second. Items that are already running are not
+paused. Child processes of each stage run at the stage's `nice` level and
+`ionice` class, so that when jobs do run, live recording comes first.
+"""
+
+import contextlib, contextvars, logging, os, shutil, threading, time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+import psutil
+
+logger = logging.getLogger('tstriage.admission')
+
+SAMPLE_INTERVAL = 1.0   # seconds of load sampled per check
+RESERVES_TTL = 300.0    # seconds between EPGStation reservation fetches
+
+# nice level and ionice class of the child processes of each stage
+DEFAULT_PRIORITY = {
+    'analyze': (15, 'idle'),
+    'mark': (15, 'idle'),
+    'cut': (10, 'best-effort'),
+    'encode': (5, 'best-effort'),
+}
+
+_priority: contextvars.ContextVar[Optional[tuple[int, str]]] = contextvars.ContextVar('tstriage_priority', default=None)
+
+
+@dataclass
+class Load:
+    cpu: float          # percent
+    memory: float       # percent
+    diskIO: float       # MB/s, reads + writes
+    freeSpace: float    # GB free in Destination
+
+
+@contextlib.contextmanager
+def priority(niceness: Optional[tuple[int, str]]):
+    """Run the children started in this context at (nice level, ionice class)."""
+    token = _priority.set(niceness)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def apply(pid: int):
+    """Lower the priority of a newly started child to that of the current context, if any."""
+    niceness = _priority.get()
+    if niceness is None:
+        return
+    level, ioclass = niceness
+    try:
+        process = psutil.Process(pid)
+        if os.name == 'nt':
+            process.nice(psutil.IDLE_PRIORITY_CLASS if level >= 15 else psutil.BELOW_NORMAL_PRIORITY_CLASS if level > 0 else psutil.NORMAL_PRIORITY_CLASS)
+            process.ionice(psutil.IOPRIO_VERYLOW if ioclass == 'idle' else psutil.IOPRIO_NORMAL)
+        else:
+            process.nice(level)
+            if hasattr(process, 'ionice'):  # Linux only
+                process.ionice(psutil.IOPRIO_CLASS_IDLE if ioclass == 'idle' else psutil.IOPRIO_CLASS_BE)
+    except (psutil.Error, OSError, ValueError) as e:
+        logger.debug(f'could not lower the priority of {pid}: {e}')
+
+
+class Admission:
+    """Decides when stage jobs may start, and at which priority their children run."""
+
+    def __init__(self, destination: Path, cpu: float = 0, memory: float = 0, diskIO: float = 0, freeSpace: float = 0,
+                 epgStation=None, margin: float = 120, poll: float = 30, priorities: Optional[dict] = None):
+        self.destination = Path(destination)
+        self.cpu, self.memory, self.diskIO, self.freeSpace = cpu, memory, diskIO, freeSpace
+        self.epgStation = epgStation
+        self.margin = margin
+        self.poll = poll
+        self.priorities = {**DEFAULT_PRIORITY, **(priorities or {})}
+        self._windows: list[tuple[float, float, str]] = []
+        self._fetched: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def FromConfig(configuration: dict, epgStation) -> Optional['Admission']:
+        options = configuration.get('Admission')
+        if options is None:
+            return None
+        options = options or {}
+        priorities = {}
+        for stage, (level, ioclass) in DEFAULT_PRIORITY.items():
+            priorities[stage] = (int((options.get('nice') or {}).get(stage, level)),
+                                 str((options.get('ionice') or {}).get(stage, ioclass)))
+        return Admission(
+            Path(configuration['Destination']).expanduser(),
+            cpu=float(options.get('cpu', 0)), memory=float(options.get('memory', 0)),
+            diskIO=float(options.get('diskIO', 0)), freeSpace=float(options.get('freeSpace', 0)),
+            epgStation=epgStation if options.get('recordings', False) else None,
+            margin=float(options.get('margin', 120)), poll=float(options.get('poll', 30)),
+            priorities=priorities)
+
+    def Priority(self, stage: str) -> Optional[tuple[int, str]]:
+        return self.priorities.get(stage)
+
+    def Sample(self) -> Load:
+        disk = psutil.disk_io_counters()
+        started = time.monotonic()
+        cpu = psutil.cpu_percent(interval=SAMPLE_INTERVAL)
+        after = psutil.disk_io_counters()
+        diskIO = 0.0
+        if disk is not None and after is not None:
+            moved = after.read_bytes - disk.read_bytes + after.write_bytes - disk.write_bytes
+            diskIO = moved / (time.monotonic() - started) / 1e6
+        try:
+            free = shutil.disk_usage(self.destination).free / 1e9
+        except OSError:
+            free = float('inf')  # unreachable; the stage itself reports it
+        return Load(cpu=cpu, memory=psutil.virtual_memory().percent, diskIO=diskIO, freeSpace=free)
+
+    def Recording(self, now: float) -> Optional[str]:
+        """Name of the EPGStation reservation recording around `now`, if any."""
+        if self.epgStation is None:
+            return None
+        with self._lock:
+            if self._fetched is None or now - self._fetched >= RESERVES_TTL:
+                try:
+                    self._windows = [(r['startAt'] / 1000 - self.margin, r['endAt'] / 1000 + self.margin, r.get('name', str(r.get('id'))))
+                                     for r in self.epgStation.GetReserves() if not r.get('isSkip') and not r.get('isConflict')]
+                    self._fetched = now
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning(f'could not fetch reservations from EPGStation, using the last ones: {e}')
+            windows = self._windows
+        return next((name for start, end, name in windows if start <= now <= end), None)
+
+    def Busy(self, load: Load, now: float) -> Optional[str]:
+        """Why a job should not start now, or None."""
+        recording = self.Recording(now)
+        if recording is not None:
+            return f'recording "{recording}"'
+        if self.cpu and load.cpu >= self.cpu:
+            return f'CPU at {load.cpu:.0f}%'
+        if self.memory and load.memory >= self.memory:
+            return f'memory at {load.memory:.0f}%'
+        if self.diskIO and load.diskIO >= self.diskIO:
+            return f'disk I/O at {load.diskIO:.0f} MB/s'
+        if self.freeSpace and load.freeSpace < self.freeSpace:
+            return f'{load.freeSpace:.1f} GB free in {self.destination}'
+        return None
+
+    def Wait(self, what: str, interrupted: threading.Event):
+        """Block until a job may start; raises KeyboardInterrupt if interrupted meanwhile."""
+        last = None
+        while (reason := self.Busy(self.Sample(), time.time())) is not None:
+            if reason != last:
+                logger.info(f'{what} waits: {reason}')
+                last = reason
+            if interrupted.wait(self.poll):
+                raise KeyboardInterrupt
+        if last is not None:
+            logger.info(f'{what} admitted')
@@ -0,0 +1,455 @@
+"""In-process ARIB STD-B24 caption extractor.
+
+CaptionSink takes the place of the Caption2AssC process on the encode Tee: it
+is written the same concatenated clip stream as the encoder, picks out PAT,
+PMT, the caption PID and the video PES headers, decodes the caption
+statements and writes <name>.ass and <name>.srt with pysubs2 when closed.
+
+Caption times follow the encoder's output clock. Every clip starts where the
+previous one ended, and within a clip captions are placed relative to the
+clip's first video PTS, i.e. the PtsMap clock (see
+docs/subtitle-lessons-2026-04-30.md). Only the first caption language is
+extracted, DRCS (downloaded glyphs) are dropped, and characters Android fonts
+lack are replaced as listed in docs/ass-font-compatibility.md.
+"""
+
+import logging, math, unicodedata
+from pathlib import Path
+from typing import Optional
+import pysubs2
+from .tsfilter import PACKET_SIZE, PAT_PID, SYNC_BYTE, VIDEO_STREAM_TYPES, _payload_offset, _single_section
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency, only speeds up packet selection
+    np = None
+
+logger = logging.getLogger('tstriage.captions')
+
+CAPTION_STREAM_TYPE = 0x06
+CAPTION_COMPONENT_TAGS = {0x30, 0x87}  # main caption (full-seg / one-seg)
+PTS_WRAP = 1 << 33
+_NO_PID = 0x2000  # never matches a 13-bit PID
+
+# Graphic sets by final byte of the designation (ARIB STD-B24 Table 7-3).
+_SETS_1 = {0x4A: 'alnum', 0x36: 'alnum', 0x30: 'hiragana', 0x37: 'hiragana',
+           0x31: 'katakana', 0x38: 'katakana', 0x49: 'jisx0201'}
+_SETS_2 = {0x42: 'kanji', 0x39: 'kanji', 0x3A: 'kanji', 0x3B: 'symbols'}
+_DOUBLE = {'kanji', 'symbols', 'drcs0', 'other2'}
+
+_HIRAGANA = ''.join(map(chr, range(0x3041, 0x3094))) + '　　　ゝゞー。「」、・'
+_KATAKANA = ''.join(map(chr, range(0x30A1, 0x30F7))) + 'ヽヾー。「」、・'
+
+# Additional symbols, row 90 cells 48-84; the rest of rows 90-94 become geta.
+_ROW90 = ['[HV]', '[SD]', '[P]', '[W]', '[MV]', '[手]', '[字]', '[双]', '[デ]', '[S]', '[二]', '[多]', '[解]',
+          '[SS]', '[B]', '[N]', '■', '●', '[天]', '[交]', '[映]', '[無]', '[料]', '[鍵]', '[前]', '[後]',
+          '[再]', '[新]', '[初]', '[終]', '[生]', '[販]', '[声]', '[吹]', '[PPV]', '[秘]', '[ほか]']
+_GETA = '〓'
+
+# Default macros 0x60-0x62: G0-G3, then GL and GR.
+_MACROS = {0x60: (['kanji', 'alnum', 'hiragana', 'macro'], 0, 2),
+           0x61: (['kanji', 'katakana', 'hiragana', 'macro'], 0, 2),
+           0x62: (['kanji', 'drcs1', 'hiragana', 'macro'], 0, 2)}
+
+# Control functions followed by a fixed number of parameter bytes.
+_C1_PARAMS = {0x8B: 1, 0x91: 1, 0x93: 1, 0x94: 1, 0x97: 1, 0x9D: 2}
+
+_ANDROID_SAFE = str.maketrans({'〜': '～', '｡': '。', '｢': '「', '｣': '」', 'ｰ': 'ー', '･': '・',
+                               '♬': '♪', '➡': '→', _GETA: '※'})
+
+
+def _pts(b: bytes) -> int:
+    return ((b[0] >> 1) & 0x07) << 30 | b[1] << 22 | (b[2] >> 1) << 15 | b[3] << 7 | b[4] >> 1
+
+
+def _pes_header(pes: bytes) -> Optional[tuple[Optional[int], int]]:
+    """(PTS or None, payload offset) of a PES packet, or None if it is not one."""
+    if len(pes) < 9 or pes[:3] != b'\x00\x00\x01':
+        return None
+    pts = _pts(pes[9:14]) if pes[7] & 0x80 and len(pes) >= 14 else None
+    return pts, 9 + pes[8]
+
+
+class CaptionDecoder:
+    """ARIB STD-B24 8-bit code, caption profile, to text.
+
+    decode() returns the statement as a list of lines, with None where the
+    screen is cleared (CS).
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.g = ['kanji', 'alnum', 'hiragana', 'macro']
+        self.gl, self.gr = 0, 2
+        self.small = False  # SSZ/MSZ: spaces are half width
+
+    def _char(self, charset: str, c1: int, c2: int) -> str:
+        if charset in ('kanji', 'symbols'):
+            if c1 >= 0x7A or charset == 'symbols':
+                return _ROW90[c2 - 0x50] if c1 == 0x7A and 0x50 <= c2 < 0x50 + len(_ROW90) else _GETA
+            try:
+                return bytes([c1 | 0x80, c2 | 0x80]).decode('euc_jp')
+            except UnicodeDecodeError:
+                return _GETA
+        if charset == 'alnum':
+            return chr(c1)
+        if charset == 'hiragana':
+            return _HIRAGANA[c1 - 0x21]
+        if charset == 'katakana':
+            return _KATAKANA[c1 - 0x21]
+        if charset == 'jisx0201':
+            return unicodedata.normalize('NFKC', chr(0xFF61 + c1 - 0x21)) if c1 <= 0x5F else ''
+        if charset == 'macro' and c1 in _MACROS:
+            g, self.gl, self.gr = _MACROS[c1]
+            self.g = list(g)
+        return ''  # DRCS, mosaic
+
+    def _escape(self, data: bytes, i: int) -> int:
+        b = data[i]
+        if b in (0x6E, 0x6F):  # LS2, LS3
+            self.gl = b - 0x6C
+            return i + 1
+        if b in (0x7C, 0x7D, 0x7E):  # LS3R, LS2R, LS1R
+            self.gr = 0x7F - b
+            return i + 1
+        if 0x28 <= b <= 0x2B:  # 1-byte set to G0-G3
+            if data[i + 1] == 0x20:
+                self.g[b - 0x28] = 'macro' if data[i + 2] == 0x70 else 'drcs1'
+                return i + 3
+            self.g[b - 0x28] = _SETS_1.get(data[i + 1], 'other')
+            return i + 2
+        if b == 0x24:  # 2-byte set
+            if 0x28 <= data[i + 1] <= 0x2B:
+                index = data[i + 1] - 0x28
+                if data[i + 2] == 0x20:
+                    self.g[index] = 'drcs0'
+                    return i + 4
+                self.g[index] = _SETS_2.get(data[i + 2], 'other2')
+                return i + 3
+            self.g[0] = _SETS_2.get(data[i + 1], 'other2')
+            return i + 2
+        return i + 1
+
+    def decode(self, data: bytes) -> list[Optional[str]]:
+        n = len(data)
+        data = bytes(data) + b'\x00' * 4  # parameters of a truncated control code read as NUL
+        out, line = [], []
+
+        def _newline():
+            if line:
+                out.append(''.join(line))
+                line.clear()
+
+        i, single, repeat = 0, None, 1
+        while i < n:
+            b = data[i]
+            i += 1
+            if 0x21 <= b <= 0x7E or 0xA1 <= b <= 0xFE:
+                charset = self.g[single if single is not None else (self.gl if b < 0x80 else self.gr)]
+                single = None
+                c2 = 0
+                if charset in _DOUBLE:
+                    c2 = data[i] & 0x7F
+                    i += 1
+                text = self._char(charset, b & 0x7F, c2)
+                if text:
+                    line.append(text * repeat)
+                repeat = 1
+            elif b in (0x20, 0xA0):
+                line.append((' ' if self.small else '　') * repeat)
+                repeat = 1
+            elif b == 0x0C:  # CS
+                _newline()
+                out.append(None)
+            elif b in (0x0A, 0x0D):  # APD, APR
+                _newline()
+            elif b == 0x1C:  # APS
+                _newline()
+                i += 2
+            elif b == 0x0E:  # LS1
+                self.gl = 1
+            elif b == 0x0F:  # LS0
+                self.gl = 0
+            elif b in (0x19, 0x1D):  # SS2, SS3
+                single = 2 if b == 0x19 else 3
+            elif b == 0x16:  # PAPF
+                i += 1
+            elif b == 0x1B:
+                i = self._escape(data, i)
+            elif b in (0x88, 0x89):  # SSZ, MSZ
+                self.small = True
+            elif b == 0x8A:  # NSZ
+                self.small = False
+            elif b in (0x90, 0x92):  # COL, CDC
+                i += 2 if data[i] == 0x20 else 1
+            elif b == 0x98:  # RPC
+                repeat = max(data[i] - 0x40, 1)
+                i += 1
+            elif b == 0x95:  # MACRO definition, up to MACRO 0x4F
+                end = data.find(b'\x95\x4f', i)
+                i = n if end < 0 else end + 2
+            elif b == 0x9B:  # CSI, up to its final byte
+                while i < n and not 0x40 <= data[i] <= 0x6F:
+                    i += 1
+                i += 1
+            else:
+                i += _C1_PARAMS.get(b, 0)
+        _newline()
+        return out
+
+
+class CaptionSink:
+    """Tee-compatible writer that extracts captions from an MPEG-TS stream.
+
+    clips gives (byte length, duration in seconds) of the clips concatenated
+    in the stream, in order; without it the stream is a single clip.
+
+    Usage:
+        Tee(encode.stdin, CaptionSink(subtitles / name, clips)).pump(reader)
+    """
+
+    def __init__(self, base: str | Path, clips: Optional[list[tuple[int, float]]] = None,
+                 program: Optional[int] = None):
+        self.base = Path(base)
+        self.program = program
+        self.clips = list(clips or [(math.inf, math.inf)])
+        self.pmt_pid: Optional[int] = None
+        self.caption_pid: Optional[int] = None
+        self.video_pid: Optional[int] = None
+        self.events: list[tuple[int, int, str]] = []  # (start ms, end ms, text)
+        self._decoder = CaptionDecoder()
+        self._clip = 0
+        self._clip_end = self.clips[0][0]
+        self._offset = 0.0       # output time of the current clip's start
+        self._base_pts = None    # first video PTS of the current clip
+        self._waiting = []       # caption PES seen before that
+        self._pes: Optional[bytearray] = None
+        self._open: Optional[tuple[int, str]] = None  # caption on screen
+        self._psi: dict[int, bytes] = {}
+        self._pos = 0
+        self._rest = b''
+
+    # --- TS layer ---
+
+    def _rows(self, packets) -> list[int]:
+        """Rows of the packets that matter: PSI, captions, video PES starts."""
+        pmt, caption, video = (p if p is not None else _NO_PID for p in (self.pmt_pid, self.caption_pid, self.video_pid))
+        if np is not None:
+            arr = np.frombuffer(packets, dtype=np.uint8).reshape(-1, PACKET_SIZE)
+            pids = ((arr[:, 1].astype(np.uint16) & 0x1F) << 8) | arr[:, 2]
+            mask = (pids == PAT_PID) | (pids == pmt) | (pids == caption) | ((pids == video) & ((arr[:, 1] & 0x40) != 0))
+            return np.flatnonzero(mask).tolist()
+        rows = []
+        for row in range(len(packets) // PACKET_SIZE):
+            b1 = packets[row * PACKET_SIZE + 1]
+            pid = ((b1 & 0x1F) << 8) | packets[row * PACKET_SIZE + 2]
+            if pid in (PAT_PID, pmt, caption) or pid == video and b1 & 0x40:
+                rows.append(row)
+        return rows
+
+    def _packets(self, packets: memoryview):
+        count = len(packets) // PACKET_SIZE
+        if any(packets[row * PACKET_SIZE] != SYNC_BYTE for row in (0, count - 1)):
+            logger.debug('lost TS packet alignment, skipping a chunk')
+        else:
+            start = 0
+            while start < count:
+                pids = (self.pmt_pid, self.caption_pid, self.video_pid)
+                for row in self._rows(packets[start * PACKET_SIZE:]):
+                    row += start
+                    self._packet(bytes(packets[row * PACKET_SIZE:(row + 1) * PACKET_SIZE]), self._pos + row * PACKET_SIZE)
+                    if (self.pmt_pid, self.caption_pid, self.video_pid) != pids:
+                        start = row + 1  # the PIDs to select have changed
+                        break
+                else:
+                    break
+        self._pos += count * PACKET_SIZE
+        while self._pos >= self._clip_end:
+            self._next_clip()
+
+    def _packet(self, packet: bytes, pos: int):
+        while pos >= self._clip_end:
+            self._next_clip()
+        pid = ((packet[1] & 0x1F) << 8) | packet[2]
+        if pid == PAT_PID or pid == self.pmt_pid:
+            key = packet[:3] + packet[4:]  # CC excluded: PSI repeats every 100 ms
+            if self._psi.get(pid) != key:
+                self._psi[pid] = key
+                if pid == PAT_PID:
+                    self._on_pat(packet)
+                else:
+                    self._on_pmt(packet)
+        elif pid == self.caption_pid:
+            self._on_caption(packet)
+        elif pid == self.video_pid and self._base_pts is None:
+            offset = _payload_offset(packet)
+            header = _pes_header(packet[offset:]) if offset is not None else None
+            if header is not None and header[0] is not None:
+                self._base_pts = header[0]
+                for pts, payload in self._waiting:
+                    self._statement(pts, payload)
+                self._waiting = []
+
+    def _on_pat(self, packet: bytes):
+        parsed = _single_section(packet)
+        if parsed is None or parsed[1][0] != 0x00:
+            return
+        entries = parsed[1][8:-4]
+        for i in range(0, len(entries) - 3, 4):
+            number = int.from_bytes(entries[i:i + 2], 'big')
+            if number != 0 and (self.program is None or number == self.program):
+                self.pmt_pid = int.from_bytes(entries[i + 2:i + 4], 'big') & 0x1FFF
+                return
+
+    def _on_pmt(self, packet: bytes):
+        parsed = _single_section(packet)
+        if parsed is None or parsed[1][0] != 0x02:
+            return
+        section = parsed[1]
+        info_length = int.from_bytes(section[10:12], 'big') & 0x0FFF
+        pos, end = 12 + info_length, len(section) - 4
+        video = caption = None
+        while pos + 5 <= end:
+            stream_type = section[pos]
+            pid = int.from_bytes(section[pos + 1:pos + 3], 'big') & 0x1FFF
+            es_length = int.from_bytes(section[pos + 3:pos + 5], 'big') & 0x0FFF
+            if stream_type in VIDEO_STREAM_TYPES and video is None:
+                video = pid
+            elif stream_type == CAPTION_STREAM_TYPE and caption is None:
+                descriptors, d = section[pos + 5:pos + 5 + es_length], 0
+                while d + 2 < len(descriptors):
+                    if descriptors[d] == 0x52 and descriptors[d + 2] in CAPTION_COMPONENT_TAGS:
+                        caption = pid
+                    d += 2 + descriptors[d + 1]
+            pos += 5 + es_length
+        if (video, caption) != (self.video_pid, self.caption_pid):
+            logger.debug(f'video PID {video}, caption PID {caption}')
+            self.video_pid, self.caption_pid = video, caption
+
+    def _on_caption(self, packet: bytes):
+        offset = _payload_offset(packet)
+        if offset is None or offset >= PACKET_SIZE:
+            return
+        if packet[1] & 0x40:
+            self._flush_pes()
+            self._pes = bytearray(packet[offset:])
+        elif self._pes is not None:
+            self._pes += packet[offset:]
+        if self._pes is not None and len(self._pes) >= 6:
+            length = int.from_bytes(self._pes[4:6], 'big')
+            if length and len(self._pes) >= 6 + length:
+                self._flush_pes()
+
+    def _flush_pes(self):
+        pes, self._pes = self._pes, None
+        header = _pes_header(pes) if pes else None
+        if header is None or header[0] is None:
+            return
+        length = int.from_bytes(pes[4:6], 'big')
+        payload = bytes(pes[header[1]:6 + length] if length else pes[header[1]:])
+        if self._base_pts is None:
+            self._waiting.append((header[0], payload))
+        else:
+            self._statement(header[0], payload)
+
+    def _next_clip(self):
+        self._flush_pes()
+        duration = self.clips[self._clip][1]
+        self._close(round((self._offset + duration) * 1000))
+        if self._waiting:
+            logger.debug(f'{len(self._waiting)} caption(s) before the first video frame of clip {self._clip} dropped')
+        self._offset += duration
+        self._clip += 1
+        self._clip_end += self.clips[self._clip][0] if self._clip < len(self.clips) else math.inf
+        self._base_pts, self._waiting, self._pes = None, [], None
+
+    # --- caption layer ---
+
+    def _time(self, pts: int) -> int:
+        """Output time in ms of a PTS in the current clip."""
+        delta = (pts - self._base_pts) % PTS_WRAP
+        if delta >= PTS_WRAP // 2:
+            delta -= PTS_WRAP
+        seconds = min(max(delta / 90000, 0.0), self.clips[min(self._clip, len(self.clips) - 1)][1])
+        return round((self._offset + seconds) * 1000)
+
+    def _statement(self, pts: int, payload: bytes):
+        try:
+            self._parse_statement(pts, payload)
+        except IndexError:
+            logger.debug(f'truncated caption data at PTS {pts}')
+
+    def _parse_statement(self, pts: int, payload: bytes):
+        # Synchronized PES: data_identifier 0x80, private_stream_id 0xFF, header length
+        if len(payload) < 3 or payload[0] != 0x80 or payload[1] != 0xFF:
+            return
+        group = payload[3 + (payload[2] & 0x0F):]
+        if len(group) < 6 or (group[0] >> 2) & 0x0F != 1:
+            return  # caption management data or another language
+        body = group[5:5 + int.from_bytes(group[3:5], 'big')]
+        pos = 1 + (5 if body[0] >> 6 in (1, 2) else 0)  # TMD, STM
+        end = min(len(body), pos + 3 + int.from_bytes(body[pos:pos + 3], 'big'))
+        pos += 3
+        time = self._time(pts)
+        self._decoder.reset()
+        while pos + 5 <= end and body[pos] == 0x1F:
+            parameter, size = body[pos + 1], int.from_bytes(body[pos + 2:pos + 5], 'big')
+            pos += 5
+            if parameter == 0x20:  # statement body
+                self._show(time, self._decoder.decode(body[pos:min(pos + size, end)]))
+            pos += size
+
+    def _show(self, time: int, tokens: list[Optional[str]]):
+        lines = []
+        for token in tokens:
+            if token is None:
+                self._close(time)
+                lines = []
+            else:
+                lines.append(token)
+        if lines:
+            self._close(time)
+            self._open = (time, '\n'.join(lines))
+
+    def _close(self, time: int):
+        if self._open is not None:
+            start, text = self._open
+            if time > start:
+                self.events.append((start, time, text))
+            self._open = None
+
+    # --- file object ---
+
+    def write(self, data):
+        view = memoryview(data).cast('B')
+        if self._rest:
+            need = PACKET_SIZE - len(self._rest)
+            self._rest += bytes(view[:need])
+            view = view[need:]
+            if len(self._rest) < PACKET_SIZE:
+                return
+            self._packets(memoryview(self._rest))
+            self._rest = b''
+        n = len(view) // PACKET_SIZE * PACKET_SIZE
+        if n:
+            self._packets(view[:n])
+        self._rest = bytes(view[n:])
+
+    def close(self):
+        self._flush_pes()
+        if self._open is not None:
+            end = self._offset + self.clips[self._clip][1] if self._clip < len(self.clips) else self._offset
+            self._close(round(end * 1000) if math.isfinite(end) else self._open[0] + 5000)
+        if not self.events:
+            logger.info(f'No captions in {self.base.name}')
+            return
+        subs = pysubs2.SSAFile()
+        for style in subs.styles.values():
+            style.backcolor = pysubs2.Color(0, 0, 0, 128)
+        for start, end, text in self.events:
+            subs.append(pysubs2.SSAEvent(start=start, end=end, text=text.translate(_ANDROID_SAFE).replace('\n', r'\N')))
+        for suffix in ('.ass', '.srt'):
+            subs.save(str(self.base.parent / (self.base.name + suffix)), encoding='utf-8')
+        logger.info(f'{len(self.events)} captions written: {self.base.name}')
@@ -0,0 +1,227 @@
+"""The tstriage command line.
+
+Only click and the package metadata are imported here; each command imports
+what it needs when it runs (the stage code behind `encode` pulls in ffmpeg,
+pysubs2 and numpy), so `tstriage --help`, `--version`, `list` or `stats`
+start quickly from cron and Jenkins. tests/test_import_time.py keeps it so.
+"""
+
+import logging, os, sys, time
+from functools import cache
+from pathlib import Path
+import click
+
+logger = logging.getLogger('tstriage.cli')
+
+# Columns of the History stages table that `stats` can group by.
+STAGE_GROUPS = ('stage', 'channel', 'preset', 'host', 'versions')
+
+
+@cache
+def get_console():
+    """The Rich console shared by logging and progress panels."""
+    from rich.console import Console
+    return Console(width=None if sys.stderr.isatty() else sys.maxsize)
+
+
+def _expand_env_vars(obj):
+    """Recursively expand environment variables in configuration values.
+
+    Supports both ${VAR_NAME} and $VAR_NAME syntax.
+    """
+    if isinstance(obj, dict):
+        return {k: _expand_env_vars(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [_expand_env_vars(v) for v in obj]
+    elif isinstance(obj, str):
+        # Expand environment variables in string
+        return os.path.expandvars(obj)
+    else:
+        return obj
+
+def _inject_env_vars(configuration):
+    """Inject environment variables from configuration.
+
+    Looks for 'Environment', 'Env', or 'environment' section in configuration
+    and sets those key-value pairs as environment variables.
+    """
+    # Try different possible keys for environment section
+    env_section = None
+    for key in ['Environment', 'Env', 'environment', 'env']:
+        if key in configuration:
+            env_section = configuration[key]
+            break
+
+    if env_section and isinstance(env_section, dict):
+        for key, value in env_section.items():
+            if isinstance(value, (str, int, float, bool)):
+                # Convert to string for environment variable
+                os.environ[key] = str(value)
+                logger.info(f'Set environment variable: {key}')
+            elif value is None:
+                # Remove environment variable if value is None
+                if key in os.environ:
+                    del os.environ[key]
+                    logger.info(f'Removed environment variable: {key}')
+
+def _print_version(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+    from . import __version__
+    click.echo(f'tstriage {__version__}')
+    ctx.exit()
+
+
+@click.group(context_settings={'help_option_names': ['-h', '--help']})
+@click.option('--config', '-c', default='tstriage.config.yml', show_default=True, help='Configuration file path')
+@click.option('--quiet', '-q', is_flag=True, help='Suppress non-error output')
+@click.option('--verbose', '-v', is_flag=True, help='Enable debug output')
+@click.option('--version', is_flag=True, expose_value=False, is_eager=True, callback=_print_version, help='Show the version and exit.')
+@click.pass_context
+def cli(ctx, config, quiet, verbose):
+    """MPEG TS Triage Runner — batch processing pipeline for TV broadcast TS files.
+
+    Processes recorded TS files through the pipeline:
+
+    categorize -> list -> analyze -> mark -> cut -> encode -> confirm -> cleanup
+
+    \b
+    Examples:
+      tstriage run categorize list analyze mark cut encode confirm cleanup
+      tstriage categorize                             # single task
+    """
+    if verbose:
+        log_level = logging.DEBUG
+    elif quiet:
+        log_level = logging.WARNING
+    else:
+        log_level = logging.INFO
+    from rich.logging import RichHandler
+    logging.basicConfig(
+        level=log_level, format='%(message)s', datefmt='[%X]',
+        handlers=[RichHandler(console=get_console(), rich_tracebacks=True)])
+
+    ctx.ensure_object(dict)
+    ctx.obj['config'] = config
+    ctx.obj['quiet'] = quiet
+
+
+def _load_config(ctx):
+    """Load and prepare configuration from YAML file."""
+    import yaml
+    config_path = Path(ctx.obj['config'])
+    with config_path.open(encoding='utf-8') as f:
+        configuration = yaml.safe_load(f)
+    configuration = _expand_env_vars(configuration)
+    _inject_env_vars(configuration)
+    return configuration
+
+
+def _run_tasks(ctx, tasks):
+    """Create Runner and execute the given tasks."""
+    from .runner import Runner
+    configuration = _load_config(ctx)
+    if Runner(configuration, quiet=ctx.obj['quiet']).Run(tasks):
+        ctx.exit(1)
+
+
+@cli.command()
+@click.pass_context
+def categorize(ctx):
+    """Match unprocessed TS files against EPGStation keywords, create .categorized items."""
+    _run_tasks(ctx, ['categorize'])
+
+
+@cli.command(name='list')
+@click.pass_context
+def list_cmd(ctx):
+    """Convert .categorized items to .toanalyze using tstriage.json settings."""
+    _run_tasks(ctx, ['list'])
+
+
+@cli.command()
+@click.pass_context
+def analyze(ctx):
+    """Run tscutter analyze and tsmarker prepare-subtitles/extract-logo, create .tomark items."""
+    _run_tasks(ctx, ['analyze'])
+
+
+@cli.command()
+@click.pass_context
+def mark(ctx):
+    """Run tsmarker mark (subtitles/logo/clipinfo/speech), create .tocut items."""
+    _run_tasks(ctx, ['mark'])
+
+
+@cli.command()
+@click.pass_context
+def cut(ctx):
+    """Write the clip manifest (program/CM clips and encode groups), create .toencode items."""
+    _run_tasks(ctx, ['cut'])
+
+
+@cli.command()
+@click.pass_context
+def encode(ctx):
+    """Encode program clips to MKV via ffmpeg, create .toconfirm items."""
+    _run_tasks(ctx, ['encode'])
+
+
+@cli.command()
+@click.pass_context
+def confirm(ctx):
+    """Apply reviewed clip flags as ground truth, decide re-encode or cleanup."""
+    _run_tasks(ctx, ['confirm'])
+
+
+@cli.command()
+@click.pass_context
+def cleanup(ctx):
+    """Remove temporary cache files for completed items."""
+    _run_tasks(ctx, ['cleanup'])
+
+
+@cli.command()
+@click.argument('tasks', nargs=-1, required=True, type=click.Choice([
+    'categorize', 'list', 'analyze', 'mark', 'cut', 'encode', 'confirm', 'cleanup'
+]))
+@click.pass_context
+def run(ctx, tasks):
+    """Run multiple pipeline tasks in sequence.
+
+    TASKS: one or more task names to execute in order.
+    Example: tstriage run categorize list analyze mark cut encode confirm cleanup
+    """
+    _run_tasks(ctx, list(tasks))
+
+
+@cli.command()
+@click.option('--by', '-b', 'by', multiple=True, type=click.Choice(STAGE_GROUPS), help='Group by column (repeatable)  [default: stage]')
+@click.option('--stage', '-s', type=click.Choice(['analyze', 'mark', 'cut', 'encode']), help='Only this stage')
+@click.option('--days', '-d', type=float, default=None, help='Only runs started within the last N days')
+@click.pass_context
+def stats(ctx, by, stage, days):
+    """Show per-stage timing percentiles from the local history."""
+    from rich.table import Table
+    from rich import filesize
+    from .history import History, StageStats
+    history = History.FromConfig(_load_config(ctx))
+    if history is None:
+        raise click.ClickException('History is disabled in the configuration')
+    since = time.time() - days * 86400 if days is not None else None
+    rows = StageStats(history.Stages(stage=stage, since=since), by or ('stage',))
+    table = Table(*(by or ('stage',)), 'runs', 'wall p50', 'wall p90', 'wall p99', 'cpu p50', 'read p50')
+    minutes = lambda v: f'{v / 60:.1f}m'
+    for row in rows:
+        table.add_row(*(str(row[k]) for k in (by or ('stage',))), str(row['count']),
+                      minutes(row['wall_p50']), minutes(row['wall_p90']), minutes(row['wall_p99']),
+                      minutes(row['cpu_p50']), filesize.decimal(int(row['read_p50'])))
+    get_console().print(table)
+
+
+def main():
+    cli()
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
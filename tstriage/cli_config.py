@@ -1,8 +1,26 @@
-import shlex
+import hashlib, json, logging, os, shlex, subprocess
+from dataclasses import dataclass, field
+from functools import cache
+from pathlib import Path
+from .subprocess_utils import ToolCommand, _clean_env, _tool_kwargs
+
+logger = logging.getLogger('tstriage.cli_config')
 
 _tscutter_cmd = 'tscutter'
 _tsmarker_cmd = 'tsmarker'
 
+# `uv run` wrappers resolved to the tool's script in the project environment,
+# keyed by the command and a hash of the project's uv.lock.
+CACHE_PATH = Path('~/.tstriage/cli.json')
+
+# uv run options that take a value (the tool is the first argument that is not an option).
+_UV_VALUE_OPTIONS = {'--directory', '--project', '--python', '-p', '--with', '--with-editable', '--with-requirements',
+                     '--extra', '--group', '--package', '--env-file', '--index', '--index-url', '--default-index',
+                     '--extra-index-url', '--cache-dir', '--config-file'}
+
+# Run inside the uv environment: PATH then starts with the environment's scripts folder.
+_WHICH = 'import shutil, sys; print(shutil.which(sys.argv[1]) or "")'
+
 
 def configure(tscutter: str = '', tsmarker: str = ''):
     global _tscutter_cmd, _tsmarker_cmd
@@ -10,11 +28,144 @@ def configure(tscutter: str = '', tsmarker: str = ''):
         _tscutter_cmd = tscutter
     if tsmarker:
         _tsmarker_cmd = tsmarker
+    # The versions are asked once per process, for whatever is configured.
+    tool_version.cache_clear()
+    tool_versions.cache_clear()
+
+
+@dataclass
+class Resolved:
+    argv: tuple[str, ...]
+    cwd: str | None = None                              # from `uv run --directory`
+    env: dict[str, str] = field(default_factory=dict)   # from `uv run --env-file`
 
 
 def tscutter(*args: str) -> list[str]:
-    return shlex.split(_tscutter_cmd) + list(args)
+    return _command(_tscutter_cmd, args)
 
 
 def tsmarker(*args: str) -> list[str]:
-    return shlex.split(_tsmarker_cmd) + list(args)
+    return _command(_tsmarker_cmd, args)
+
+
+def _command(cmd: str, args: tuple[str, ...]) -> ToolCommand:
+    resolved = resolve(cmd)
+    return ToolCommand([*resolved.argv, *args], cwd=resolved.cwd, env=resolved.env)
+
+
+def _split_uv_run(argv: list[str]) -> tuple[list[str], list[str], dict[str, list[str]]] | None:
+    """(uv run + its options, tool + arguments, values of the options) for a `uv run` command, else None."""
+    if len(argv) < 3 or Path(argv[0]).stem != 'uv' or argv[1] != 'run':
+        return None
+    options: dict[str, list[str]] = {}
+    i = 2
+    while i < len(argv) and argv[i].startswith('-'):
+        option, _, value = argv[i].partition('=')
+        if option in _UV_VALUE_OPTIONS and not value:
+            i += 1
+            value = argv[i] if i < len(argv) else ''
+        options.setdefault(option, []).append(value)
+        i += 1
+    if i >= len(argv):
+        return None
+    return argv[:i], argv[i:], options
+
+
+def _lock_hash(project: Path) -> str | None:
+    try:
+        return hashlib.sha1((project / 'uv.lock').read_bytes()).hexdigest()
+    except OSError:
+        return None
+
+
+def _read_env_file(path: Path) -> dict[str, str]:
+    """Variables of a dotenv file: `KEY=value` lines, optionally `export`ed and quoted."""
+    env = {}
+    try:
+        lines = path.read_text(encoding='utf-8').splitlines()
+    except OSError as e:
+        logger.warning(f'cannot read environment file {path}: {e}')
+        return env
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#') or '=' not in line:
+            continue
+        key, _, value = line.removeprefix('export ').partition('=')
+        value = value.strip()
+        if value[:1] in ('"', "'") and value.endswith(value[0]) and len(value) > 1:
+            value = value[1:-1]
+        elif ' #' in value:
+            value = value.split(' #', 1)[0].rstrip()
+        env[key.strip()] = value
+    return env
+
+
+@cache
+def resolve(cmd: str) -> Resolved:
+    """The configured command, with a `uv run [options] <tool>` wrapper replaced by the tool's
+    script in the uv environment, so that each call does not pay for uv resolving the environment.
+
+    What uv would do for the tool besides is returned with it: `--directory` becomes the
+    working directory and the variables of `--env-file` files are added to its environment
+    (see subprocess_utils.popen). Resolved once per process and cached in CACHE_PATH until the
+    project's uv.lock changes. Anything else, or a wrapper that cannot be resolved, is run as configured.
+    """
+    argv = shlex.split(cmd)
+    split = _split_uv_run(argv)
+    if split is None:
+        return Resolved(tuple(argv))
+    uv, (tool, *args), options = split
+    # uv changes to --directory first; --project and --env-file are relative to it.
+    directory = Path(options['--directory'][-1]).expanduser().resolve() if '--directory' in options else None
+    base = directory or Path.cwd()
+    project = base / Path(options['--project'][-1]).expanduser() if '--project' in options else base
+    lock = _lock_hash(project)
+    key = hashlib.sha1(f'{cmd}\n{project}\n{lock}'.encode()).hexdigest()
+    cachePath = CACHE_PATH.expanduser()
+    try:
+        with cachePath.open(encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        entries = {}
+    script = entries.get(key) if lock is not None else None
+    if script is None or not Path(script).exists():
+        try:
+            result = subprocess.run(uv + ['python', '-c', _WHICH, tool], capture_output=True, text=True, timeout=600, env=_clean_env())
+            script = result.stdout.strip().splitlines()[-1] if result.returncode == 0 and result.stdout.strip() else ''
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.debug(f'cannot resolve "{cmd}": {e}')
+            script = ''
+        if not script:
+            logger.debug(f'"{cmd}" not resolved, running it through uv')
+            return Resolved(tuple(argv))
+        if lock is not None:
+            entries[key] = script
+            try:
+                cachePath.parent.mkdir(parents=True, exist_ok=True)
+                tmp = cachePath.with_suffix('.tmp')
+                with tmp.open('w', encoding='utf-8') as f:
+                    json.dump(entries, f, indent=1)
+                os.replace(tmp, cachePath)
+            except OSError as e:
+                logger.debug(f'cannot write {cachePath}: {e}')
+    env: dict[str, str] = {}
+    for envFile in options.get('--env-file', []):  # later files take precedence, as with uv
+        env.update(_read_env_file(base / Path(envFile).expanduser()))
+    logger.debug(f'"{cmd}" resolved to {script}')
+    return Resolved((script, *args), cwd=str(directory) if directory is not None else None, env=env)
+
+
+@cache
+def tool_version(tool: str) -> str:
+    """`<tool> --version` output of the configured tscutter/tsmarker, or 'unknown'."""
+    cmd = tscutter('--version') if tool == 'tscutter' else tsmarker('--version')
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=120, **_tool_kwargs(cmd, env=_clean_env()))
+    except (OSError, subprocess.TimeoutExpired):
+        return 'unknown'
+    return result.stdout.strip().splitlines()[-1] if result.returncode == 0 and result.stdout.strip() else 'unknown'
+
+
+@cache
+def tool_versions() -> str:
+    return ', '.join(tool_version(t) for t in ('tscutter', 'tsmarker'))
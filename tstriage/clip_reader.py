@@ -0,0 +1,76 @@
+import logging, os
+from pathlib import Path
+
+logger = logging.getLogger('tstriage.clip_reader')
+
+_ALIGN = 64 * 1024
+
+
+class ClipReader:
+    """Read-only file object over byte ranges of a file, concatenated.
+
+    Serves what `tsmarker extract-clips` writes to stdout (the ptsmap
+    next_start_pos/prev_end_pos ranges of each clip) without a child process.
+    Reads use os.pread where available, end on _ALIGN boundaries after the
+    first read of each range, and the next range is announced to the kernel
+    with posix_fadvise(WILLNEED) so read-ahead covers clip boundaries.
+
+    Usage:
+        with ClipReader(ts_path, [(start_pos, end_pos), ...]) as reader:
+            Tee(encode.stdin).pump(reader)
+    """
+
+    def __init__(self, path: str | Path, ranges: list[tuple[int, int]]):
+        self.path = Path(path)
+        self.ranges = [(int(s), int(e)) for s, e in ranges if e > s]
+        self.total = sum(e - s for s, e in self.ranges)
+        self._f = self.path.open('rb', buffering=0)
+        self._fd = self._f.fileno()
+        self._index = 0
+        self._pos = self.ranges[0][0] if self.ranges else 0
+        if self.ranges:
+            self._advise(0)
+
+    def __enter__(self) -> 'ClipReader':
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _advise(self, index: int):
+        if hasattr(os, 'posix_fadvise') and index < len(self.ranges):
+            s, e = self.ranges[index]
+            try:
+                os.posix_fadvise(self._fd, s, e - s, os.POSIX_FADV_WILLNEED)
+            except OSError:
+                pass
+
+    def _pread(self, n: int, offset: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._fd, n, offset)
+        self._f.seek(offset)
+        return self._f.read(n)
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(16 * 1024 * 1024), b''))
+        while self._index < len(self.ranges):
+            s, e = self.ranges[self._index]
+            if self._pos >= e:
+                self._index += 1
+                if self._index < len(self.ranges):
+                    self._pos = self.ranges[self._index][0]
+                    self._advise(self._index + 1)
+                continue
+            n = min(size, e - self._pos)
+            if self._pos + n < e and n > _ALIGN:
+                n -= (self._pos + n) % _ALIGN
+            data = self._pread(n, self._pos)
+            if not data:
+                raise EOFError(f'{self.path.name} ends at {self._pos}, before clip end {e}')
+            self._pos += len(data)
+            return data
+        return b''
+
+    def close(self):
+        self._f.close()
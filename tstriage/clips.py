@@ -0,0 +1,105 @@
+"""Clip manifest written by Cut and consumed by Encode and Confirm.
+
+The manifest replaces the per-clip .ts files that `tsmarker cut` used to write:
+it lists every clip with its PTS range, source byte range and program flag,
+plus the program groups Encode turns into output files. Reviewers flip the
+`program` flags in the manifest instead of moving clip files into or out of
+the CM folder; Confirm turns the flags into `_groundtruth` markers.
+"""
+
+import json, logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+from .pipeline import ProgramClips
+
+logger = logging.getLogger('tstriage.clips')
+
+_EPSILON = 1e-3  # seconds; PTS values round-trip through JSON as floats
+
+
+@dataclass
+class Clip:
+    start: float
+    end: float
+    start_pos: int      # byte offset in the source TS (ptsmap next_start_pos)
+    end_pos: int        # byte offset in the source TS (ptsmap prev_end_pos)
+    program: bool = False
+    group: Optional[int] = None  # output file index, for program clips
+
+
+@dataclass
+class ClipManifest:
+    source: str
+    by_method: str
+    clips: list[Clip] = field(default_factory=list)
+    groups: list[list[Clip]] = field(default_factory=list)  # merged program ranges per output file
+
+    @staticmethod
+    def PathFor(destination: Path, path: Path) -> Path:
+        return Path(destination) / '_metadata' / Path(path).with_suffix('.clips').name
+
+    @staticmethod
+    def Build(source: Path, ptsmap_path: Path, markermap_path: Path, splitNum: int = 1, byGroup: bool = False,
+              quiet: bool = False) -> 'ClipManifest':
+        with Path(ptsmap_path).open() as f:
+            ptsmap = json.load(f)
+        with Path(markermap_path).open() as f:
+            markermap = json.load(f)
+        data = ProgramClips(ptsmap_path, markermap_path, splitNum, byGroup, quiet)
+
+        def _clip(start: float, end: float, **kwargs) -> Clip:
+            return Clip(start=start, end=end,
+                        start_pos=ptsmap[str(start)]['next_start_pos'],
+                        end_pos=ptsmap[str(end)]['prev_end_pos'], **kwargs)
+
+        groups = [[_clip(s, e, program=True, group=i) for s, e in group] for i, group in enumerate(data['groups'])]
+        clips = []
+        for key in sorted(markermap, key=lambda k: json.loads(k)[0]):
+            start, end = json.loads(key)
+            group = next((r.group for g in groups for r in g
+                          if r.start - _EPSILON <= start and end <= r.end + _EPSILON), None)
+            clips.append(_clip(start, end, program=group is not None, group=group))
+        return ClipManifest(source=Path(source).name, by_method=data['by_method'], clips=clips, groups=groups)
+
+    @staticmethod
+    def Load(path: Path) -> 'ClipManifest':
+        with Path(path).open(encoding='utf-8') as f:
+            data = json.load(f)
+        return ClipManifest(source=data['source'], by_method=data['by_method'],
+                            clips=[Clip(**c) for c in data['clips']],
+                            groups=[[Clip(**c) for c in g] for g in data['groups']])
+
+    def Save(self, path: Path):
+        with Path(path).open('w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=1)
+
+    def Groups(self) -> list[list[list[float]]]:
+        """Program groups in the `tsmarker get-program-clips` shape."""
+        return [[[c.start, c.end] for c in group] for group in self.groups]
+
+    def Duration(self) -> float:
+        """Total program length in seconds, i.e. what Encode will encode."""
+        return sum(c.end - c.start for group in self.groups for c in group)
+
+    def GroupBytes(self, i: int) -> int:
+        return sum(c.end_pos - c.start_pos for c in self.groups[i])
+
+    def Changes(self, other: 'ClipManifest') -> list[Clip]:
+        """Clips whose program flag differs from the same clip in other."""
+        flags = {(round(c.start, 3), round(c.end, 3)): c.program for c in other.clips}
+        return [c for c in self.clips if flags.get((round(c.start, 3), round(c.end, 3)), c.program) != c.program]
+
+
+def WriteGroundTruth(markermap_path: Path, manifest: ClipManifest):
+    """Store the manifest's program flags as `_groundtruth` markers (1.0 program, 0.0 CM)."""
+    with Path(markermap_path).open() as f:
+        markermap = json.load(f)
+    flags = {(round(c.start, 3), round(c.end, 3)): c.program for c in manifest.clips}
+    for key, markers in markermap.items():
+        start, end = json.loads(key)
+        program = flags.get((round(start, 3), round(end, 3)))
+        if program is not None:
+            markers['_groundtruth'] = 1.0 if program else 0.0
+    with Path(markermap_path).open('w') as f:
+        json.dump(markermap, f, indent=True)
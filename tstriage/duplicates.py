@@ -0,0 +1,104 @@
+"""Duplicate detection for Categorize: rebroadcasts, simulcasts and copies of a recording.
+
+Categorize fingerprints every recording it matches to a keyword:
+
+  program   hash of the EPG name and description, normalized (NFKC, whitespace
+            and broadcast markers such as [再] or [字] removed); None when the
+            EPG has no description, since a bare title (news, a daily show)
+            says nothing about the episode
+  duration  EPG duration in seconds
+  content   hash of TS packet payloads sampled at fixed points of the file,
+            which reads about 200 KB however long the recording is
+  episode   episode number in the EPG name or description (#3, 第3話, 第3回)
+  event     EPGStation programId: network, service and event ID of the broadcast
+
+A recording is a duplicate of another when their program hashes match, their
+durations differ by no more than DURATION_TOLERANCE, and they also share the
+content hash, the episode number or the broadcast event. The program hash
+alone is not enough: series often repeat a generic description every week.
+Categorize compares against the action items on the NAS (items still in
+flight) and against the recordings encoded in the last WINDOW_DAYS days, kept
+in History.
+"""
+
+import hashlib, logging, re, unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+from .tsfilter import PACKET_SIZE, SYNC_BYTE
+
+logger = logging.getLogger('tstriage.duplicates')
+
+DURATION_TOLERANCE = 60.0   # seconds; simulcasts may start or end a little apart
+SAMPLES = 16                # points sampled across the file
+SAMPLE_PACKETS = 64         # packets hashed at each point
+WINDOW_DAYS = 30.0          # how far back encoded recordings are looked up in History
+
+# Bracketed one- or two-character markers: [再] rerun, [字] captions, [新] new series, [SS], ...
+_MARKERS = re.compile(r'[\[【(<]\w{1,2}[\]】)>]')
+_EPISODE = re.compile(r'#\s*(\d+)|第\s*(\d+)\s*[話回]')
+
+
+def _Normalize(text: str) -> str:
+    text = unicodedata.normalize('NFKC', text or '')
+    return ''.join(_MARKERS.sub('', text).split())
+
+
+def Episode(*texts: str) -> Optional[str]:
+    """The episode number in the first of texts that has one."""
+    for text in texts:
+        match = _EPISODE.search(unicodedata.normalize('NFKC', text or ''))
+        if match:
+            return str(int(match.group(1) or match.group(2)))
+    return None
+
+
+def ContentHash(path: Path, samples: int = SAMPLES, packets: int = SAMPLE_PACKETS) -> str:
+    """Hash of the payloads of `packets` packets at `samples` evenly spaced points of a TS file."""
+    path = Path(path)
+    size = path.stat().st_size
+    h = hashlib.sha1()
+    window = (packets + 1) * PACKET_SIZE
+    with path.open('rb') as f:
+        for i in range(1, samples + 1):
+            f.seek(size * i // (samples + 1))
+            data = f.read(window + PACKET_SIZE)
+            start = next((p for p in range(min(PACKET_SIZE, len(data)))
+                          if data[p] == SYNC_BYTE and data[p + PACKET_SIZE:p + PACKET_SIZE + 1] == bytes([SYNC_BYTE])), None)
+            if start is None:
+                continue
+            for p in range(start, min(start + packets * PACKET_SIZE, len(data) - PACKET_SIZE + 1), PACKET_SIZE):
+                h.update(data[p + 4:p + PACKET_SIZE])  # the header's continuity counter is not content
+    return h.hexdigest()
+
+
+@dataclass
+class RecordingFingerprint:
+    program: Optional[str]
+    duration: Optional[float]
+    content: str
+    episode: Optional[str] = None
+    event: Optional[str] = None
+
+    @staticmethod
+    def Compute(path: Path, epg: Optional[dict]) -> 'RecordingFingerprint':
+        program = duration = episode = event = None
+        if epg is not None:
+            if _Normalize(epg.get('description', '')):
+                key = _Normalize(epg.get('name', '')) + '\n' + _Normalize(epg.get('description', ''))
+                program = hashlib.sha1(key.encode()).hexdigest()
+            if 'startAt' in epg and 'endAt' in epg:
+                duration = (epg['endAt'] - epg['startAt']) / 1000
+            episode = Episode(epg.get('name', ''), epg.get('description', ''))
+            if epg.get('programId') is not None:
+                event = str(epg['programId'])
+        return RecordingFingerprint(program=program, duration=duration, content=ContentHash(path), episode=episode, event=event)
+
+    def Matches(self, other: 'RecordingFingerprint') -> bool:
+        if (self.program is None or self.program != other.program
+                or self.duration is None or other.duration is None
+                or abs(self.duration - other.duration) > DURATION_TOLERANCE):
+            return False
+        return (self.content == other.content
+                or (self.episode is not None and self.episode == other.episode)
+                or (self.event is not None and self.event == other.event))
@@ -1,8 +1,15 @@
 from functools import cache
-import os, subprocess, json, unicodedata, time, re, copy, shutil
+import os, subprocess, json, logging, unicodedata, time, re, copy, shutil
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional
 import yaml
+from .subprocess_utils import popen, run_process
+
+logger = logging.getLogger('tstriage.epg')
+
+# EIT present/following tables repeat every few seconds, so the recording's own
+# event is in its first minute (~17 Mbps for ISDB-T, ~24 Mbps for BS).
+DUMP_BYTES = 188 * 1024 * 1024  # whole packets
 
 def represent_str(dumper, instance):
     if "\n" in instance:
@@ -48,48 +55,109 @@ enclosed_characters_convert_table = {
     '\U00003299': '[秘]',
     '\U0001F200': '[ほか]',
 }
+_ENCLOSED_CHARACTERS = str.maketrans(enclosed_characters_convert_table)
+
+
+def IterEvents(path: Path, chunk_size: int = 1024 * 1024) -> Iterator[dict]:
+    """Events of a mirakurun-epgdump JSON array, parsed one at a time."""
+    decoder = json.JSONDecoder()
+    with Path(path).open(encoding='utf-8') as f:
+        buf, pos, eof = '', 0, False
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n,[':
+                pos += 1
+            if pos == len(buf) and not eof:
+                buf, pos = f.read(chunk_size), 0
+                eof = not buf
+                continue
+            if pos == len(buf) or buf[pos] == ']':
+                return
+            try:
+                event, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                more = '' if eof else f.read(chunk_size)
+                if not more:
+                    raise
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield event
+            pos = end
+
+
+class HeadPipe:
+    """Pipe wrapper for Tee that passes on the first limit bytes, then closes the pipe
+    and reports it broken, as a consumer that stopped reading would."""
+
+    def __init__(self, pipe, limit: int):
+        self.pipe = pipe
+        self.remaining = limit
+
+    def write(self, data):
+        if self.remaining <= 0:
+            raise BrokenPipeError
+        self.pipe.write(data[:self.remaining])
+        self.remaining -= len(data)
+        if self.remaining <= 0:
+            self.pipe.close()
+
+    def close(self):
+        if not self.pipe.closed:
+            self.pipe.close()
 
 class EPG:
     @staticmethod
-    def Dump(videoPath, epgPath, quiet: bool=False):
+    def DumpCmd(videoPath, epgPath) -> list[str] | str:
+        """mirakurun-epgdump command line; videoPath '-' reads the TS from stdin."""
         epgdump = 'mirakurun-epgdump.cmd' if os.name == 'nt' else 'mirakurun-epgdump'
         if not shutil.which(epgdump):
             raise RuntimeError(f'{epgdump} not found in $PATH!')
+        if os.name == 'nt':
+            return f'mirakurun-epgdump.cmd "{videoPath}" "{epgPath}"'
+        return ['mirakurun-epgdump', str(videoPath), str(epgPath)]
+
+    @staticmethod
+    def Dump(videoPath, epgPath, quiet: bool=False, limit: Optional[int]=DUMP_BYTES):
+        """Dump the EIT events of the first limit bytes of the recording (None: all of it)."""
         videoPath = Path(videoPath)
         if not videoPath.is_file():
             raise FileNotFoundError(f'"{videoPath.name}" not found!')
-        videoPath = Path(videoPath)
-        if os.name == 'nt':
-            dumpCmd = f'mirakurun-epgdump.cmd "{videoPath}" "{epgPath}"'
-        else:
-            dumpCmd = ['mirakurun-epgdump', videoPath, epgPath]
-        if quiet:
-            subprocess.run(dumpCmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        else:
-            subprocess.run(dumpCmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if limit is not None and videoPath.stat().st_size > limit:
+            dumpP = popen(EPG.DumpCmd('-', epgPath), stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            try:
+                with videoPath.open('rb') as f:
+                    while limit > 0 and (chunk := f.read(min(limit, 1024 * 1024))):
+                        dumpP.stdin.write(chunk)
+                        limit -= len(chunk)
+                dumpP.stdin.close()
+            except BrokenPipeError:
+                pass
+            if dumpP.wait() == 0:
+                return
+            logger.debug(f'mirakurun-epgdump of the head of "{videoPath.name}" failed, dumping all of it')
+        run_process(EPG.DumpCmd(videoPath, epgPath), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
     def __init__(self, path: Path, service_id: int, channels: Optional[dict]=None) -> None:
         self.path = path
         self._service_id = service_id
-        with self.path.open(encoding='utf-8') as f:
-            self.epg = json.load(f)
         self.channels = channels
 
+    @property
+    def epg(self) -> list[dict]:
+        """The events of the recording's service, parsed on first use."""
+        if not hasattr(self, '_events'):
+            self._events = [e for e in IterEvents(self.path) if e.get('serviceId') == self._service_id]
+        return self._events
+
     def Info(self) -> dict:
         if hasattr(self, 'info'):
             return self.info
         info = {}
+        videoName = unicodedata.normalize('NFKC', self.path.stem)
         for item in self.epg:
             name = item.get('name')
             if name:
-                for k,v in enclosed_characters_convert_table.items():
-                    name = name.replace(k, v)
-                name = unicodedata.normalize('NFKC', name)
-                #name = name.replace('(', '[')
-                #name = name.replace(')', ']')
-                #name = name.replace(chr(8217), "'")
-                videoName = unicodedata.normalize('NFKC', self.path.stem)
-                if (name in videoName or re.sub(r"\[.*?\]", "", name) in videoName) and item.get('serviceId') == self.ServiceId():
+                name = unicodedata.normalize('NFKC', name.translate(_ENCLOSED_CHARACTERS))
+                if name in videoName or re.sub(r"\[.*?\]", "", name) in videoName:
                     for k in item:
                         info[k] = item[k]
                     break
@@ -30,3 +30,7 @@ class EPGStation:
                 keyword = searchOption['keyword']
                 keywords.append(keyword)
         return keywords
+
+    def GetReserves(self, limit=99) -> list[dict]:
+        with urllib.request.urlopen(f'{self.url}/api/reserves?type=all&isHalfWidth=true&limit={limit}', timeout=30) as response:
+            return json.load(response)['reserves']
@@ -0,0 +1,185 @@
+"""Local SQLite history of finished encodes and per-stage timings.
+
+Kept on the processing host (not the NAS) so that SQLite locking behaves.
+"""
+
+import logging, math, sqlite3, threading, time
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger('tstriage.history')
+
+DEFAULT_PATH = '~/.tstriage/history.sqlite'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS encodes (
+    finished REAL NOT NULL,
+    name TEXT NOT NULL,
+    preset TEXT NOT NULL,
+    encoder TEXT NOT NULL,
+    duration REAL NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    fps REAL NOT NULL,
+    bytes INTEGER NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS encodes_preset ON encodes (preset, encoder);
+CREATE TABLE IF NOT EXISTS stages (
+    started REAL NOT NULL,
+    name TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    channel TEXT,
+    preset TEXT,
+    host TEXT NOT NULL,
+    status TEXT NOT NULL,
+    wall REAL NOT NULL,
+    cpu REAL NOT NULL,
+    read_bytes INTEGER NOT NULL,
+    peak_rss INTEGER NOT NULL,
+    versions TEXT
+);
+CREATE INDEX IF NOT EXISTS stages_stage ON stages (stage, started);
+CREATE TABLE IF NOT EXISTS fingerprints (
+    added REAL NOT NULL,
+    name TEXT NOT NULL,
+    program TEXT,
+    duration REAL,
+    content TEXT NOT NULL,
+    episode TEXT,
+    event TEXT
+);
+CREATE INDEX IF NOT EXISTS fingerprints_program ON fingerprints (program);
+CREATE INDEX IF NOT EXISTS fingerprints_content ON fingerprints (content);
+"""
+
+# One fingerprint per recording: re-encodes replace it. Databases written before
+# keep the first row of each name.
+_FINGERPRINTS_UNIQUE = """
+DELETE FROM fingerprints WHERE rowid NOT IN (SELECT min(rowid) FROM fingerprints GROUP BY name);
+CREATE UNIQUE INDEX fingerprints_name ON fingerprints (name);
+"""
+
+
+def Percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile, q in [0, 100]."""
+    ordered = sorted(values)
+    if not ordered:
+        return math.nan
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+class History:
+    def __init__(self, path: Path):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Encode jobs finish on scheduler threads; serialize access ourselves.
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            self._conn.executescript(_SCHEMA)
+            if self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'fingerprints_name'").fetchone() is None:
+                self._conn.executescript(_FINGERPRINTS_UNIQUE)
+            columns = {row['name'] for row in self._conn.execute('PRAGMA table_info(fingerprints)')}
+            for column in ('episode', 'event'):  # added after the table
+                if column not in columns:
+                    self._conn.execute(f'ALTER TABLE fingerprints ADD COLUMN {column} TEXT')
+
+    @staticmethod
+    def FromConfig(configuration: dict) -> Optional['History']:
+        path = configuration.get('History', DEFAULT_PATH)
+        if not path:
+            return None
+        try:
+            return History(Path(path))
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f'History disabled, cannot open {path}: {e}')
+            return None
+
+    def AddEncode(self, name: str, preset: str, encoder: str, duration: float,
+                  width: int, height: int, fps: float, bytes: int, seconds: float):
+        """Record one finished encode. width/height/fps describe the encoded output."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO encodes (finished, name, preset, encoder, duration, width, height, fps, bytes, seconds) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), name, preset, encoder, duration, width, height, fps, bytes, seconds))
+
+    def Encodes(self, encoder: Optional[str] = None, preset: Optional[str] = None, limit: int = 50) -> list[dict[str, Any]]:
+        """Most recent encodes first, optionally filtered by encoder and preset."""
+        query = 'SELECT * FROM encodes'
+        clauses, args = [], []
+        if encoder is not None:
+            clauses.append('encoder = ?')
+            args.append(encoder)
+        if preset is not None:
+            clauses.append('preset = ?')
+            args.append(preset)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        query += ' ORDER BY finished DESC LIMIT ?'
+        args.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query, args)]
+
+    def AddStage(self, started: float, name: str, stage: str, channel: Optional[str], preset: Optional[str],
+                 host: str, status: str, wall: float, cpu: float, read_bytes: int, peak_rss: int,
+                 versions: Optional[str] = None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT INTO stages (started, name, stage, channel, preset, host, status, wall, cpu, read_bytes, peak_rss, versions) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (started, name, stage, channel, preset, host, status, wall, cpu, read_bytes, peak_rss, versions))
+
+    def Stages(self, stage: Optional[str] = None, since: Optional[float] = None, status: Optional[str] = 'ok') -> list[dict[str, Any]]:
+        query = 'SELECT * FROM stages'
+        clauses, args = [], []
+        for column, value in (('stage', stage), ('status', status)):
+            if value is not None:
+                clauses.append(f'{column} = ?')
+                args.append(value)
+        if since is not None:
+            clauses.append('started >= ?')
+            args.append(since)
+        if clauses:
+            query += ' WHERE ' + ' AND '.join(clauses)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(query + ' ORDER BY started', args)]
+
+    def AddFingerprint(self, name: str, program: Optional[str], duration: Optional[float], content: str,
+                       episode: Optional[str] = None, event: Optional[str] = None):
+        """Record the fingerprint of an encoded recording (see duplicates.py), replacing an earlier one."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO fingerprints (added, name, program, duration, content, episode, event) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (time.time(), name, program, duration, content, episode, event))
+
+    def Fingerprints(self, program: str, since: float) -> list[dict[str, Any]]:
+        """Fingerprints of the recordings with this program hash encoded since `since`, earliest first."""
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(
+                'SELECT * FROM fingerprints WHERE program = ? AND added >= ? ORDER BY added', (program, since))]
+
+
+def StageStats(rows: Iterable[dict[str, Any]], by: Iterable[str]) -> list[dict[str, Any]]:
+    """Group stage rows by the given columns and summarize wall/CPU/read percentiles."""
+    by = list(by)
+    groups: dict[tuple, list[dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(row[k] for k in by), []).append(row)
+    stats = []
+    for key in sorted(groups, key=lambda k: tuple(str(v) for v in k)):
+        members = groups[key]
+        wall = [r['wall'] for r in members]
+        stats.append({
+            **dict(zip(by, key)),
+            'count': len(members),
+            'wall_p50': Percentile(wall, 50),
+            'wall_p90': Percentile(wall, 90),
+            'wall_p99': Percentile(wall, 99),
+            'cpu_p50': Percentile([r['cpu'] for r in members], 50),
+            'read_p50': Percentile([r['read_bytes'] for r in members], 50),
+        })
+    return stats
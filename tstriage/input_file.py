@@ -59,7 +59,13 @@ class InputFile:
         args += [ '-f', 'mpegts', outFile ]
         return args
 
-    def EncodeTsCmd(self, inPath: str | Path, outPath: str | Path, preset: dict, encoder: str, crop: Optional[dict] = None, audio_config: Optional[list[dict]] = None, audioLanguages: list[str] = ['jpn']) -> list[str]:
+    def EncodeTsCmd(self, inPath: str | Path, outPath: str | Path, preset: dict, encoder: str, crop: Optional[dict] = None, audio_config: Optional[list[dict]] = None, audioLanguages: list[str] = ['jpn'], threads: int = 0, progressUrl: Optional[str] = None, strip: bool = False, fixAudio: bool = False) -> list[str]:
+        """Encode command reading the output of StripTsCmd.
+
+        With strip=True the input is the unstripped TS instead, and this one
+        command also does the strip pass's work: video/audio stream selection,
+        the fixAudio resample and the audio language tags.
+        """
         videoFilter = preset.get('videoFilter') or ''
         if crop:
             filters = videoFilter.split(',') if videoFilter else []
@@ -89,10 +95,12 @@ class InputFile:
             ]
         else:
             videoCodec = [ '-c:v', encoder, '-crf', str(preset['crf']) ]
-        args = [
-            self.ffmpeg, '-hide_banner', '-y',
-            '-i', str(inPath)
-        ]
+            if threads > 0:
+                videoCodec += [ '-threads', str(threads) ]
+        args = [ self.ffmpeg, '-hide_banner', '-y' ]
+        if progressUrl:
+            args += [ '-nostats', '-progress', progressUrl ]
+        args += [ '-i', str(inPath) ]
         if len(videoFilter) > 0:
             args += [ '-vf', videoFilter ]
         args += videoCodec
@@ -109,8 +117,9 @@ class InputFile:
                     logger.info(f'Encoding: Dual mono audio detected, componentType=2, sampling rate: {sampling_rate}Hz, languages: {audio_langs}')
                     break
 
+        audioFilter = 'aresample=async=1' if strip and fixAudio else ''
         if has_dual_mono:
-            args += ['-filter_complex', '[0:a]channelsplit=channel_layout=stereo[left][right]']
+            args += ['-filter_complex', f'[0:a]{audioFilter + "," if audioFilter else ""}channelsplit=channel_layout=stereo[left][right]']
             args += ['-map', '0:v', '-map', '[left]', '-map', '[right]']
             args += ['-c:a', 'aac', '-ar', '48000', '-ac', '1', '-b:a', '128k']
             for i in range(2):
@@ -123,7 +132,13 @@ class InputFile:
                 args += [f'-metadata:s:a:{i}', f'language={lang}']
             args += ['-bsf:a', 'aac_adtstoasc']
         else:
-            args += [ '-c:a', 'copy', '-bsf:a', 'aac_adtstoasc' ]
+            if audioFilter:
+                args += [ '-af', audioFilter, '-c:a', 'aac', '-ar', '48000', '-ac', '2' ]
+            else:
+                args += [ '-c:a', 'copy', '-bsf:a', 'aac_adtstoasc' ]
             args += [ '-map', '0:v', '-map', '0:a', '-ignore_unknown' ]
+            if strip:
+                for i in range(len(audioLanguages)):
+                    args += [ f'-metadata:s:a:{i}', f'language={audioLanguages[i]}' ]
         args += [ outPath ]
         return args
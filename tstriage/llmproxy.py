@@ -0,0 +1,160 @@
+"""Local caching proxy for the OpenAI-compatible endpoint used by `tsmarker` speech marking.
+
+With an `LLMProxy` section, Runner starts the proxy and points
+`OPENAI_API_BASE` of the child processes at it. POST responses are cached on
+disk, keyed on the request path and body, so re-marking an item (e.g. after
+Confirm asks for a re-encode) replays the answers instead of paying for them
+again. Requests that reach the endpoint are limited to `concurrency` at a time
+and to `rpm` per minute by a token bucket that allows bursts of `burst`.
+"""
+
+import base64, hashlib, json, logging, os, threading, time, urllib.error, urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+from .metrics import LLM_REQUESTS
+
+logger = logging.getLogger('tstriage.llmproxy')
+
+DEFAULT_CACHE = '~/.tstriage/llm-cache'
+
+# Headers passed on to the endpoint; everything else (Host, Content-Length, ...) is set by urllib.
+_FORWARDED = ('Authorization', 'Content-Type', 'Accept', 'OpenAI-Organization', 'OpenAI-Project')
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average and bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class ResponseCache:
+    """Successful responses stored as `<cache>/<key[:2]>/<key>.json`."""
+
+    def __init__(self, folder: Path):
+        self.folder = Path(folder).expanduser()
+
+    @staticmethod
+    def Key(path: str, body: bytes) -> str:
+        return hashlib.sha256(path.encode() + b'\n' + body).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.folder / key[:2] / f'{key}.json'
+
+    def Get(self, key: str) -> Optional[tuple[str, bytes]]:
+        try:
+            with self._path(key).open(encoding='utf-8') as f:
+                entry = json.load(f)
+            return entry['contentType'], base64.b64decode(entry['body'])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def Put(self, key: str, contentType: str, body: bytes):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f'.{threading.get_ident()}.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump({'contentType': contentType, 'body': base64.b64encode(body).decode('ascii')}, f)
+        os.replace(tmp, path)
+
+
+class LLMProxy:
+    """Local OpenAI-compatible endpoint that queues, rate-limits and caches calls to `upstream`."""
+
+    def __init__(self, upstream: str, cache: Path, concurrency: int = 2, rpm: float = 60, burst: int = 5,
+                 timeout: float = 300):
+        self.upstream = upstream.rstrip('/')
+        self.cache = ResponseCache(cache)
+        self.slots = threading.BoundedSemaphore(max(1, concurrency))
+        self.bucket = TokenBucket(rpm / 60, burst) if rpm else None
+        self.timeout = timeout
+        self.server: Optional[ThreadingHTTPServer] = None
+
+    @staticmethod
+    def FromConfig(configuration: dict, upstream: Optional[str]) -> Optional['LLMProxy']:
+        options = configuration.get('LLMProxy')
+        if options is None or not upstream:
+            return None
+        options = options or {}
+        return LLMProxy(upstream, Path(options.get('cache', DEFAULT_CACHE)), concurrency=int(options.get('concurrency', 2)),
+                        rpm=float(options.get('rpm', 60)), burst=int(options.get('burst', 5)))
+
+    @property
+    def url(self) -> str:
+        address, port = self.server.server_address[:2]
+        return f'http://{address}:{port}'
+
+    def Serve(self, address: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+        """Start the proxy on a daemon thread. port=0 picks a free port."""
+        self.server = ThreadingHTTPServer((address, port), type('Handler', (_Handler,), {'proxy': self}))
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='llmproxy', daemon=True).start()
+        logger.info(f'LLM proxy: {self.url} -> {self.upstream}')
+        return self.server
+
+    def Forward(self, method: str, path: str, headers: dict, body: Optional[bytes]) -> tuple[int, str, bytes]:
+        request = urllib.request.Request(self.upstream + path, data=body, method=method,
+                                         headers={k: v for k, v in headers.items() if k in _FORWARDED})
+        with self.slots:
+            if self.bucket is not None:
+                self.bucket.acquire()
+            try:
+                with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                    return response.status, response.headers.get('Content-Type', 'application/json'), response.read()
+            except urllib.error.HTTPError as e:
+                return e.code, e.headers.get('Content-Type', 'application/json'), e.read()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    proxy: LLMProxy
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        key = ResponseCache.Key(self.path, body)
+        cached = self.proxy.cache.Get(key)
+        if cached is not None:
+            LLM_REQUESTS.inc(result='hit')
+            self._reply(200, *cached)
+            return
+        status, contentType, data = self._forward(body)
+        if status == 200:
+            self.proxy.cache.Put(key, contentType, data)
+        LLM_REQUESTS.inc(result='miss' if status == 200 else 'error')
+        self._reply(status, contentType, data)
+
+    def do_GET(self):
+        self._reply(*self._forward(None))
+
+    def _forward(self, body: Optional[bytes]) -> tuple[int, str, bytes]:
+        try:
+            return self.proxy.Forward(self.command, self.path, dict(self.headers), body)
+        except OSError as e:
+            logger.warning(f'LLM endpoint unreachable: {e}')
+            return 502, 'application/json', json.dumps({'error': {'message': str(e)}}).encode()
+
+    def _reply(self, status: int, contentType: str, data: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
@@ -0,0 +1,101 @@
+"""Advisory file locks that let independent tstriage runs share a host.
+
+Each lock guards one thing, so `tstriage encode` in one terminal and
+`tstriage categorize` in another run side by side, and only work on the same
+thing is serialized:
+
+  item      an action item, held while a stage processes it; a run that
+            finds an item locked leaves it to the run holding it
+  ensemble  a series' ensemble dataset and model, held while it is trained
+            and used
+  logo      a channel logo, held while it is extracted
+  output    an encoded output file, held while it is written
+
+Lock files live in `~/.tstriage/locks`, named after a hash of the scope and
+key. They are `flock`ed on POSIX and `msvcrt.locking`ed on Windows, so the OS
+releases them when a run dies. Claiming action items across hosts is still
+done by renaming them (see Runner._ProcessItem).
+"""
+
+import hashlib, logging, os, threading, time
+from pathlib import Path
+from typing import Any
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger('tstriage.locks')
+
+LOCK_DIR = '~/.tstriage/locks'
+_POLL = 0.5  # seconds between attempts where the OS cannot block (Windows)
+
+
+class FileLock:
+    """Exclusive lock on `path`; not reentrant, even within a thread."""
+
+    def __init__(self, path: Path, name: str = ''):
+        self.path = Path(path)
+        self.name = name or self.path.name
+        self._fd: int | None = None
+        self._mutex = threading.Lock()
+
+    @staticmethod
+    def For(scope: str, key: Any) -> 'FileLock':
+        digest = hashlib.sha1(f'{scope}\n{key}'.encode()).hexdigest()[:16]
+        return FileLock(Path(LOCK_DIR).expanduser() / f'{scope}-{digest}.lock', name=f'{scope} {key}')
+
+    def _try(self, fd: int) -> bool:
+        try:
+            if os.name == 'nt':
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def acquire(self, blocking: bool = True) -> bool:
+        with self._mutex:
+            if self._fd is not None:
+                raise RuntimeError(f'{self.name} is already held')
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            if not self._try(fd):
+                if not blocking:
+                    os.close(fd)
+                    return False
+                logger.info(f'waiting for the {self.name} lock held by another tstriage run ...')
+                try:
+                    if os.name == 'nt':
+                        while not self._try(fd):
+                            time.sleep(_POLL)
+                    else:
+                        fcntl.flock(fd, fcntl.LOCK_EX)
+                except BaseException:
+                    os.close(fd)
+                    raise
+            self._fd = fd
+            return True
+
+    def release(self):
+        with self._mutex:
+            if self._fd is None:
+                return
+            try:
+                if os.name == 'nt':
+                    os.lseek(self._fd, 0, os.SEEK_SET)
+                    msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+            finally:
+                os.close(self._fd)
+                self._fd = None
+
+    def __enter__(self) -> 'FileLock':
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
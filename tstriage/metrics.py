@@ -0,0 +1,123 @@
+"""Prometheus text exposition of live pipeline state.
+
+Metrics are always collected (it is just a few dict updates); the HTTP endpoint
+is only started when a `Metrics` section is configured. No client library is
+needed for the handful of counters and gauges exported here.
+"""
+
+import logging, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+logger = logging.getLogger('tstriage.metrics')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class _Metric:
+    def __init__(self, name: str, help: str, kind: str):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(tuple(sorted(labels.items())), None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def get(self, **labels) -> float:
+        return self._values.get(tuple(sorted(labels.items())), 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                labels = ','.join(f'{k}="{_escape(v)}"' for k, v in key)
+                lines.append(f'{self.name}{{{labels}}} {value:g}' if labels else f'{self.name} {value:g}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+        self._collectors: list[Callable[[], None]] = []
+
+    def counter(self, name: str, help: str) -> _Metric:
+        metric = _Metric(name, help, 'counter')
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help: str) -> _Metric:
+        metric = _Metric(name, help, 'gauge')
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], None]):
+        """Register a callback that refreshes gauges right before each scrape."""
+        self._collectors.append(fn)
+
+    def render(self) -> str:
+        for fn in self._collectors:
+            try:
+                fn()
+            except Exception:
+                logger.debug('metrics collector failed', exc_info=True)
+        return '\n'.join(line for metric in self._metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+
+QUEUE_ITEMS = REGISTRY.gauge('tstriage_queue_items', 'Action items per state; host is set while an item is claimed')
+STAGE_ITEMS = REGISTRY.counter('tstriage_stage_items_total', 'Items finished per stage and status')
+STAGE_BYTES = REGISTRY.counter('tstriage_stage_bytes_total', 'Bytes streamed through stage pipelines')
+FAILURES = REGISTRY.counter('tstriage_failures_total', 'Items that failed per stage')
+ENCODER_FPS = REGISTRY.gauge('tstriage_encoder_fps', 'Current ffmpeg encode speed in frames per second')
+SUBPROCESS_PROGRESS = REGISTRY.gauge('tstriage_subprocess_progress_ratio', 'Progress reported by running child tasks (0..1)')
+LLM_REQUESTS = REGISTRY.counter('tstriage_llm_requests_total', 'Requests through the LLM proxy by result (hit, miss, error)')
+LAST_PROGRESS = REGISTRY.gauge('tstriage_last_progress_timestamp_seconds', 'Unix time of the latest progress event per stage')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+def serve(address: str = '127.0.0.1', port: int = 9464, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Start the metrics endpoint on a daemon thread. port=0 picks a free port."""
+    handler = type('Handler', (_Handler,), {'registry': registry})
+    server = ThreadingHTTPServer((address, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f'Metrics endpoint: http://{address}:{server.server_address[1]}/metrics')
+    return server
@@ -1,7 +1,6 @@
 import json
 from pathlib import Path
 from typing import Generator, Optional
-from rich.progress import track
 
 class NAS:
     def __init__(self, recorded: Path, destination: Path):
@@ -10,6 +9,7 @@ class NAS:
         self.tstriageFolder = recorded / '_tstriage'
     
     def SearchUnprocessedFiles(self) -> list[Path]:
+        from rich.progress import track
         processedFiles: set[str] = set()
         for path in track(list(Path(self.destination).glob('**/*')), description="Loading encoded files"):
             if path.suffix in ('.mp4', '.mkv') and (path.parent / '_metadata').exists():
@@ -1,10 +1,15 @@
-import json, logging, shutil, subprocess, tempfile
+import json, logging, os, shutil, subprocess, tempfile, threading, time
+from contextlib import nullcontext
 from pathlib import Path
 import pysubs2
 import yaml
-from . import cli_config
+from . import cli_config, tsfilter
+from .captions import CaptionSink
+from .clip_reader import ClipReader
 from .input_file import InputFile
-from .subprocess_utils import run_json
+from .segments import Concat, MergeSubtitles, PlanSegments, Segment, SegmentManifest
+from .metrics import ENCODER_FPS, LAST_PROGRESS, STAGE_BYTES
+from .subprocess_utils import popen, run_json, run_process
 from .tee import Tee
 
 logger = logging.getLogger('tstriage.pipeline')
@@ -36,7 +41,8 @@ def _load_audio(yaml_path: Path) -> list[dict] | None:
     return audios
 
 
-def _get_program_clips(ptsmap_path: Path, markermap_path: Path, split_num: int, by_group: bool, quiet: bool) -> list[list]:
+def ProgramClips(ptsmap_path: Path, markermap_path: Path, split_num: int, by_group: bool, quiet: bool) -> dict:
+    """`tsmarker get-program-clips` output: {'groups': [[[start, end], ...], ...], 'by_method': ...}."""
     cmd = cli_config.tsmarker('get-program-clips',
                               '--marker', str(markermap_path),
                               '--index', str(ptsmap_path))
@@ -51,21 +57,31 @@ def _get_program_clips(ptsmap_path: Path, markermap_path: Path, split_num: int,
     if data is None:
         raise RuntimeError('tsmarker get-program-clips failed')
     logger.info(f'Using method: {data["by_method"]}')
-    return data['groups']
+    return data
+
+
+def _get_program_clips(ptsmap_path: Path, markermap_path: Path, split_num: int, by_group: bool, quiet: bool) -> list[list]:
+    return ProgramClips(ptsmap_path, markermap_path, split_num, by_group, quiet)['groups']
+
+
+def ProgramDuration(ptsmap_path: Path, markermap_path: Path, quiet: bool) -> float:
+    """Total program length in seconds, i.e. what EncodePipeline will encode."""
+    groups = _get_program_clips(ptsmap_path, markermap_path, 1, False, quiet)
+    return sum(clip[1] - clip[0] for group in groups for clip in group)
 
 
 def _detect_crop(inFile: Path, ptsmap_path: Path, quiet: bool) -> dict | None:
     with tempfile.TemporaryDirectory(prefix='EncodePipeline_') as td:
         logo_path = Path(td) / (inFile.stem + '_logo.png')
         qflag = ['--quiet'] if quiet else []
-        subprocess.run(cli_config.tsmarker('extract-logo',
-                                           '--input', str(inFile),
-                                           '--index', str(ptsmap_path),
-                                           '--output', str(logo_path),
-                                           '--max-time', '10',
-                                           '--no-remove-border') + qflag, check=True)
-        result = subprocess.run(cli_config.tsmarker('crop-detect', '--input', str(logo_path)),
-                                capture_output=True, text=True, check=True)
+        run_process(cli_config.tsmarker('extract-logo',
+                                        '--input', str(inFile),
+                                        '--index', str(ptsmap_path),
+                                        '--output', str(logo_path),
+                                        '--max-time', '10',
+                                        '--no-remove-border') + qflag, check=True)
+        result = run_process(cli_config.tsmarker('crop-detect', '--input', str(logo_path)),
+                             capture_output=True, text=True, check=True)
         if not result.stdout.strip() or result.stdout.strip() == 'null':
             return None
 
@@ -86,13 +102,31 @@ def _detect_crop(inFile: Path, ptsmap_path: Path, quiet: bool) -> dict | None:
         return None
 
 
+def _watch_encoder_progress(stream, encoder: str, item: str):
+    """Export fps from `ffmpeg -progress pipe:1` key=value lines until EOF."""
+    try:
+        for line in stream:
+            key, _, value = line.decode('ascii', 'replace').strip().partition('=')
+            if key == 'fps':
+                try:
+                    ENCODER_FPS.set(float(value), encoder=encoder, item=item)
+                except ValueError:
+                    pass
+    finally:
+        ENCODER_FPS.remove(encoder=encoder, item=item)
+
+
+def _caption2ass() -> str | None:
+    return shutil.which('Caption2AssC.cmd') or shutil.which('Caption2AssC')
+
+
 def _start_subtitles_process(out_subtitles: Path, out_file: Path):
-    exe = shutil.which('Caption2AssC.cmd') or shutil.which('Caption2AssC')
+    exe = _caption2ass()
     if exe is None:
         raise RuntimeError('Caption2AssC not found in PATH — install Caption2AssC or add it to PATH')
     si = subprocess.STARTUPINFO(wShowWindow=6, dwFlags=subprocess.STARTF_USESHOWWINDOW) if hasattr(subprocess, 'STARTUPINFO') else None
     cf = getattr(subprocess, 'CREATE_NO_WINDOW', 0x08000000)
-    return subprocess.Popen(
+    return popen(
         f'"{exe}" - "{out_subtitles / out_file.with_suffix("").name}"',
         stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
         startupinfo=si, creationflags=cf, shell=True)
@@ -100,11 +134,18 @@ def _start_subtitles_process(out_subtitles: Path, out_file: Path):
 
 def EncodePipeline(inFile: Path, ptsmap_path: Path, markermap_path: Path, outFile: Path, outSubtitles: Path,
                    byGroup: bool, splitNum: int, preset: dict, cropdetect: bool, encoder: str,
-                   fixAudio: bool, noStrip: bool, quiet=False, progress=None):
+                   fixAudio: bool, noStrip: bool, quiet=False, progress=None, threads: int = 0,
+                   presetName: str = '', predictor=None, splitStrip: bool = False, manifest=None,
+                   nativeExtract: bool = True, pidFilter: bool = False, captions: str = 'auto',
+                   segmentLength: float = 0, settingsHash: str = '') -> list[Path]:
 
     audio_config = _load_audio(outFile.parent / inFile.with_suffix('.yaml').name)
 
-    groups = _get_program_clips(ptsmap_path, markermap_path, splitNum, byGroup, quiet)
+    if manifest is not None:
+        groups = manifest.Groups()  # written by Cut (or Confirm), already split/grouped
+        logger.info(f'Using clip manifest ({manifest.by_method})')
+    else:
+        groups = _get_program_clips(ptsmap_path, markermap_path, splitNum, byGroup, quiet)
     total = sum(clip[1] - clip[0] for group in groups for clip in group)
     mins = int(total // 60)
     secs = int(total % 60)
@@ -112,79 +153,183 @@ def EncodePipeline(inFile: Path, ptsmap_path: Path, markermap_path: Path, outFil
     n = len(groups)
     logger.info(f'Encoding into {n} file{"s" if n > 1 else ""}')
 
+    started = time.monotonic()
     crop = _detect_crop(inFile, ptsmap_path, quiet) if cropdetect else None
     inputFile = InputFile(inFile)
+    if pidFilter and not tsfilter.available():
+        logger.warning('numpy is not installed, encoding without the TS PID filter')
+        pidFilter = False
+    if captions == 'auto':
+        # Caption2AssC only runs on Windows; elsewhere captions are always extracted in-process.
+        captions = 'caption2ass' if os.name == 'nt' and _caption2ass() else 'native'
+    elif captions not in ('native', 'caption2ass'):
+        raise ValueError(f'Unknown captions extractor: {captions}')
+    info = inputFile.GetInfo() if pidFilter or captions == 'native' else None
+    serviceId = info.serviceId if info is not None else None
+
+    ptsmap_data = None
+    if manifest is None or segmentLength:
+        with open(ptsmap_path) as f:
+            ptsmap_data = json.load(f)
 
+    def _sizes(clips: list) -> list[tuple[int, float]]:
+        return [(ptsmap_data[str(clip[1])]['prev_end_pos'] - ptsmap_data[str(clip[0])]['next_start_pos'], clip[1] - clip[0])
+                for clip in clips]
+
+    outputs = []
+    resumed = False
     for i, clips in enumerate(groups):
         currentOut = outFile if len(groups) == 1 else outFile.parent / f'{outFile.stem}_{i}.mkv'
+        outputs.append(currentOut)
         currentOut.unlink(missing_ok=True)
         currentOut.touch()
 
         # Calculate total bytes for progress tracking.
-        # extractP outputs concatenated clip byte ranges from the original TS.
-        # Tee.pump feeds these bytes to ffmpeg, so byte throughput ≈ encode progress.
-        total_bytes = 0
-        with open(ptsmap_path) as f:
-            ptsmap_data = json.load(f)
-        for clip in clips:
-            start_pos = ptsmap_data[str(clip[0])]['next_start_pos']
-            end_pos = ptsmap_data[str(clip[1])]['prev_end_pos']
-            total_bytes += end_pos - start_pos
+        # The encoder is fed the concatenated clip byte ranges of the original TS
+        # (by ClipReader or extract-clips), so byte throughput ≈ encode progress.
+        # The (byte length, duration) of each clip also tells the caption sink where clips join.
+        if manifest is not None:
+            sizes = [(c.end_pos - c.start_pos, c.end - c.start) for c in manifest.groups[i]]
+        else:
+            sizes = _sizes(clips)
+        total_bytes = sum(size for size, _ in sizes)
 
         encode_tid = "ffmpeg_encode"
-        if progress is not None:
-            progress.add_task(encode_tid, total_bytes, "Encoding", unit="B")
+        bytes_done = 0  # bytes of finished segments
         bytes_read = 0
         def _on_chunk(n):
             nonlocal bytes_read
             bytes_read += n
+            STAGE_BYTES.inc(n, stage='encode')
+            LAST_PROGRESS.set(time.time(), stage='encode')
             if progress is not None:
-                progress.update(encode_tid, bytes_read)
+                progress.update(encode_tid, bytes_done + bytes_read)
+
+        def _encode(combined: bool, clips: list, ranges: list | None, sizes: list, partOut: Path, partSubtitles: Path) -> int:
+            """Run one extract → [strip →] encode pass; returns the encoder's exit code."""
+            nonlocal bytes_read
+            bytes_read = 0
+            encode_cmd = inputFile.EncodeTsCmd('-', str(partOut), preset, encoder, crop, audio_config, ['jpn'], threads=threads,
+                                               progressUrl='pipe:1', strip=combined, fixAudio=fixAudio)
+            encodeP = popen(encode_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+            # Must be drained until ffmpeg exits, or ffmpeg gets SIGPIPE on its last progress report.
+            watcher = threading.Thread(target=_watch_encoder_progress, args=(encodeP.stdout, encoder, currentOut.stem), daemon=True)
+            watcher.start()
+
+            with encodeP:
+                subsP = _start_subtitles_process(partSubtitles, partOut) if captions == 'caption2ass' else None
+                subs = subsP.stdin if subsP is not None else CaptionSink(partSubtitles / partOut.stem, sizes, program=serviceId)
+                broken_ok = (subs,) if subsP is not None else ()
+
+                extract_cmd = cli_config.tsmarker('extract-clips',
+                                                  '--input', str(inFile),
+                                                  '--index', str(ptsmap_path),
+                                                  '--clips', json.dumps(clips))
+                if quiet:
+                    extract_cmd.append('--quiet')
+
+                extractP = None if ranges is not None else popen(extract_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                source = ClipReader(inFile, ranges) if extractP is None else extractP
+                stream = source if extractP is None else extractP.stdout
 
-        encode_cmd = inputFile.EncodeTsCmd('-', str(currentOut), preset, encoder, crop, audio_config, ['jpn'])
-        encodeP = subprocess.Popen(encode_cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                def _sink(pipe):
+                    # Captions are read from the unfiltered stream, so only the encoder side is filtered.
+                    return tsfilter.FilteredPipe(pipe, tsfilter.PidFilter(program=serviceId)) if pidFilter else pipe
+
+                if noStrip or combined:
+                    with subsP or nullcontext(), source:
+                        try:
+                            Tee(_sink(encodeP.stdin), subs, broken_ok=broken_ok).pump(
+                                stream, buf_size=1024*1024, on_chunk=_on_chunk)
+                        except BrokenPipeError:
+                            pass  # the encoder exited early; its exit code is checked below
+                else:
+                    strip_cmd = inputFile.StripTsCmd('-', '-', ['jpn'], fixAudio=fixAudio, audio_config=audio_config)
+                    stripP = popen(strip_cmd, stdin=subprocess.PIPE, stdout=encodeP.stdin,
                                    stderr=subprocess.DEVNULL)
+                    with stripP, subsP or nullcontext(), source:
+                        Tee(_sink(stripP.stdin), subs, broken_ok=broken_ok).pump(
+                            stream, buf_size=1024*1024, on_chunk=_on_chunk)
+                    if stripP.returncode != 0:
+                        raise RuntimeError(f'ffmpeg strip failed (exit {stripP.returncode})')
+
+                try:
+                    encodeP.stdin.close()  # the strip path leaves our copy open; ffmpeg needs EOF to finish
+                except BrokenPipeError:
+                    pass
+                watcher.join()
+            if encodeP.returncode == 0:
+                if extractP is not None and extractP.returncode != 0:
+                    raise RuntimeError(f'tsmarker extract-clips failed (exit {extractP.returncode})')
+                if subsP is not None and subsP.returncode != 0:
+                    raise RuntimeError(f'Caption2AssC failed (exit {subsP.returncode})')
+            return encodeP.returncode
 
-        with encodeP:
-            subsP = _start_subtitles_process(outSubtitles, currentOut)
-
-            extract_cmd = cli_config.tsmarker('extract-clips',
-                                              '--input', str(inFile),
-                                              '--index', str(ptsmap_path),
-                                              '--clips', json.dumps(clips))
-            if quiet:
-                extract_cmd.append('--quiet')
-
-            if noStrip:
-                extractP = subprocess.Popen(extract_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-                with subsP, extractP:
-                    Tee(encodeP.stdin, subsP.stdin, broken_ok=(subsP.stdin,)).pump(
-                        extractP.stdout, buf_size=1024*1024, on_chunk=_on_chunk)
+        def _encode_part(clips: list, ranges: list | None, sizes: list, partOut: Path, partSubtitles: Path):
+            combined = not noStrip and not splitStrip
+            returncode = _encode(combined, clips, ranges, sizes, partOut, partSubtitles)
+            if returncode != 0 and combined:
+                logger.warning(f'Combined strip+encode failed (exit {returncode}), retrying with a separate strip pass: {partOut.name}')
+                returncode = _encode(False, clips, ranges, sizes, partOut, partSubtitles)
+            if returncode != 0:
+                raise RuntimeError(f'ffmpeg encode failed (exit {returncode})')
+
+        if progress is not None:
+            progress.add_task(encode_tid, total_bytes, "Encoding", unit="B")
+
+        if not segmentLength:
+            # The group's bytes are read in-process when the manifest gives their ranges.
+            ranges = [(c.start_pos, c.end_pos) for c in manifest.groups[i]] if manifest is not None and nativeExtract else None
+            _encode_part(clips, ranges, sizes, currentOut, outSubtitles)
+        else:
+            plan = SegmentManifest(output=currentOut.name, preset=presetName, encoder=encoder,
+                                   segments=[Segment(c) for c in PlanSegments(clips, [float(k) for k in ptsmap_data], segmentLength)],
+                                   settings=settingsHash)
+            planPath = SegmentManifest.PathFor(ptsmap_path.parent, currentOut)
+            partsDir = SegmentManifest.PartsFor(currentOut)
+            if planPath.exists() and partsDir.is_dir() and (previous := SegmentManifest.Load(planPath)).Resumes(plan):
+                plan = previous
             else:
-                strip_cmd = inputFile.StripTsCmd('-', '-', ['jpn'], fixAudio=fixAudio, audio_config=audio_config)
-                stripP = subprocess.Popen(strip_cmd, stdin=subprocess.PIPE, stdout=encodeP.stdin,
-                                          stderr=subprocess.DEVNULL)
-                extractP = subprocess.Popen(extract_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
-                with stripP, subsP, extractP:
-                    Tee(stripP.stdin, subsP.stdin, broken_ok=(subsP.stdin,)).pump(
-                        extractP.stdout, buf_size=1024*1024, on_chunk=_on_chunk)
-                if stripP.returncode != 0:
-                    raise RuntimeError(f'ffmpeg strip failed (exit {stripP.returncode})')
-
-            if extractP.returncode != 0:
-                raise RuntimeError(f'tsmarker extract-clips failed (exit {extractP.returncode})')
-            if subsP.returncode != 0:
-                raise RuntimeError(f'Caption2AssC failed (exit {subsP.returncode})')
-
-        if encodeP.returncode != 0:
-            raise RuntimeError(f'ffmpeg encode failed (exit {encodeP.returncode})')
+                shutil.rmtree(partsDir, ignore_errors=True)
+            partsDir.mkdir(parents=True, exist_ok=True)
+            plan.Save(planPath)
+            parts = [partsDir / f'{k:03d}.mkv' for k in range(len(plan.segments))]
+            logger.info(f'Encoding {currentOut.name} in {len(parts)} segments')
+            for segment, part in zip(plan.segments, parts):
+                partSizes = _sizes(segment.clips)
+                if segment.done and part.exists():
+                    logger.info(f'Segment {part.name} already encoded, skipping')
+                    resumed = True
+                else:
+                    ranges = [(ptsmap_data[str(s)]['next_start_pos'], ptsmap_data[str(e)]['prev_end_pos'])
+                              for s, e in segment.clips] if nativeExtract else None
+                    _encode_part(segment.clips, ranges, partSizes, part, partsDir)
+                    segment.done = True
+                    plan.Save(planPath)
+                bytes_done += sum(size for size, _ in partSizes)
+            logger.info(f'Joining {len(parts)} segments: {currentOut.name}')
+            Concat(parts, currentOut)
+            MergeSubtitles(parts, [segment.Duration() for segment in plan.segments], outSubtitles / currentOut.stem)
+            shutil.rmtree(partsDir)
+            planPath.unlink()
 
         if progress is not None:
             progress.done(encode_tid)
 
-        logger.info(f'Normalizing subtitle encoding: {currentOut.name}')
-        base = outSubtitles / currentOut.with_suffix('').name
-        for suffix in ('.ass', '.srt'):
-            sp = base.with_suffix(suffix)
-            if sp.exists():
-                pysubs2.load(str(sp), encoding='utf-8').save(str(sp))
+        if captions == 'caption2ass' and not segmentLength:
+            logger.info(f'Normalizing subtitle encoding: {currentOut.name}')
+            base = outSubtitles / currentOut.with_suffix('').name
+            for suffix in ('.ass', '.srt'):
+                sp = base.with_suffix(suffix)
+                if sp.exists():
+                    pysubs2.load(str(sp), encoding='utf-8').save(str(sp))
+
+    if predictor is not None and not resumed:  # a resumed encode's time covers only part of the work
+        # The outputs are complete; failing to learn from them must not fail the encode.
+        try:
+            predictor.Record(inFile.stem, presetName, preset, encoder, total, info or inputFile.GetInfo(),
+                             bytes=sum(p.stat().st_size for p in outputs), seconds=time.monotonic() - started)
+        except Exception as e:
+            logger.warning(f'could not record the encode of {inFile.name} in history: {e}')
+    return outputs
@@ -0,0 +1,88 @@
+"""Output size and encode time prediction for Presets entries.
+
+The model is deliberately simple: bits per output pixel (size) and output pixels
+per wall-clock second (speed), taken as the median of recent encodes with the
+same encoder and preset. Without history, rough priors derived from crf are
+used, which is good enough to order a queue.
+"""
+
+import logging, re, statistics
+from dataclasses import dataclass
+from typing import Optional
+from .history import History
+from .video_info import VideoInfo
+
+logger = logging.getLogger('tstriage.predictor')
+
+# Priors used until history exists for an encoder/preset pair.
+_PRIOR_BPP_AT_CRF23 = 0.08              # bits per output pixel (x264 medium, broadcast sources)
+_PRIOR_NVENC_BPP_FACTOR = 1.3           # NVENC needs more bits for similar quality
+_PRIOR_SPEED = {'nvenc': 250e6, 'software': 40e6}  # output pixels per second
+_AUDIO_BYTES_PER_SEC = 192_000 / 8
+
+
+@dataclass
+class EncodeEstimate:
+    preset: str
+    bytes: float
+    seconds: float
+    samples: int  # history rows backing the estimate; 0 means priors only
+
+    def __str__(self) -> str:
+        basis = f'{self.samples} past encodes' if self.samples else 'priors'
+        return f'{self.preset}: ~{self.bytes / 1e9:.2f} GB in ~{self.seconds / 60:.0f} min ({basis})'
+
+
+def OutputGeometry(info: VideoInfo, preset: dict) -> tuple[int, int, float]:
+    """Output width, height and frame rate after the preset's videoFilter."""
+    width, height, fps = info.width, info.height, info.fps
+    for f in (preset.get('videoFilter') or '').split(','):
+        name, _, args = f.strip().partition('=')
+        if name == 'scale':
+            w, h = (int(float(v)) for v in args.split(':')[:2])
+            dar = info.dar[0] / info.dar[1] if info.dar[1] else width / height
+            width = w if w > 0 else round(h * dar / 2) * 2
+            height = h if h > 0 else round(width / dar / 2) * 2
+        elif name == 'fps':
+            num, _, den = args.partition('/')
+            fps = float(num) / float(den or 1)
+        elif name in ('yadif', 'bwdif') and re.match(r'(mode=)?(1|send_field)\b', args):
+            fps *= 2
+    return width, height, fps
+
+
+class EncodePredictor:
+    def __init__(self, history: Optional[History] = None):
+        self.history = history
+
+    def Estimate(self, presetName: str, preset: dict, encoder: str, duration: float, info: VideoInfo) -> EncodeEstimate:
+        width, height, fps = OutputGeometry(info, preset)
+        pixels = width * height * fps * duration
+
+        rows = self.history.Encodes(encoder=encoder, preset=presetName) if self.history else []
+        if rows:
+            bpp = statistics.median(r['bytes'] * 8 / (r['duration'] * r['width'] * r['height'] * r['fps']) for r in rows)
+            size = bpp * pixels / 8
+        else:
+            bpp = _PRIOR_BPP_AT_CRF23 * 2 ** ((23 - preset.get('crf', 23)) / 6)
+            if '_nvenc' in encoder:
+                bpp *= _PRIOR_NVENC_BPP_FACTOR
+            size = bpp * pixels / 8 + _AUDIO_BYTES_PER_SEC * duration
+
+        # Speed depends on the encoder much more than on the preset.
+        speedRows = rows or (self.history.Encodes(encoder=encoder) if self.history else [])
+        if speedRows:
+            speed = statistics.median(r['duration'] * r['width'] * r['height'] * r['fps'] / r['seconds'] for r in speedRows if r['seconds'] > 0)
+        else:
+            speed = _PRIOR_SPEED['nvenc' if '_nvenc' in encoder else 'software']
+        return EncodeEstimate(preset=presetName, bytes=size, seconds=pixels / speed, samples=len(rows))
+
+    def EstimateAll(self, presets: dict, encoder: str, duration: float, info: VideoInfo) -> list[EncodeEstimate]:
+        return [self.Estimate(name, preset, encoder, duration, info) for name, preset in presets.items()]
+
+    def Record(self, name: str, presetName: str, preset: dict, encoder: str, duration: float, info: VideoInfo, bytes: int, seconds: float):
+        if self.history is None or duration <= 0 or seconds <= 0:
+            return
+        width, height, fps = OutputGeometry(info, preset)
+        self.history.AddEncode(name=name, preset=presetName, encoder=encoder, duration=duration,
+                               width=width, height=height, fps=fps, bytes=bytes, seconds=seconds)
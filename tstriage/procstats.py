@@ -0,0 +1,150 @@
+"""CPU time, bytes read and peak RSS of child processes, sampled with psutil.
+
+Spawn sites call track(pid) right after starting a child; every Meter that is
+active in the current context then follows that child and its descendants
+until they exit. Usage is sampled, so the last fraction of a second of each
+process and very short-lived processes are not counted.
+"""
+
+import contextvars, logging, threading
+from dataclasses import dataclass
+import psutil
+
+logger = logging.getLogger('tstriage.procstats')
+
+SAMPLE_INTERVAL = 0.5
+
+_meters: contextvars.ContextVar[tuple['Meter', ...]] = contextvars.ContextVar('tstriage_meters', default=())
+
+
+@dataclass
+class Usage:
+    cpu: float = 0.0        # user + system seconds
+    read_bytes: int = 0     # bytes requested by read syscalls (includes pipes)
+    peak_rss: int = 0       # largest single-process RSS seen
+
+
+@dataclass
+class _Seen:
+    cpu: float = 0.0
+    read_bytes: int = 0
+    peak_rss: int = 0
+
+
+def _sample_process(p: psutil.Process, seen: dict[int, _Seen]):
+    try:
+        with p.oneshot():
+            times = p.cpu_times()
+            rss = p.memory_info().rss
+            try:
+                io = p.io_counters()
+                read = getattr(io, 'read_chars', io.read_bytes)
+            except (psutil.AccessDenied, AttributeError):
+                read = 0
+    except (psutil.NoSuchProcess, psutil.ZombieProcess, psutil.AccessDenied):
+        return
+    s = seen.setdefault(p.pid, _Seen())
+    s.cpu = max(s.cpu, times.user + times.system)
+    s.read_bytes = max(s.read_bytes, read)
+    s.peak_rss = max(s.peak_rss, rss)
+
+
+class Meter:
+    """Accumulate usage of every child tracked while the meter is active."""
+
+    def __init__(self):
+        self._roots: dict[int, psutil.Process] = {}
+        self._seen: dict[int, _Seen] = {}
+        self._lock = threading.Lock()
+        self._token = None
+
+    def __enter__(self) -> 'Meter':
+        self._token = _meters.set(_meters.get() + (self,))
+        _sampler.add(self)
+        return self
+
+    def __exit__(self, *args):
+        self.sample()
+        _sampler.remove(self)
+        _meters.reset(self._token)
+
+    @staticmethod
+    def watch(pid: int) -> 'Meter':
+        """Sample a single process tree outside of any stage, until close()."""
+        meter = Meter()
+        meter.add(pid)
+        _sampler.add(meter)
+        return meter
+
+    def close(self) -> Usage:
+        _sampler.remove(self)
+        return self.usage()
+
+    def add(self, pid: int):
+        try:
+            p = psutil.Process(pid)
+        except psutil.NoSuchProcess:
+            return
+        with self._lock:
+            self._roots[pid] = p
+        _sample_process(p, self._seen)
+
+    def sample(self):
+        with self._lock:
+            roots = list(self._roots.items())
+        for pid, root in roots:
+            if not root.is_running():
+                with self._lock:
+                    self._roots.pop(pid, None)
+                continue
+            try:
+                children = root.children(recursive=True)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                children = []
+            for p in [root, *children]:
+                _sample_process(p, self._seen)
+
+    def usage(self, pids=None) -> Usage:
+        """Total usage, or usage of the given pids only."""
+        seen = [s for pid, s in self._seen.items() if pids is None or pid in pids]
+        return Usage(cpu=sum(s.cpu for s in seen),
+                     read_bytes=sum(s.read_bytes for s in seen),
+                     peak_rss=max((s.peak_rss for s in seen), default=0))
+
+
+class _Sampler:
+    def __init__(self):
+        self._meters: set[Meter] = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, meter: Meter):
+        with self._lock:
+            self._meters.add(meter)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='procstats', daemon=True)
+                self._thread.start()
+
+    def remove(self, meter: Meter):
+        with self._lock:
+            self._meters.discard(meter)
+
+    def _run(self):
+        event = threading.Event()
+        while not event.wait(SAMPLE_INTERVAL):
+            with self._lock:
+                meters = list(self._meters)
+            for meter in meters:
+                try:
+                    meter.sample()
+                except Exception:
+                    logger.debug('sampling failed', exc_info=True)
+
+
+_sampler = _Sampler()
+
+
+def track(pid: int):
+    """Attribute a newly started child process to every active Meter."""
+    for meter in _meters.get():
+        meter.add(pid)
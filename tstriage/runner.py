@@ -1,28 +1,55 @@
 #!/usr/bin/env python3
-import json, os, socket, sys
+import contextlib, errno, json, os, signal, socket, subprocess, tempfile, threading, time, urllib.error
 import shutil
+from dataclasses import asdict
 from itertools import chain
 from pathlib import Path
 import logging
 import unicodedata
-import psutil
-import click
+from typing import TYPE_CHECKING, Iterator
 import yaml
-from rich.console import Console
-from rich.logging import RichHandler
-from rich.progress import Progress as RichProgress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn, TimeRemainingColumn
-from rich.table import Column
 from . import __version__
+from .admission import Admission, priority
 from . import cli_config
-from ._progress import SubprocessProgress, _UnitColumn
-
-console = Console(width=None if sys.stderr.isatty() else sys.maxsize)
 from .epgstation import EPGStation
-from .tasks import Analyze, Mark, Cut, Encode, Confirm, Cleanup
+from .history import History
+from .locks import FileLock
+from . import metrics, tracing
 from .nas import NAS
+from .predictor import EncodePredictor
+from .procstats import Meter
+from .scratch import UPSTREAM, ScratchStore
+from .scheduler import EncoderScheduler, EncoderSlots, EncodeJob, EstimateDuration
+
+# Stage code (tasks → pipeline → pysubs2, ffmpeg, numpy), Rich progress and
+# duplicate detection are imported by the methods that use them, so that
+# commands which need none of them start quickly (see tests/test_import_time.py).
+if TYPE_CHECKING:
+    from rich.progress import Progress as RichProgress
+    from .duplicates import RecordingFingerprint
 
 logger = logging.getLogger('tstriage.runner')
 
+# Failures worth retrying: EPGStation timeouts and connection errors, hung child processes,
+# and NAS hiccups (OSErrors with the errnos below). Anything else, such as a missing recording
+# or an unwritable destination, is quarantined at once.
+TRANSIENT_ERRORS = (TimeoutError, ConnectionError, urllib.error.URLError, subprocess.TimeoutExpired)
+TRANSIENT_ERRNOS = {getattr(errno, name) for name in ('EIO', 'ESTALE', 'EAGAIN', 'EBUSY', 'ETIMEDOUT', 'EHOSTDOWN',
+                                                       'EHOSTUNREACH', 'ENETDOWN', 'ENETUNREACH', 'ENETRESET', 'EREMOTEIO')
+                    if hasattr(errno, name)}
+
+
+def _IsTransient(e: BaseException) -> bool:
+    if isinstance(e, BrokenPipeError):  # the reader went away; retrying will not bring it back
+        return False
+    return isinstance(e, TRANSIENT_ERRORS) or (isinstance(e, OSError) and e.errno in TRANSIENT_ERRNOS)
+
+# Ctrl+C reaches the children too. A child may die of it before the main thread has set
+# _interrupted, so a failing item waits this long for the flag before it is quarantined.
+INTERRUPT_GRACE = 0.5  # seconds
+
+ACTION_ITEM_STATES = ('error', 'duplicate', 'categorized', 'toanalyze', 'tomark', 'tocut', 'toencode', 'toconfirm', 'tocleanup')
+
 class Runner:
     def __init__(self, configuration, quiet: bool):
         self.configuration = configuration
@@ -32,25 +59,31 @@ class Runner:
             tscutter=cli.get('tscutter', ''),
             tsmarker=cli.get('tsmarker', ''),
         )
-        self.encoder = configuration['Encoder']
         self.presets = configuration['Presets']
+        self.pipeline = configuration.get('Pipeline') or {}
+        self.scheduler = EncoderScheduler.FromConfig(configuration)
+        self.history = History.FromConfig(configuration)
+        self.predictor = EncodePredictor(self.history)
+        self._interrupted = threading.Event()
+        retry = configuration.get('Retry') or {}
+        self.retries = int(retry.get('retries', 0))
+        self.backoff = float(retry.get('backoff', 30))
+        self.failed: list[str] = []
+        self.duplicates: list[str] = []
         self.epgStation = EPGStation(url=configuration['EPGStation'])
+        self.admission = Admission.FromConfig(configuration, self.epgStation)
         self.nas = NAS(
             recorded=Path(self.configuration['Uncategoried']).expanduser(),
             destination=Path(configuration['Destination']).expanduser())
+        self.scratch = ScratchStore.FromConfig(configuration, self.nas.tstriageFolder)
+        self._scratchUsed: int | None = None  # read once per upstream stage, see _ProcessItem
     
-    # wait for other instances to finish
-    def SingleInstanceWait(self):
-        allProcesses = psutil.process_iter(attrs=['pid', 'name'])
-        currentProcess = psutil.Process()
-        for process in allProcesses:
-            if process.info['name'] == currentProcess.name and process.info['pid'] != currentProcess.pid: # type: ignore
-                logger.info(f'waiting for process {process.info["pid"]} to finish ...') # type: ignore
-                process.wait()
-
     def Categorize(self):
+        from .duplicates import RecordingFingerprint
+        detect = bool(self.pipeline.get('duplicates', False))
+        known = self._InFlightFingerprints() if detect else []
         for path in self.nas.SearchUnprocessedFiles():
-            destination = None
+            destination, epg = None, None
             for keyword in sorted(self.epgStation.GetKeywords(), key=len, reverse=True):
                 if unicodedata.normalize('NFKC', keyword) in unicodedata.normalize('NFKC', path.stem):
                     epg = self.epgStation.GetEPG(path)
@@ -66,8 +99,47 @@ class Runner:
                 'path': str(path),
                 'destination': str(destination) if destination is not None else None,
             }
+            if detect and destination is not None:
+                fingerprint = RecordingFingerprint.Compute(path, epg)
+                item['fingerprint'] = asdict(fingerprint)
+                original = self._FindDuplicate(fingerprint, known)
+                if original is not None:
+                    item['duplicateOf'] = original
+                    logger.info(f'{path.name} is a duplicate of {original}, not processing it')
+                    self.CreateActionItem(item, '.duplicate')
+                    self.duplicates.append(f'{path.stem} (of {original})')
+                    continue
+                known.append((path.stem, fingerprint))
             self.CreateActionItem(item, '.categorized')
 
+    def _InFlightFingerprints(self) -> list[tuple[str, 'RecordingFingerprint']]:
+        """Fingerprints of the action items on the NAS, except those of duplicates."""
+        from .duplicates import RecordingFingerprint
+        known = []
+        for path in self.nas.ActionItems():
+            if path.suffix == '.duplicate':
+                continue
+            try:
+                with path.open(encoding='utf-8') as f:
+                    raw = json.load(f)
+                if 'fingerprint' in raw:
+                    known.append((Path(raw['path'].replace('\\', '/')).stem, RecordingFingerprint(**raw['fingerprint'])))
+            except (OSError, ValueError, TypeError):
+                continue
+        return known
+
+    def _FindDuplicate(self, fingerprint: 'RecordingFingerprint', known: list[tuple[str, 'RecordingFingerprint']]) -> str | None:
+        from .duplicates import WINDOW_DAYS, RecordingFingerprint
+        for name, other in known:
+            if fingerprint.Matches(other):
+                return name
+        if self.history is not None and fingerprint.program is not None:
+            since = time.time() - float(self.pipeline.get('duplicatesWindow', WINDOW_DAYS)) * 86400
+            for row in self.history.Fingerprints(fingerprint.program, since):
+                if fingerprint.Matches(RecordingFingerprint(row['program'], row['duration'], row['content'], row['episode'], row['event'])):
+                    return row['name']
+        return None
+
     def LoadActionItem(self, path: Path) -> dict[str, str]:
         with path.open() as f:
             item = json.load(f)
@@ -93,177 +165,416 @@ class Runner:
     
     def List(self):
         for path in self.nas.ActionItems('.categorized'):
-            item = self.LoadActionItem(path)
-            encodeTo = item["destination"]
-            if encodeTo != 'None':
-                with self.nas.FindTsTriageSettings(folder=Path(encodeTo)).open() as f:
-                    settings = json.load(f)
-                path.unlink()
-                newItem = {
-                    'path': item['path'],
-                    'destination': item['destination'],
-                    'cutter': settings.get('cutter', {}),
-                    'marker': settings.get('marker', {}),
-                    'encoder': settings.get('encoder', {})
-                }
-                self.CreateActionItem(newItem, '.toanalyze')
-                logger.info(f'Will process: {item["path"]}')
-            else:
-                logger.warning(f'More information is needed: {item["path"]}')
+            with self._ItemLock(path) as mine:
+                if not mine:
+                    continue
+                item = self.LoadActionItem(path)
+                encodeTo = item["destination"]
+                if encodeTo != 'None':
+                    with self.nas.FindTsTriageSettings(folder=Path(encodeTo)).open() as f:
+                        settings = json.load(f)
+                    path.unlink()
+                    newItem = {
+                        'path': item['path'],
+                        'destination': item['destination'],
+                        'cutter': settings.get('cutter', {}),
+                        'marker': settings.get('marker', {}),
+                        'encoder': settings.get('encoder', {})
+                    }
+                    if 'fingerprint' in item:
+                        newItem['fingerprint'] = item['fingerprint']
+                    self.CreateActionItem(newItem, '.toanalyze')
+                    logger.info(f'Will process: {item["path"]}')
+                else:
+                    logger.warning(f'More information is needed: {item["path"]}')
+
+    def _Progress(self) -> 'RichProgress':
+        from rich.progress import Progress as RichProgress, SpinnerColumn, TextColumn, BarColumn, TimeElapsedColumn, TimeRemainingColumn
+        from rich.table import Column
+        from ._progress import _UnitColumn
+        from .cli import get_console
+        return RichProgress(
+            SpinnerColumn(), TextColumn("{task.description}", table_column=Column(overflow="ellipsis")), _UnitColumn(), BarColumn(), TimeElapsedColumn(), TimeRemainingColumn(),
+            console=get_console(), transient=False, refresh_per_second=10)
+
+    def _ProcessItem(self, rich: 'RichProgress', path: Path, suffix: str, verb: str, work, nextSuffix: str) -> Path | None:
+        """Claim an action item for this host, run work(item, progress) and hand it on to nextSuffix.
+
+        Analyze, Mark and Cut leave the item queued while scratch space is short (see
+        scratch.py). With Admission configured, waits until the host has room for the job
+        before claiming the item. Items locked by another tstriage run on this host, or taken meanwhile by
+        another host, are left alone and None is returned. Transient errors are retried as
+        configured under Retry. Items that still fail are quarantined as .error (see
+        _Quarantine) and None is returned, so the stage moves on to the next item;
+        interrupted ones are put back as they were.
+        """
+        if suffix.removeprefix('.to') in UPSTREAM and self.scratch.Limited:
+            if self._scratchUsed is None:
+                self._scratchUsed = self._ScratchUsed()
+            reason = self.scratch.Pressure(self._scratchUsed)
+            if reason is not None:
+                logger.info(f'not {verb} "{path.stem}" for now: {reason}')
+                return None
+        if self.admission is not None:
+            # Before claiming, so that another host with room can take the item meanwhile.
+            self.admission.Wait(f'{verb} "{path.stem}"', self._interrupted)
+        with self._ItemLock(path) as mine:
+            return self._Process(rich, path, suffix, verb, work, nextSuffix) if mine else None
+
+    @contextlib.contextmanager
+    def _ItemLock(self, path: Path) -> Iterator[bool]:
+        """Hold the lock of an action item; yields False if another tstriage run on this host
+        holds it or the item is gone (claimed by another host, or done)."""
+        lock = FileLock.For('item', path.stem)
+        if not lock.acquire(blocking=False):
+            logger.info(f'"{path.stem}" is being processed by another tstriage run')
+            yield False
+            return
+        try:
+            yield path.exists()
+        finally:
+            lock.release()
+
+    def _Process(self, rich: 'RichProgress', path: Path, suffix: str, verb: str, work, nextSuffix: str) -> Path | None:
+        from ._progress import SubprocessProgress
+        item = self.LoadActionItem(path)
+        item.pop('error', None)  # left by an earlier failure if the item was re-queued by hand
+        name = Path(item['path']).stem
+        stage = suffix.removeprefix('.to')
+        original = path
+        path = path.rename(path.with_suffix(f'{suffix}.{socket.gethostname()}'))
+        status = 'error'
+        started, wallStart = time.time(), time.monotonic()
+        meter = Meter()
+        progress = None
+        attempts = 0
+        try:
+            progress = SubprocessProgress(rich, ctx=name, stage=stage)
+            niceness = self.admission.Priority(stage) if self.admission is not None else None
+            with meter, priority(niceness), tracing.span('item', item=name, stage=stage, host=socket.gethostname()):
+                while True:
+                    attempts += 1
+                    try:
+                        work(item, progress)
+                        break
+                    except Exception as e:
+                        if not _IsTransient(e) or attempts > self.retries or self._interrupted.is_set():
+                            raise
+                        delay = self.backoff * 2 ** (attempts - 1)
+                        logger.warning(f'{verb} "{name}" failed ({e}), retry {attempts}/{self.retries} in {delay:.0f}s')
+                        if self._interrupted.wait(delay):
+                            raise KeyboardInterrupt
+            status = 'ok'
+            self.scratch.Reclaim(item, stage)
+            path.unlink()
+            return self.CreateActionItem(item, nextSuffix)
+        except KeyboardInterrupt:
+            status = 'interrupted'
+            path.rename(original)
+            raise
+        except BaseException as e:
+            if self._interrupted.is_set() or self._interrupted.wait(INTERRUPT_GRACE):
+                status = 'interrupted'
+                path.rename(original)
+                raise KeyboardInterrupt
+            logger.exception(f'in {verb} "{path}":')
+            metrics.FAILURES.inc(stage=stage)
+            self._Quarantine(path, stage, e, progress.stderr_tail() if progress is not None else [], attempts)
+            if not isinstance(e, Exception):
+                raise
+            return None
+        finally:
+            metrics.STAGE_ITEMS.inc(stage=stage, status=status)
+            self._RecordStage(item, stage, started, time.monotonic() - wallStart, meter, status)
+
+    def _Quarantine(self, path: Path, stage: str, error: BaseException, stderr: list[str], attempts: int = 1):
+        """Rename a failed action item to .error, recording why it failed in the item itself.
+
+        Rename it back to its stage suffix (e.g. .toencode) to retry it.
+        """
+        try:
+            with path.open(encoding='utf-8') as f:
+                raw = json.load(f)
+            raw['error'] = {
+                'stage': stage,
+                'host': socket.gethostname(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'type': type(error).__name__,
+                'message': str(error),
+                'attempts': attempts,
+                'stderr': stderr,
+            }
+            with path.open('w', encoding='utf-8') as f:
+                json.dump(raw, f, ensure_ascii=False, indent=True)
+        except (OSError, ValueError) as e:
+            logger.warning(f'could not record the error in "{path}": {e}')
+        path.rename(path.with_suffix('.error'))
+        self.failed.append(f'{stage}: {path.name.split(".")[0]}')
+
+    def _ScratchUsed(self) -> int:
+        """Bytes of the intermediates tracked by the action items on the NAS."""
+        items = []
+        for path in self.nas.ActionItems():
+            try:
+                with path.open(encoding='utf-8') as f:
+                    items.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return self.scratch.Used(items)
+
+    def _RecordStage(self, item, stage: str, started: float, wall: float, meter: Meter, status: str):
+        if self.history is None:
+            return
+        path = Path(item['path'])
+        descPath = self.nas.destination / item['destination'] / path.with_suffix('.yaml').name
+        channel = None
+        try:
+            with descPath.open(encoding='utf-8') as f:
+                channel = (yaml.safe_load(f) or {}).get('serviceId_desc')
+        except (OSError, yaml.YAMLError):
+            pass
+        usage = meter.usage()
+        # Runs in _Process's finally: a failure here must not mask the item's own error,
+        # nor fail an item that was already handed on.
+        try:
+            self.history.AddStage(
+                started=started, name=path.stem, stage=stage, channel=channel,
+                preset=item.get('encoder', {}).get('preset'), host=socket.gethostname(), status=status,
+                wall=wall, cpu=usage.cpu, read_bytes=usage.read_bytes, peak_rss=usage.peak_rss,
+                versions=f'tstriage {__version__}, {cli_config.tool_versions()}')
+        except Exception as e:
+            logger.warning(f'could not record {stage} of "{path.stem}" in history: {e}')
+
+    def _SkipUpToDate(self) -> bool:
+        """Whether stages skip items whose stamp says their outputs are current (see stamps.py)."""
+        return bool(self.pipeline.get('skipUpToDate', True))
 
     def Analyze(self):
+        from .tasks import Analyze
         paths = list(self.nas.ActionItems('.toanalyze'))
-        suffix = '.toanalyze'
-        with RichProgress(
-            SpinnerColumn(), TextColumn("{task.description}", table_column=Column(overflow="ellipsis")), _UnitColumn(), BarColumn(), TimeElapsedColumn(), TimeRemainingColumn(),
-            console=console, transient=False, refresh_per_second=10
-        ) as rich:
+        self._scratchUsed = None
+        fanout = bool(self.pipeline.get('fanout', False))
+        skip = self._SkipUpToDate()
+        with self._Progress() as rich:
             file_task = rich.add_task("Analyze", total=len(paths))
             for path in paths:
-                item = self.LoadActionItem(path)
-                name = Path(item['path']).stem
-                rich.update(file_task, description=f"Analyze: {name}")
-                original = path
-                path = path.rename(path.with_suffix(f'{suffix}.{socket.gethostname()}'))
-                try:
-                    progress = SubprocessProgress(rich, ctx=name)
-                    Analyze(item=item, epgStation=self.epgStation, quiet=self.quiet, progress=progress)
-                    path.unlink()
-                    self.CreateActionItem(item, '.tomark')
-                except KeyboardInterrupt:
-                    path.rename(original)
-                    raise
-                except:
-                    logger.exception(f'in analyzing "{path}":')
-                    path.rename(path.with_suffix('.error'))
-                    raise
+                rich.update(file_task, description=f"Analyze: {path.stem}")
+                self._ProcessItem(rich, path, '.toanalyze', 'analyzing',
+                                  lambda item, progress: Analyze(item=item, epgStation=self.epgStation, quiet=self.quiet, progress=progress, fanout=fanout,
+                                                                 skipUpToDate=skip),
+                                  '.tomark')
                 rich.advance(file_task)
 
     def Mark(self):
+        from .tasks import Mark, EnsembleModel
         paths = list(self.nas.ActionItems('.tomark'))
-        suffix = '.tomark'
-        with RichProgress(
-            SpinnerColumn(), TextColumn("{task.description}", table_column=Column(overflow="ellipsis")), _UnitColumn(), BarColumn(), TimeElapsedColumn(), TimeRemainingColumn(),
-            console=console, transient=False, refresh_per_second=10
-        ) as rich:
+        self._scratchUsed = None
+        skip = self._SkipUpToDate()
+        seriesPriors = bool(self.pipeline.get('seriesPriors', False))
+        models: dict[Path, Path | None] = {}
+
+        with tempfile.TemporaryDirectory(prefix='tstriage-ensemble-') as workFolder, self._Progress() as rich:
+
+            def _model(searchFolder: Path, quiet: bool) -> Path | None:
+                # Trained on the first item that needs it, then shared by the folder's other items.
+                if searchFolder not in models:
+                    models[searchFolder] = EnsembleModel(searchFolder, quiet, workFolder=Path(workFolder) / str(len(models)))
+                return models[searchFolder]
+
             file_task = rich.add_task("Mark", total=len(paths))
             for path in paths:
-                item = self.LoadActionItem(path)
-                name = Path(item['path']).stem
-                rich.update(file_task, description=f"Mark: {name}")
-                original = path
-                path = path.rename(path.with_suffix(f'{suffix}.{socket.gethostname()}'))
-                try:
-                    progress = SubprocessProgress(rich, ctx=name)
-                    Mark(item=item, epgStation=self.epgStation, quiet=self.quiet, progress=progress)
-                    path.unlink()
-                    self.CreateActionItem(item, '.tocut')
-                except KeyboardInterrupt:
-                    path.rename(original)
-                    raise
-                except:
-                    logger.exception(f'in marking "{path}":')
-                    path.rename(path.with_suffix('.error'))
-                    raise
+                rich.update(file_task, description=f"Mark: {path.stem}")
+                self._ProcessItem(rich, path, '.tomark', 'marking',
+                                  lambda item, progress: Mark(item=item, epgStation=self.epgStation, quiet=self.quiet, progress=progress,
+                                                              skipUpToDate=skip, seriesPriors=seriesPriors, ensembleModel=_model),
+                                  '.tocut')
                 rich.advance(file_task)
 
     def Cut(self):
+        from .tasks import Cut
         paths = list(self.nas.ActionItems('.tocut'))
-        suffix = '.tocut'
-        with RichProgress(
-            SpinnerColumn(), TextColumn("{task.description}", table_column=Column(overflow="ellipsis")), _UnitColumn(), BarColumn(), TimeElapsedColumn(), TimeRemainingColumn(),
-            console=console, transient=False, refresh_per_second=10
-        ) as rich:
+        self._scratchUsed = None
+        skip = self._SkipUpToDate()
+        cutClips = bool(self.pipeline.get('cutClips', False))
+        with self._Progress() as rich:
             file_task = rich.add_task("Cut", total=len(paths))
             for path in paths:
-                item = self.LoadActionItem(path)
-                name = Path(item['path']).stem
-                rich.update(file_task, description=f"Cut: {name}")
+                rich.update(file_task, description=f"Cut: {path.stem}")
                 outputFolder = path.with_suffix("")
-                original = path
-                path = path.rename(path.with_suffix(f'{suffix}.{socket.gethostname()}'))
-                try:
-                    progress = SubprocessProgress(rich, ctx=name)
-                    Cut(item=item, outputFolder=outputFolder, quiet=self.quiet, progress=progress)
-                    path.unlink()
-                    self.CreateActionItem(item, '.toencode')
-                except KeyboardInterrupt:
-                    path.rename(original)
-                    raise
-                except:
-                    logger.exception(f'in cutting "{path}":')
-                    path.rename(path.with_suffix('.error'))
-                    raise
+
+                def _cut(item, progress):
+                    Cut(item=item, outputFolder=outputFolder, quiet=self.quiet, progress=progress, cutClips=cutClips, skipUpToDate=skip)
+                    if outputFolder.exists():
+                        # Reviewed through the clip folder; Confirm reads it.
+                        before = self.scratch.Used([item])
+                        self.scratch.Track(item, outputFolder, until='confirm')
+                        if self._scratchUsed is not None:
+                            self._scratchUsed += self.scratch.Used([item]) - before
+
+                self._ProcessItem(rich, path, '.tocut', 'cutting', _cut, '.toencode')
                 rich.advance(file_task)
 
+    def _EstimateEncode(self, item) -> float:
+        """Log predicted size/time for the item and return its encode seconds for queue ordering."""
+        from .tasks import EstimateEncode
+        name = Path(item['path']).stem
+        try:
+            estimates = EstimateEncode(item, self.scheduler.encoders[0].encoder, self.presets, self.predictor, quiet=True)
+            chosen = estimates[item['encoder']['preset']]
+        except Exception as e:
+            logger.debug(f'{name}: no prediction ({e}), ordering by program length')
+            return EstimateDuration(item)
+        logger.info(f'{name}: {chosen}')
+        for estimate in estimates.values():
+            if estimate is not chosen:
+                logger.debug(f'  {estimate}')
+        return chosen.seconds
+
     def Encode(self):
-        paths = list(self.nas.ActionItems('.toencode'))
-        suffix = '.toencode'
-        with RichProgress(
-            SpinnerColumn(), TextColumn("{task.description}", table_column=Column(overflow="ellipsis")), _UnitColumn(), BarColumn(), TimeElapsedColumn(), TimeRemainingColumn(),
-            console=console, transient=False, refresh_per_second=10
-        ) as rich:
-            file_task = rich.add_task("Encode", total=len(paths))
-            for path in paths:
-                item = self.LoadActionItem(path)
-                name = Path(item['path']).stem
-                rich.update(file_task, description=f"Encode: {name}")
-                original = path
-                path = path.rename(path.with_suffix(f'{suffix}.{socket.gethostname()}'))
-                try:
-                    progress = SubprocessProgress(rich, ctx=name)
-                    Encode(item=item, encoder=self.encoder, presets=self.presets, quiet=self.quiet, progress=progress)
-                    path.unlink()
-                    metadataFolder = Path(item['destination']) / '_metadata'
-                    newTriagePath = self.CreateActionItem(item, '.toconfirm')
+        from .tasks import Encode
+        jobs = []
+        for path in self.nas.ActionItems('.toencode'):
+            item = self.LoadActionItem(path)
+            jobs.append(EncodeJob(path=path, item=item, estimate=self._EstimateEncode(item)))
+        nativeExtract = self.pipeline.get('extract', 'native') == 'native'
+        pidFilter = bool(self.pipeline.get('pidFilter', False))
+        captions = self.pipeline.get('captions', 'auto')
+        segmentLength = float(self.pipeline.get('segmentLength') or 0)
+        skip = self._SkipUpToDate()
+        with self._Progress() as rich:
+            file_task = rich.add_task("Encode", total=len(jobs))
+
+            def _encode(job: EncodeJob, slot: EncoderSlots):
+                rich.update(file_task, description=f"Encode: {job.path.stem}")
+                newTriagePath = self._ProcessItem(rich, job.path, '.toencode', 'encoding',
+                                                  lambda item, progress: Encode(item=item, encoder=slot.encoder, presets=self.presets, quiet=self.quiet, progress=progress,
+                                                                                 threads=slot.threads, predictor=self.predictor, nativeExtract=nativeExtract, pidFilter=pidFilter,
+                                                                                 captions=captions, segmentLength=segmentLength, skipUpToDate=skip),
+                                                  '.toconfirm')
+                if newTriagePath is not None:
+                    if self.history is not None and 'fingerprint' in job.item:
+                        try:
+                            self.history.AddFingerprint(Path(job.item['path']).stem, **job.item['fingerprint'])
+                        except Exception as e:
+                            logger.warning(f'could not record the fingerprint of "{job.path.stem}" in history: {e}')
+                    metadataFolder = Path(job.item['destination']) / '_metadata'
                     shutil.copy(newTriagePath, metadataFolder / newTriagePath.with_suffix('.toencode').name)
-                except KeyboardInterrupt:
-                    path.rename(original)
-                    raise
-                except:
-                    logger.exception(f'in encoding "{path}":')
-                    path.rename(path.with_suffix('.error'))
-                    raise
                 rich.advance(file_task)
 
+            self.scheduler.Run(jobs, _encode, interrupted=self._interrupted)
+
     def Confirm(self):
+        from .tasks import Confirm
         for path in chain(self.nas.ActionItems('.toencode'), self.nas.ActionItems('.toconfirm'), self.nas.ActionItems('.tocleanup')):
-            item = self.LoadActionItem(path)
-            outputFolder = path.with_suffix("")
-            reEncodingNeeded = Confirm(item=item, outputFolder=outputFolder)
-            path.unlink()
-            if reEncodingNeeded or path.suffix == '.toencode':
-                self.CreateActionItem(item, '.toencode')
-            else:
-                self.CreateActionItem(item, '.tocleanup')
+            with self._ItemLock(path) as mine:
+                if not mine:
+                    continue
+                try:
+                    item = self.LoadActionItem(path)
+                    outputFolder = path.with_suffix("")
+                    reEncodingNeeded = Confirm(item=item, outputFolder=outputFolder, quiet=self.quiet)
+                except Exception as e:
+                    logger.exception(f'in confirming "{path}":')
+                    metrics.FAILURES.inc(stage='confirm')
+                    self._Quarantine(path, 'confirm', e, [])
+                    continue
+                path.unlink()
+                if reEncodingNeeded or path.suffix == '.toencode':
+                    self.CreateActionItem(item, '.toencode')
+                else:
+                    self.scratch.Reclaim(item, 'confirm')
+                    self.CreateActionItem(item, '.tocleanup')
 
     def Cleanup(self):
+        from .tasks import Cleanup
         for path in self.nas.ActionItems('.tocleanup'):
-            item = self.LoadActionItem(path)
-            Cleanup(item=item)
-    
-    def Run(self, tasks):
-        self.SingleInstanceWait()
+            with self._ItemLock(path) as mine:
+                if not mine:
+                    continue
+                try:
+                    item = self.LoadActionItem(path)
+                    self.scratch.Reclaim(item, 'cleanup')
+                    Cleanup(item=item)
+                except Exception as e:
+                    logger.exception(f'in cleaning up "{path}":')
+                    metrics.FAILURES.inc(stage='cleanup')
+                    self._Quarantine(path, 'cleanup', e, [])
+
+    def _CollectQueue(self):
+        """Refresh tstriage_queue_items from the action items on the NAS."""
+        metrics.QUEUE_ITEMS.clear()
+        for state in ACTION_ITEM_STATES:
+            metrics.QUEUE_ITEMS.set(0, state=state, host='')
+        for path in self.nas.ActionItems():
+            for state in ACTION_ITEM_STATES:
+                if path.name.endswith(f'.{state}'):
+                    metrics.QUEUE_ITEMS.inc(state=state, host='')
+                    break
+                if f'.{state}.' in path.name:
+                    metrics.QUEUE_ITEMS.inc(state=state, host=path.name.rsplit('.', 1)[1])
+                    break
 
+    def ServeMetrics(self):
+        options = self.configuration.get('Metrics')
+        if options is None:
+            return
+        options = options or {}
+        metrics.REGISTRY.collector(self._CollectQueue)
+        metrics.serve(address=options.get('address', '127.0.0.1'), port=int(options.get('port', 9464)))
+
+    def ServeLLMProxy(self):
+        """Put the caching LLM proxy between tsmarker speech marking and OPENAI_API_BASE."""
+        from .llmproxy import LLMProxy
+        proxy = LLMProxy.FromConfig(self.configuration, os.environ.get('OPENAI_API_BASE'))
+        if proxy is None:
+            return
+        proxy.Serve()
+        os.environ['OPENAI_API_BASE'] = proxy.url
+
+    def Run(self, tasks) -> int:
+        """Run the tasks in order; returns the number of items quarantined as .error."""
+        self._interrupted.clear()
+        self.ServeMetrics()
+        self.ServeLLMProxy()
+        tracePath = self.configuration.get('Tracing')
+        if tracePath:
+            tracing.enable()
+        try:
+            with self._InterruptHandler(), tracing.span('run', tasks=' '.join(tasks), version=__version__):
+                self._RunTasks(tasks)
+        finally:
+            if tracePath:
+                tracing.export(Path(tracePath))
+        if self.duplicates:
+            logger.warning(f'{len(self.duplicates)} recording(s) parked as .duplicate, rename to .categorized to process: {", ".join(self.duplicates)}')
+        if self.failed:
+            logger.error(f'{len(self.failed)} item(s) moved to .error: {", ".join(self.failed)}')
+        return len(self.failed)
+
+    @contextlib.contextmanager
+    def _InterruptHandler(self) -> Iterator[None]:
+        """Set _interrupted as soon as Ctrl+C arrives, so that stage workers whose children die
+        of the same SIGINT put their items back instead of quarantining them."""
+        if threading.current_thread() is not threading.main_thread():
+            yield
+            return
+
+        def _handler(signum, frame):
+            self._interrupted.set()
+            signal.default_int_handler(signum, frame)
+
+        previous = signal.signal(signal.SIGINT, _handler)
+        try:
+            yield
+        finally:
+            signal.signal(signal.SIGINT, previous)
+
+    def _RunTasks(self, tasks):
         logger.info(f'running {tasks} ...')
         for task in tasks:
             try:
-                if task == 'categorize':
-                    self.Categorize()
-                elif task == 'list':
-                    self.List()
-                elif task == 'analyze':
-                    self.Analyze()
-                elif task == 'mark':
-                    self.Mark()
-                elif task == 'cut':
-                    self.Cut()
-                elif task == 'encode':
-                    self.Encode()
-                elif task == 'confirm':
-                    self.Confirm()
-                elif task == 'cleanup':
-                    self.Cleanup()
+                with tracing.span(task):
+                    self._RunTask(task)
             except KeyboardInterrupt:
                 logger.info('interrupted by user')
                 break
@@ -271,168 +582,25 @@ class Runner:
                 logger.warning(f'File not found during {task} task. Please check the configuration and input files.')
                 continue
 
-def _expand_env_vars(obj):
-    """Recursively expand environment variables in configuration values.
-
-    Supports both ${VAR_NAME} and $VAR_NAME syntax.
-    """
-    if isinstance(obj, dict):
-        return {k: _expand_env_vars(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [_expand_env_vars(v) for v in obj]
-    elif isinstance(obj, str):
-        # Expand environment variables in string
-        return os.path.expandvars(obj)
-    else:
-        return obj
-
-def _inject_env_vars(configuration):
-    """Inject environment variables from configuration.
-
-    Looks for 'Environment', 'Env', or 'environment' section in configuration
-    and sets those key-value pairs as environment variables.
-    """
-    # Try different possible keys for environment section
-    env_section = None
-    for key in ['Environment', 'Env', 'environment', 'env']:
-        if key in configuration:
-            env_section = configuration[key]
-            break
-
-    if env_section and isinstance(env_section, dict):
-        for key, value in env_section.items():
-            if isinstance(value, (str, int, float, bool)):
-                # Convert to string for environment variable
-                os.environ[key] = str(value)
-                logger.info(f'Set environment variable: {key}')
-            elif value is None:
-                # Remove environment variable if value is None
-                if key in os.environ:
-                    del os.environ[key]
-                    logger.info(f'Removed environment variable: {key}')
-
-@click.group(context_settings={'help_option_names': ['-h', '--help']})
-@click.option('--config', '-c', default='tstriage.config.yml', show_default=True, help='Configuration file path')
-@click.option('--quiet', '-q', is_flag=True, help='Suppress non-error output')
-@click.option('--verbose', '-v', is_flag=True, help='Enable debug output')
-@click.version_option(__version__, prog_name='tstriage', message='%(prog)s %(version)s')
-@click.pass_context
-def cli(ctx, config, quiet, verbose):
-    """MPEG TS Triage Runner — batch processing pipeline for TV broadcast TS files.
-
-    Processes recorded TS files through the pipeline:
-
-    categorize -> list -> analyze -> mark -> cut -> encode -> confirm -> cleanup
-
-    \b
-    Examples:
-      tstriage run categorize list analyze mark cut encode confirm cleanup
-      tstriage categorize                             # single task
-    """
-    if verbose:
-        log_level = logging.DEBUG
-    elif quiet:
-        log_level = logging.WARNING
-    else:
-        log_level = logging.INFO
-    logging.basicConfig(
-        level=log_level, format='%(message)s', datefmt='[%X]',
-        handlers=[RichHandler(console=console, rich_tracebacks=True)])
-
-    ctx.ensure_object(dict)
-    ctx.obj['config'] = config
-    ctx.obj['quiet'] = quiet
-
-
-def _load_config(ctx):
-    """Load and prepare configuration from YAML file."""
-    config_path = Path(ctx.obj['config'])
-    with config_path.open(encoding='utf-8') as f:
-        configuration = yaml.safe_load(f)
-    configuration = _expand_env_vars(configuration)
-    _inject_env_vars(configuration)
-    return configuration
-
-
-def _run_tasks(ctx, tasks):
-    """Create Runner and execute the given tasks."""
-    configuration = _load_config(ctx)
-    Runner(configuration, quiet=ctx.obj['quiet']).Run(tasks)
-
-
-@cli.command()
-@click.pass_context
-def categorize(ctx):
-    """Match unprocessed TS files against EPGStation keywords, create .categorized items."""
-    _run_tasks(ctx, ['categorize'])
-
-
-@cli.command(name='list')
-@click.pass_context
-def list_cmd(ctx):
-    """Convert .categorized items to .toanalyze using tstriage.json settings."""
-    _run_tasks(ctx, ['list'])
-
-
-@cli.command()
-@click.pass_context
-def analyze(ctx):
-    """Run tscutter analyze and tsmarker prepare-subtitles/extract-logo, create .tomark items."""
-    _run_tasks(ctx, ['analyze'])
-
-
-@cli.command()
-@click.pass_context
-def mark(ctx):
-    """Run tsmarker mark (subtitles/logo/clipinfo/speech), create .tocut items."""
-    _run_tasks(ctx, ['mark'])
-
-
-@cli.command()
-@click.pass_context
-def cut(ctx):
-    """Cut CM segments via tsmarker cut, create .toencode items."""
-    _run_tasks(ctx, ['cut'])
-
-
-@cli.command()
-@click.pass_context
-def encode(ctx):
-    """Encode program clips to MKV via ffmpeg, create .toconfirm items."""
-    _run_tasks(ctx, ['encode'])
-
-
-@cli.command()
-@click.pass_context
-def confirm(ctx):
-    """Review encoded output with tsmarker groundtruth, decide re-encode or cleanup."""
-    _run_tasks(ctx, ['confirm'])
-
-
-@cli.command()
-@click.pass_context
-def cleanup(ctx):
-    """Remove temporary cache files for completed items."""
-    _run_tasks(ctx, ['cleanup'])
-
-
-@cli.command()
-@click.argument('tasks', nargs=-1, required=True, type=click.Choice([
-    'categorize', 'list', 'analyze', 'mark', 'cut', 'encode', 'confirm', 'cleanup'
-]))
-@click.pass_context
-def run(ctx, tasks):
-    """Run multiple pipeline tasks in sequence.
-
-    TASKS: one or more task names to execute in order.
-    Example: tstriage run categorize list analyze mark cut encode confirm cleanup
-    """
-    _run_tasks(ctx, list(tasks))
-
-
-def main():
-    cli()
+    def _RunTask(self, task):
+        if task == 'categorize':
+            self.Categorize()
+        elif task == 'list':
+            self.List()
+        elif task == 'analyze':
+            self.Analyze()
+        elif task == 'mark':
+            self.Mark()
+        elif task == 'cut':
+            self.Cut()
+        elif task == 'encode':
+            self.Encode()
+        elif task == 'confirm':
+            self.Confirm()
+        elif task == 'cleanup':
+            self.Cleanup()
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    from .cli import main
+    main()
@@ -0,0 +1,141 @@
+"""Encode job scheduling across encoder slots.
+
+Each configured encoder contributes a number of slots; a job occupies one slot
+and runs with that encoder's threads-per-job setting. Jobs are started
+longest-first (LPT), so a long movie does not end up starting last on an
+otherwise idle box.
+"""
+
+import contextvars, logging, threading
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Optional
+import yaml
+
+logger = logging.getLogger('tstriage.scheduler')
+
+# ISDB-T transport streams run at roughly 17 Mbps; used when no EPG duration is known.
+_FALLBACK_BITRATE = 17_000_000
+
+
+@dataclass
+class EncoderSlots:
+    encoder: str
+    slots: int = 1
+    threads: int = 0  # 0 → let ffmpeg decide
+
+
+@dataclass
+class EncodeJob:
+    path: Path
+    item: dict[str, Any]
+    estimate: float = 0.0  # seconds, only used for ordering
+
+
+def EstimateDuration(item: dict[str, Any]) -> float:
+    """Estimate program length in seconds from the EPG description written by Analyze."""
+    path = Path(item['path'])
+    descPath = Path(item['destination']) / path.with_suffix('.yaml').name
+    if descPath.exists():
+        try:
+            with descPath.open(encoding='utf-8') as f:
+                desc = yaml.safe_load(f)
+            return float(desc['duration']) / 1000
+        except (yaml.YAMLError, KeyError, TypeError, ValueError):
+            logger.debug(f'No usable duration in {descPath.name}')
+    try:
+        return path.stat().st_size * 8 / _FALLBACK_BITRATE
+    except OSError:
+        return 0.0
+
+
+class EncoderScheduler:
+    def __init__(self, encoders: list[EncoderSlots], maxJobs: int = 0):
+        if not encoders:
+            raise ValueError('at least one encoder is required')
+        self.encoders = encoders
+        totalSlots = sum(e.slots for e in encoders)
+        self.maxJobs = min(maxJobs, totalSlots) if maxJobs > 0 else totalSlots
+        self._free = {e.encoder: e.slots for e in encoders}
+        self._running = 0
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def FromConfig(configuration: dict) -> 'EncoderScheduler':
+        scheduler = configuration.get('Scheduler') or {}
+        encoders = scheduler.get('encoders') or {configuration['Encoder']: {}}
+        return EncoderScheduler(
+            [EncoderSlots(encoder=name,
+                          slots=int((options or {}).get('slots', 1)),
+                          threads=int((options or {}).get('threads', 0)))
+             for name, options in encoders.items()],
+            maxJobs=int(scheduler.get('maxJobs', 0)))
+
+    def Order(self, jobs: list[EncodeJob]) -> list[EncodeJob]:
+        return sorted(jobs, key=lambda job: job.estimate, reverse=True)
+
+    def _Acquire(self) -> Optional[EncoderSlots]:
+        # Encoders are tried in configuration order, so list the fastest first.
+        if self._running >= self.maxJobs:
+            return None
+        for slot in self.encoders:
+            if self._free[slot.encoder] > 0:
+                self._free[slot.encoder] -= 1
+                self._running += 1
+                return slot
+        return None
+
+    def _Release(self, slot: EncoderSlots):
+        with self._cond:
+            self._free[slot.encoder] += 1
+            self._running -= 1
+            self._cond.notify_all()
+
+    def Run(self, jobs: list[EncodeJob], work: Callable[[EncodeJob, EncoderSlots], None],
+            interrupted: Optional[threading.Event] = None):
+        """Run work(job, slot) for every job, longest first, within the slot limits.
+
+        The first failure stops further admissions; running jobs are allowed to
+        finish and the error is re-raised afterwards.
+        """
+        jobs = self.Order(jobs)
+        if self.maxJobs == 1 and len(self.encoders) == 1:
+            for job in jobs:
+                work(job, self.encoders[0])
+            return
+
+        errors: list[BaseException] = []
+        threads: list[threading.Thread] = []
+
+        def _worker(job: EncodeJob, slot: EncoderSlots):
+            try:
+                work(job, slot)
+            except BaseException as e:
+                errors.append(e)
+            finally:
+                self._Release(slot)
+
+        try:
+            for job in jobs:
+                slot = None
+                with self._cond:
+                    while not errors and (slot := self._Acquire()) is None:
+                        self._cond.wait()
+                if slot is None:
+                    break
+                logger.debug(f'{job.path.name}: {slot.encoder} (~{job.estimate / 60:.0f} min)')
+                # Workers inherit the caller's context so their spans nest under the stage span.
+                t = threading.Thread(target=contextvars.copy_context().run, args=(_worker, job, slot),
+                                     name=f'encode-{slot.encoder}', daemon=True)
+                t.start()
+                threads.append(t)
+            for t in threads:
+                t.join()
+        except KeyboardInterrupt:
+            if interrupted is not None:
+                interrupted.set()
+            for t in threads:
+                t.join()
+            raise
+        if errors:
+            raise errors[0]
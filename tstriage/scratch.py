@@ -0,0 +1,113 @@
+"""Scratch store: intermediates of action items in `_tstriage`, and when they can go.
+
+Each intermediate a stage leaves in `_tstriage` is tracked in the action item
+itself, under `artifacts`: its path relative to `_tstriage`, its size, and the
+last stage that needs it. The item carries the list from stage to stage (and
+host to host), and an artifact is removed as soon as the item has passed that
+stage. Cleanup removes whatever is left.
+
+  clip folder  `_tstriage/<name>/`, cut for review with `Pipeline.cutClips`;
+               needed until the item is confirmed
+
+With a `Scratch` section, Analyze, Mark and Cut stop taking new items while the
+tracked artifacts of all items exceed `budget` GB or less than `reserve` GB
+are free on the volume of `_tstriage`. Those items are left queued for a later
+run, while Encode, Confirm and Cleanup go on and free space.
+
+The ensemble dataset and model that Mark trains for each series folder go to
+a temporary folder that is removed when the Mark stage ends.
+
+Files that later stages of other items read, such as `_metadata` (ptsmap,
+markermap, EPG) and channel logos, are not intermediates and are kept.
+"""
+
+import logging, shutil
+from pathlib import Path
+from typing import Any, Iterable, Optional
+
+logger = logging.getLogger('tstriage.scratch')
+
+STAGES = ('analyze', 'mark', 'cut', 'encode', 'confirm', 'cleanup')
+UPSTREAM = ('analyze', 'mark', 'cut')  # throttled while scratch is short
+
+
+def Size(path: Path) -> int:
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return sum(p.stat().st_size for p in path.rglob('*') if p.is_file())
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+def _Remove(path: Path):
+    if path.is_dir():
+        shutil.rmtree(path)
+    elif path.exists():
+        path.unlink()
+
+
+class ScratchStore:
+    """Tracks the intermediates of action items in `folder` and the space they may take."""
+
+    def __init__(self, folder: Path, budget: float = 0, reserve: float = 0):
+        self.folder = Path(folder)
+        self.budget = budget    # bytes, 0 → no limit
+        self.reserve = reserve  # bytes
+
+    @staticmethod
+    def FromConfig(configuration: dict, folder: Path) -> 'ScratchStore':
+        options = configuration.get('Scratch') or {}
+        return ScratchStore(folder, budget=float(options.get('budget', 0)) * 1e9, reserve=float(options.get('reserve', 0)) * 1e9)
+
+    @property
+    def Limited(self) -> bool:
+        return bool(self.budget or self.reserve)
+
+    def Track(self, item: dict[str, Any], path: Path, until: str):
+        """Record an intermediate of the item, needed up to and including stage `until`."""
+        if until not in STAGES:
+            raise ValueError(f'unknown stage: {until}')
+        relative = Path(path).relative_to(self.folder).as_posix()
+        artifacts = [a for a in item.get('artifacts', []) if a['path'] != relative]
+        artifacts.append({'path': relative, 'until': until, 'bytes': Size(path)})
+        item['artifacts'] = artifacts
+
+    def Reclaim(self, item: dict[str, Any], done: str) -> int:
+        """Remove the intermediates of the item that no stage after `done` needs; returns bytes freed."""
+        freed, kept = 0, []
+        for artifact in item.get('artifacts', []):
+            if STAGES.index(artifact['until']) > STAGES.index(done):
+                kept.append(artifact)
+                continue
+            path = self.folder / artifact['path']
+            try:
+                _Remove(path)
+                freed += artifact['bytes']
+                logger.debug(f'reclaimed {artifact["path"]} ({artifact["bytes"] / 1e6:.0f} MB)')
+            except OSError as e:
+                logger.warning(f'could not remove {path}: {e}')
+                kept.append(artifact)
+        if kept:
+            item['artifacts'] = kept
+        else:
+            item.pop('artifacts', None)
+        return freed
+
+    @staticmethod
+    def Used(items: Iterable[dict[str, Any]]) -> int:
+        return sum(a['bytes'] for item in items for a in item.get('artifacts', []))
+
+    def Pressure(self, used: int) -> Optional[str]:
+        """Why upstream stages should not take new items, or None."""
+        if self.budget and used >= self.budget:
+            return f'intermediates take {used / 1e9:.1f} GB of {self.budget / 1e9:.0f} GB'
+        if self.reserve:
+            try:
+                free = shutil.disk_usage(self.folder).free
+            except OSError:
+                return None
+            if free < self.reserve:
+                return f'{free / 1e9:.1f} GB free in {self.folder}'
+        return None
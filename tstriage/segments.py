@@ -0,0 +1,118 @@
+"""Checkpointed encoding: an output file is encoded as segments joined at the end.
+
+EncodePipeline splits the clips of each output file into segments of about
+`segmentLength` seconds at ptsmap points (scene changes, where tscutter
+recorded byte offsets), encodes them into `<output stem>.parts/NNN.mkv` and
+records every finished segment in `_metadata/<output stem>.segments`, along
+with a hash of the encode settings. An encode that dies is resumed from the
+first unfinished segment, reading the source from that segment's byte offset,
+unless the settings changed meanwhile; the parts are then joined with the
+ffmpeg concat demuxer and their subtitles merged.
+"""
+
+import json, logging, shutil
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+import pysubs2
+from .subprocess_utils import run_process
+
+logger = logging.getLogger('tstriage.segments')
+
+
+@dataclass
+class Segment:
+    clips: list[list[float]]  # [start, end] ranges, as in tsmarker get-program-clips
+    done: bool = False
+
+    def Duration(self) -> float:
+        return sum(e - s for s, e in self.clips)
+
+
+@dataclass
+class SegmentManifest:
+    output: str
+    preset: str
+    encoder: str
+    segments: list[Segment] = field(default_factory=list)
+    settings: str = ''  # stamps.SettingsHash of the encode settings
+
+    @staticmethod
+    def PathFor(metadata: Path, output: Path) -> Path:
+        return Path(metadata) / f'{Path(output).stem}.segments'
+
+    @staticmethod
+    def PartsFor(output: Path) -> Path:
+        return Path(output).parent / f'{Path(output).stem}.parts'
+
+    @staticmethod
+    def Load(path: Path) -> 'SegmentManifest':
+        with Path(path).open(encoding='utf-8') as f:
+            data = json.load(f)
+        return SegmentManifest(output=data['output'], preset=data['preset'], encoder=data['encoder'],
+                               segments=[Segment(**s) for s in data['segments']], settings=data.get('settings', ''))
+
+    def Save(self, path: Path):
+        # Written after every segment: replace atomically so a crash never leaves half a manifest.
+        tmp = Path(path).with_suffix('.tmp')
+        with tmp.open('w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=1)
+        tmp.replace(path)
+
+    def Resumes(self, other: 'SegmentManifest') -> bool:
+        """True if other is the same plan for the same output with the same settings, so its finished parts can be kept."""
+        return ((self.output, self.preset, self.encoder, self.settings) == (other.output, other.preset, other.encoder, other.settings)
+                and [s.clips for s in self.segments] == [s.clips for s in other.segments])
+
+
+def PlanSegments(clips: list[list[float]], points: list[float], length: float) -> list[list[list[float]]]:
+    """Split clips into segments of at least length seconds (except the last one),
+    cutting only at points, i.e. the ptsmap keys."""
+    points = sorted(points)
+    segments, current, current_length = [], [], 0.0
+    for start, end in clips:
+        for cut in [p for p in points if start < p < end] + [end]:
+            if current and current_length >= length:
+                segments.append(current)
+                current, current_length = [], 0.0
+            if current and current[-1][1] == start:
+                current[-1][1] = cut
+            else:
+                current.append([start, cut])
+            current_length += cut - start
+            start = cut
+    if current:
+        segments.append(current)
+    return segments
+
+
+def Concat(parts: list[Path], output: Path):
+    """Join encoded parts with the ffmpeg concat demuxer (stream copy)."""
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not found in $PATH — install ffmpeg or add it to PATH")
+    listPath = parts[0].parent / 'concat.txt'
+    with listPath.open('w', encoding='utf-8') as f:
+        for part in parts:
+            f.write("file '{}'\n".format(str(part.resolve()).replace("'", "'\\''")))
+    run_process([ffmpeg, '-hide_banner', '-loglevel', 'error', '-y', '-f', 'concat', '-safe', '0', '-i', str(listPath),
+                 '-map', '0', '-c', 'copy', str(output)], check=True)
+    listPath.unlink()
+
+
+def MergeSubtitles(parts: list[Path], durations: list[float], base: Path):
+    """Merge the .ass/.srt of every part (named after the part) into base.ass/base.srt,
+    shifting each part by the length of the parts before it."""
+    for suffix in ('.ass', '.srt'):
+        merged, offset = None, 0.0
+        for part, duration in zip(parts, durations):
+            path = part.with_suffix(suffix)
+            if path.exists():
+                subs = pysubs2.load(str(path), encoding='utf-8')
+                subs.shift(s=offset)
+                if merged is None:
+                    merged = subs
+                else:
+                    merged.events.extend(subs.events)
+            offset += duration
+        if merged is not None:
+            merged.save(str(base.parent / (base.name + suffix)), encoding='utf-8')
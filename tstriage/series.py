@@ -0,0 +1,151 @@
+"""Series profiles: what confirmed episodes of a show say about its CM structure.
+
+Every destination folder holds one series. After Confirm writes `_groundtruth`
+markers, the profile in `_metadata/series.profile` is relearned from all
+confirmed episodes of the folder: how accurate each cheap marking method
+(subtitles, clipinfo, logo) was against the ground truth, the range of the
+program share of an episode, and the range of the number and length of its CM
+breaks.
+
+With `Pipeline.seriesPriors`, Mark runs the cheap methods first. If the most
+accurate one is reliable for the series and its result fits the profile, that
+result is used as `_ensemble` and neither `speech` (an LLM call per episode)
+nor the ensemble model runs. Otherwise Mark carries on as usual.
+"""
+
+import json, logging
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Optional
+
+logger = logging.getLogger('tstriage.series')
+
+CHEAP_METHODS = ('subtitles', 'clipinfo', 'logo')
+MIN_EPISODES = 3        # confirmed episodes needed before the profile is trusted
+RELIABLE = 0.97         # share of the running time a method got right in past episodes
+RATIO_MARGIN = 0.05     # tolerance on the program share range
+DISAGREEMENT = 0.02     # share of the running time reliable methods may disagree on
+CM_LENGTH_MARGIN = 15.0 # seconds, one CM spot
+
+
+def _Clips(markermap: dict) -> list[tuple[float, float, dict]]:
+    return sorted((*json.loads(k), v) for k, v in markermap.items())
+
+
+def _CmBreaks(clips: list[tuple[float, float, dict]], flags: list[bool]) -> list[float]:
+    """Lengths of the runs of consecutive CM clips."""
+    breaks, current = [], 0.0
+    for (start, end, _), program in zip(clips, flags):
+        if program:
+            if current:
+                breaks.append(current)
+            current = 0.0
+        else:
+            current += end - start
+    if current:
+        breaks.append(current)
+    return breaks
+
+
+@dataclass
+class SeriesProfile:
+    episodes: int
+    accuracy: dict[str, float] = field(default_factory=dict)  # per cheap method
+    programRatio: list[float] = field(default_factory=lambda: [0.0, 1.0])  # [min, max]
+    cmBreaks: list[int] = field(default_factory=lambda: [0, 0])             # [min, max] per episode
+    cmLength: list[float] = field(default_factory=lambda: [0.0, 0.0])      # [min, max] seconds
+
+    @staticmethod
+    def PathFor(destination: Path) -> Path:
+        return Path(destination) / '_metadata' / 'series.profile'
+
+    @staticmethod
+    def Load(path: Path) -> Optional['SeriesProfile']:
+        try:
+            with Path(path).open(encoding='utf-8') as f:
+                return SeriesProfile(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def Save(self, path: Path):
+        with Path(path).open('w', encoding='utf-8') as f:
+            json.dump(asdict(self), f, ensure_ascii=False, indent=1)
+
+    @staticmethod
+    def Learn(metadata: Path) -> Optional['SeriesProfile']:
+        """Profile of the confirmed episodes (markermaps with `_groundtruth`) in a _metadata folder."""
+        ratios, breakCounts, breakLengths = [], [], []
+        right, seen = {m: 0.0 for m in CHEAP_METHODS}, {m: 0.0 for m in CHEAP_METHODS}
+        for path in sorted(Path(metadata).glob('*.markermap')):
+            try:
+                with path.open(encoding='utf-8') as f:
+                    clips = _Clips(json.load(f))
+            except (OSError, ValueError):
+                continue
+            if not clips or any('_groundtruth' not in markers for _, _, markers in clips):
+                continue
+            truth = [markers['_groundtruth'] > 0.5 for _, _, markers in clips]
+            total = sum(end - start for start, end, _ in clips)
+            if total <= 0:
+                continue
+            ratios.append(sum(end - start for (start, end, _), t in zip(clips, truth) if t) / total)
+            breaks = _CmBreaks(clips, truth)
+            breakCounts.append(len(breaks))
+            breakLengths += breaks
+            for method in CHEAP_METHODS:
+                if all(method in markers for _, _, markers in clips):
+                    seen[method] += total
+                    right[method] += sum(end - start for (start, end, markers), t in zip(clips, truth)
+                                         if (markers[method] > 0.5) == t)
+        if not ratios:
+            return None
+        return SeriesProfile(
+            episodes=len(ratios),
+            accuracy={m: right[m] / seen[m] for m in CHEAP_METHODS if seen[m]},
+            programRatio=[min(ratios), max(ratios)],
+            cmBreaks=[min(breakCounts), max(breakCounts)],
+            cmLength=[min(breakLengths), max(breakLengths)] if breakLengths else [0.0, 0.0])
+
+    def Best(self) -> Optional[str]:
+        """The cheap method that was right for most of the running time, if it is reliable."""
+        method = max(self.accuracy, key=self.accuracy.get, default=None)
+        return method if method is not None and self.accuracy[method] >= RELIABLE else None
+
+    def Disagreement(self, markermap: dict) -> Optional[str]:
+        """Why the cheap markers of an episode cannot be trusted on their own, or None if they fit the profile."""
+        if self.episodes < MIN_EPISODES:
+            return f'only {self.episodes} confirmed episode(s) in the series profile'
+        method = self.Best()
+        if method is None:
+            return 'no cheap method is reliable for this series'
+        clips = _Clips(markermap)
+        if not clips or any(method not in markers for _, _, markers in clips):
+            return f'no {method} markers'
+        flags = [markers[method] > 0.5 for _, _, markers in clips]
+        total = sum(end - start for start, end, _ in clips)
+        ratio = sum(end - start for (start, end, _), f in zip(clips, flags) if f) / total
+        lo, hi = self.programRatio
+        if not lo - RATIO_MARGIN <= ratio <= hi + RATIO_MARGIN:
+            return f'{method}: program share {ratio:.2f} outside {lo:.2f}-{hi:.2f}'
+        breaks = _CmBreaks(clips, flags)
+        if not self.cmBreaks[0] <= len(breaks) <= self.cmBreaks[1]:
+            return f'{method}: {len(breaks)} CM breaks, the series has {self.cmBreaks[0]}-{self.cmBreaks[1]}'
+        lo, hi = self.cmLength
+        if any(not lo - CM_LENGTH_MARGIN <= b <= hi + CM_LENGTH_MARGIN for b in breaks):
+            return f'{method}: CM breaks of {", ".join(f"{b:.0f}" for b in breaks)}s, the series has {lo:.0f}-{hi:.0f}s'
+        for other in CHEAP_METHODS:
+            if other == method or self.accuracy.get(other, 0.0) < RELIABLE:
+                continue
+            if all(other in markers for _, _, markers in clips):
+                differ = sum(end - start for (start, end, markers), f in zip(clips, flags) if (markers[other] > 0.5) != f)
+                if differ / total > DISAGREEMENT:
+                    return f'{method} and {other} disagree on {differ:.0f}s'
+        return None
+
+    def Apply(self, markermap: dict) -> str:
+        """Store the best cheap method's result as `_ensemble`, which get-program-clips prefers
+        after `_groundtruth`; returns the method used."""
+        method = self.Best()
+        for markers in markermap.values():
+            markers['_ensemble'] = 1.0 if markers[method] > 0.5 else 0.0
+        return method
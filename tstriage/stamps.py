@@ -0,0 +1,66 @@
+"""Stage stamps: make-style up-to-date checks for Analyze, Mark, Cut and Encode.
+
+When a stage finishes it writes `_metadata/<name>.<stage>.stamp` with the
+fingerprint of what it was run on: size and mtime of its input files, a hash
+of the settings it uses and the versions of the tools it runs, plus the
+outputs it wrote. When the fingerprint is unchanged and the outputs still
+exist, the stage is skipped. Deleting a stamp forces its stage to run again.
+"""
+
+import hashlib, json, logging
+from pathlib import Path
+from typing import Any, Optional
+from . import __version__, cli_config
+
+logger = logging.getLogger('tstriage.stamps')
+
+
+def SettingsHash(settings: Any) -> str:
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def Fingerprint(inputs: list[Path], settings: Any, tools: tuple[str, ...] = ()) -> dict:
+    files = {}
+    for path in inputs:
+        try:
+            st = Path(path).stat()
+            files[str(path)] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            files[str(path)] = None
+    return {
+        'inputs': files,
+        'settings': SettingsHash(settings),
+        'tools': {'tstriage': __version__, **{t: cli_config.tool_version(t) for t in tools}},
+    }
+
+
+class StageStamp:
+    """The stamp of one stage of one recording, with the fingerprint it is checked against."""
+
+    def __init__(self, destination: Path, path: Path, stage: str, inputs: list[Path], settings: Any,
+                 tools: tuple[str, ...] = ()):
+        self.stage = stage
+        self.path = Path(destination) / '_metadata' / Path(path).with_suffix(f'.{stage}.stamp').name
+        self.fingerprint = Fingerprint(inputs, settings, tools)
+
+    def Current(self) -> Optional[dict]:
+        """The result recorded with the stamp if the stage is up to date, None otherwise."""
+        try:
+            with self.path.open(encoding='utf-8') as f:
+                stamp = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if stamp.get('fingerprint') != self.fingerprint:
+            logger.debug(f'{self.path.name}: inputs, settings or tools changed')
+            return None
+        missing = [o for o in stamp.get('outputs', []) if not Path(o).exists()]
+        if missing:
+            logger.debug(f'{self.path.name}: missing {", ".join(missing)}')
+            return None
+        return stamp.get('result', {})
+
+    def Record(self, outputs: list[Path], result: Optional[dict] = None):
+        """Stamp the stage as done; result is whatever a skipped run has to restore."""
+        with self.path.open('w', encoding='utf-8') as f:
+            json.dump({'stage': self.stage, 'fingerprint': self.fingerprint,
+                       'outputs': [str(o) for o in outputs], 'result': result or {}}, f, ensure_ascii=False, indent=1)
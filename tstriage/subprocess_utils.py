@@ -1,5 +1,7 @@
 import json, logging, os, subprocess, sys, threading, time
 from typing import Optional
+from . import admission, tracing
+from .procstats import Meter, track
 
 logger = logging.getLogger('tstriage.subprocess_utils')
 
@@ -10,12 +12,95 @@ def _clean_env() -> dict:
     return env
 
 
+class ToolCommand(list):
+    """argv of tscutter/tsmarker, with the working directory and variables the tool runs with
+    (see cli_config.resolve)."""
+
+    def __init__(self, argv, cwd: Optional[str] = None, env: Optional[dict] = None):
+        super().__init__(argv)
+        self.cwd = cwd
+        self.env = env or {}
+
+
+def _tool_kwargs(cmd, **kwargs) -> dict:
+    """Popen kwargs with the working directory and environment of a ToolCommand applied."""
+    if isinstance(cmd, ToolCommand):
+        if cmd.cwd is not None:
+            kwargs.setdefault('cwd', cmd.cwd)
+        if cmd.env:
+            # Like uv, the files do not override variables that are already set.
+            kwargs['env'] = {**cmd.env, **(kwargs.get('env') or os.environ)}
+    return kwargs
+
+
+class _TracedPopen(subprocess.Popen):
+    """Popen that records a span (command, duration, exit code, usage) for the child."""
+
+    def __init__(self, args, **kwargs):
+        self._span = tracing.start_span('subprocess', command=args if isinstance(args, str) else ' '.join(map(str, args)))
+        try:
+            super().__init__(args, **kwargs)
+        except BaseException as e:
+            self._span.end(error=f'{type(e).__name__}: {e}')
+            raise
+        self._span.set(pid=self.pid)
+        # Only spans that are exported need the child's own usage.
+        self._meter = Meter.watch(self.pid) if tracing.enabled() else None
+        track(self.pid)
+        admission.apply(self.pid)
+
+    def poll(self):
+        returncode = super().poll()
+        if returncode is not None:
+            self._finish()
+        return returncode
+
+    def wait(self, timeout=None):
+        returncode = super().wait(timeout)
+        self._finish()
+        return returncode
+
+    def _finish(self):
+        if self._span.end_ns is not None:
+            return
+        self._span.set(exit_code=self.returncode)
+        if self._meter is not None:
+            usage = self._meter.close()
+            self._span.set(cpu_seconds=usage.cpu, read_bytes=usage.read_bytes, peak_rss=usage.peak_rss)
+        self._span.end(error=f'exit code {self.returncode}' if self.returncode else None)
+
+
+def popen(cmd, **kwargs) -> subprocess.Popen:
+    """subprocess.Popen that traces the child, attributes it to the active procstats meters,
+    runs it at the stage priority set by admission.priority() and in the directory and
+    environment of a ToolCommand."""
+    return _TracedPopen(cmd, **_tool_kwargs(cmd, **kwargs))
+
+
+def run_process(cmd, input=None, check: bool = False, capture_output: bool = False, **kwargs) -> subprocess.CompletedProcess:
+    """Drop-in for subprocess.run that attributes the child to the active procstats meters."""
+    if capture_output:
+        kwargs['stdout'] = kwargs['stderr'] = subprocess.PIPE
+    if input is not None:
+        kwargs['stdin'] = subprocess.PIPE
+    with popen(cmd, **kwargs) as proc:
+        try:
+            stdout, stderr = proc.communicate(input)
+        except BaseException:
+            proc.kill()
+            raise
+    result = subprocess.CompletedProcess(proc.args, proc.returncode, stdout, stderr)
+    if check:
+        result.check_returncode()
+    return result
+
+
 def run(cmd: list[str], capture_stderr: bool = False) -> subprocess.CompletedProcess:
     """Execute command. stdout captured for JSON. Set capture_stderr=True when stderr must be inspected."""
     logger.debug(f'Running: {" ".join(cmd)}')
     try:
         stderr = subprocess.PIPE if capture_stderr else None
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True, env=_clean_env())
+        result = run_process(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True, env=_clean_env())
     except FileNotFoundError:
         logger.error(f'Command not found: {cmd[0]}')
         logger.error('Ensure the CLI tool is installed and in PATH, or configure "Cli" in config.yml')
@@ -41,7 +126,7 @@ def run_pipe(cmd: list[str], progress=None):
     """
     logger.debug(f'Running: {" ".join(cmd)}')
     try:
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=_clean_env())
+        proc = popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=_clean_env())
     except FileNotFoundError:
         logger.error(f'Command not found: {cmd[0]}')
         sys.exit(1)
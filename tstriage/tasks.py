@@ -1,13 +1,21 @@
-import contextlib, json, logging, shutil, subprocess
+import contextlib, contextvars, json, logging, shutil, subprocess, tempfile, threading
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
 
 from . import cli_config
 from ._progress import SubprocessProgress
-from .epg import EPG
+from .clips import ClipManifest, WriteGroundTruth
+from .epg import DUMP_BYTES, EPG, HeadPipe
 from .epgstation import EPGStation
-from .pipeline import EncodePipeline
-from .subprocess_utils import run, run_json, run_pipe
+from .input_file import InputFile
+from .locks import FileLock
+from .metrics import STAGE_BYTES
+from .pipeline import EncodePipeline, ProgramDuration
+from .predictor import EncodeEstimate, EncodePredictor
+from .series import CHEAP_METHODS, SeriesProfile
+from .stamps import SettingsHash, StageStamp
+from .subprocess_utils import popen, run, run_json, run_pipe, run_process
+from .tee import Tee
 
 logger = logging.getLogger('tstriage.tasks')
 
@@ -25,36 +33,144 @@ def _pq(quiet: bool) -> list[str]:
     return flags
 
 
-def Analyze(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress: SubprocessProgress | None = None):
+def _AudioStreams(path: Path) -> list[str]:
+    result = run_process(
+        ['ffprobe', '-v', 'error', '-select_streams', 'a',
+         '-show_entries', 'stream=index', '-of', 'csv=p=0', str(path)],
+        capture_output=True, text=True, check=True)
+    return list(dict.fromkeys([line.strip() for line in result.stdout.strip().split('\n') if line.strip()]))
+
+
+def _AudioCheckCmd(source: str, audio_pos: int) -> list[str]:
+    """Decode the first two seconds of one audio stream; source may be '-' for stdin."""
+    return ['ffmpeg', '-v', 'error', '-err_detect', 'aggressive',
+            '-i', source, '-map', f'0:a:{audio_pos}',
+            '-t', '2', '-f', 'null', '-']
+
+
+def _CheckAudio(item: dict[str, Any], global_idx: str, stderr: str):
+    error_lines = [line for line in stderr.strip().split('\n')
+                   if 'channel element' in line and 'is not allocated' in line]
+    if error_lines:
+        logger.warning(f'Audio stream #{global_idx} has decode errors:')
+        for line in error_lines:
+            logger.warning(f'  {line}')
+        item['encoder']['fixaudio'] = True
+
+
+def _AnalyzeFanout(item: dict[str, Any], workingPath: Path, epgPath: Path, analyzeCmd: list[str],
+                   audio_global_indices: list[str], progress: SubprocessProgress | None):
+    """Run tscutter analyze next to a single read of the recording that feeds
+    mirakurun-epgdump and the audio checks through their stdin.
+
+    tscutter seeks and needs a path, so it reads the file itself; running it at
+    the same time lets both reads be served from the same page-cache pages.
+    """
+    epgP = popen(EPG.DumpCmd('-', epgPath), stdin=subprocess.PIPE,
+                 stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    checks = [popen(_AudioCheckCmd('-', audio_pos), stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+              for audio_pos in range(len(audio_global_indices))]
+    stderrs = [b''] * len(checks)
+    errors: list[BaseException] = []
+
+    def _read_stderr(i: int):
+        stderrs[i] = checks[i].stderr.read()
+
+    def _pump():
+        try:
+            # The audio checks stop reading after two seconds of audio.
+            epgHead = HeadPipe(epgP.stdin, DUMP_BYTES)
+            tee = Tee(epgHead, *(p.stdin for p in checks),
+                      broken_ok={epgHead: None, **{p.stdin: None for p in checks}}, threaded=True)
+            with workingPath.open('rb') as f:
+                tee.pump(f, buf_size=1024 * 1024, on_chunk=lambda n: STAGE_BYTES.inc(n, stage='analyze'))
+        except BaseException as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=_read_stderr, args=(i,), daemon=True) for i in range(len(checks))]
+    threads.append(threading.Thread(target=contextvars.copy_context().run, args=(_pump,), name='analyze-fanout', daemon=True))
+    for t in threads:
+        t.start()
+    try:
+        run_pipe(analyzeCmd, progress=progress)
+        with (progress.status("Extracting EPG") if progress else contextlib.nullcontext()):
+            for t in threads:
+                t.join()
+            for p in (epgP, *checks):
+                p.wait()
+    except BaseException:
+        for p in (epgP, *checks):
+            p.kill()
+        for t in threads:
+            t.join()
+        for p in (epgP, *checks):
+            p.wait()
+        raise
+    if errors:
+        raise errors[0]
+    if epgP.returncode != 0:
+        raise RuntimeError(f'mirakurun-epgdump failed (exit {epgP.returncode})')
+    for global_idx, stderr in zip(audio_global_indices, stderrs):
+        _CheckAudio(item, global_idx, stderr.decode('utf-8', 'replace'))
+
+
+def _UpToDate(stamp: StageStamp, skip: bool, name: str) -> dict | None:
+    result = stamp.Current() if skip else None
+    if result is not None:
+        logger.info(f'{stamp.stage}: "{name}" is up to date, skipping')
+    return result
+
+
+def Analyze(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress: SubprocessProgress | None = None,
+            fanout: bool = False, skipUpToDate: bool = False):
     path = Path(item['path'])
     destination = Path(item['destination'])
     workingPath = Path(item['path'])
 
     indexPath = destination / '_metadata' / workingPath.with_suffix('.ptsmap').name
+    descPath = destination / workingPath.with_suffix('.yaml').name
+    stamp = StageStamp(destination, path, 'analyze', [workingPath], item.get('cutter', {}), ('tscutter', 'tsmarker'))
+    if (result := _UpToDate(stamp, skipUpToDate, path.name)) is not None:
+        if result.get('fixaudio'):  # found by the audio check of the stamped run
+            item['encoder']['fixaudio'] = True
+        return
 
     minSilenceLen = item.get('cutter', {}).get('minSilenceLen', 800)
     silenceThresh = item.get('cutter', {}).get('silenceThresh', -80)
     splitPosShift = item.get('cutter', {}).get('splitPosShift', 1)
 
-    run_pipe(cli_config.tscutter(
+    analyzeCmd = cli_config.tscutter(
         *_pq(quiet), 'analyze',
         '--input', str(workingPath),
         '--output', str(indexPath),
         '--length', str(minSilenceLen),
         '--threshold', str(silenceThresh),
         '--shift', str(splitPosShift),
-    ), progress=progress)
-
+    )
     epgPath = destination / '_metadata' / workingPath.with_suffix('.epg').name
-    with (progress.status("Extracting EPG") if progress else contextlib.nullcontext()):
-        EPG.Dump(workingPath, epgPath, quiet=quiet)
+    audio_global_indices = _AudioStreams(workingPath)
+
+    if fanout:
+        _AnalyzeFanout(item, workingPath, epgPath, analyzeCmd, audio_global_indices, progress)
+    else:
+        run_pipe(analyzeCmd, progress=progress)
+        with (progress.status("Extracting EPG") if progress else contextlib.nullcontext()):
+            EPG.Dump(workingPath, epgPath, quiet=quiet)
 
     probe_data = run_json(cli_config.tscutter('probe', '--input', str(workingPath)))
     if probe_data is None:
         raise RuntimeError('tscutter probe failed')
 
     epg = EPG(epgPath, probe_data['serviceId'], epgStation.GetChannels())
-    epg.OutputDesc(destination / workingPath.with_suffix('.yaml').name)
+    try:
+        epg.Info()
+    except RuntimeError:
+        # Only the head of the recording was dumped; its event may start later (long recording margins).
+        logger.info(f'EPG event of "{path.name}" not in the first {DUMP_BYTES // 2**20} MB, dumping the whole recording')
+        EPG.Dump(workingPath, epgPath, quiet=quiet, limit=None)
+        epg = EPG(epgPath, probe_data['serviceId'], epgStation.GetChannels())
+    epg.OutputDesc(descPath)
 
     if progress:
         progress.clear_parent_desc()
@@ -65,42 +181,29 @@ def Analyze(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress:
     ), progress=progress)
 
     logoPath = (path.parent / '_tstriage' / f'{epg.Channel()}_{probe_data["width"]}x{probe_data["height"]}').with_suffix('.png')
-    if not logoPath.exists():
-        run_pipe(cli_config.tsmarker(
-            *_pq(quiet), 'extract-logo',
-            '--input', str(workingPath),
-            '--index', str(indexPath),
-            '--output', str(logoPath),
-            '--max-time', '999999',
-        ), progress=progress)
+    # Shared by every recording of the channel at this resolution; extracted once.
+    with FileLock.For('logo', logoPath):
+        if not logoPath.exists():
+            run_pipe(cli_config.tsmarker(
+                *_pq(quiet), 'extract-logo',
+                '--input', str(workingPath),
+                '--index', str(indexPath),
+                '--output', str(logoPath),
+                '--max-time', '999999',
+            ), progress=progress)
 
-    ffmpeg_path = 'ffmpeg'
-    ffprobe_path = 'ffprobe'
+    if not fanout:
+        with (progress.status("Checking audio") if progress else contextlib.nullcontext()):
+            for audio_pos, global_idx in enumerate(audio_global_indices):
+                decode_result = run_process(_AudioCheckCmd(str(workingPath), audio_pos), capture_output=True, text=True)
+                _CheckAudio(item, global_idx, decode_result.stderr)
 
-    result = subprocess.run(
-        [ffprobe_path, '-v', 'error', '-select_streams', 'a',
-         '-show_entries', 'stream=index', '-of', 'csv=p=0', str(workingPath)],
-        capture_output=True, text=True, check=True)
-    audio_global_indices = list(dict.fromkeys([line.strip() for line in result.stdout.strip().split('\n') if line.strip()]))
-
-    with (progress.status("Checking audio") if progress else contextlib.nullcontext()):
-        for audio_pos, global_idx in enumerate(audio_global_indices):
-            decode_result = subprocess.run(
-                [ffmpeg_path, '-v', 'error', '-err_detect', 'aggressive',
-                 '-i', str(workingPath), '-map', f'0:a:{audio_pos}',
-                 '-t', '2', '-f', 'null', '-'],
-                capture_output=True, text=True)
-
-            error_lines = [line for line in decode_result.stderr.strip().split('\n')
-                           if 'channel element' in line and 'is not allocated' in line]
-            if error_lines:
-                logger.warning(f'Audio stream #{global_idx} has decode errors:')
-                for line in error_lines:
-                    logger.warning(f'  {line}')
-                item['encoder']['fixaudio'] = True
-
-
-def Mark(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress: SubprocessProgress | None = None):
+    stamp.Record([indexPath, epgPath, descPath], {'fixaudio': bool(item.get('encoder', {}).get('fixaudio'))})
+
+
+def Mark(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress: SubprocessProgress | None = None,
+         skipUpToDate: bool = False, seriesPriors: bool = False,
+         ensembleModel: Callable[[Path, bool], Path | None] | None = None):
     path = Path(item['path'])
     destination = Path(item['destination'])
     workingPath = Path(item['path'])
@@ -118,50 +221,126 @@ def Mark(item: dict[str, Any], epgStation: EPGStation, quiet: bool, progress: Su
     epgPath = destination / '_metadata' / workingPath.with_suffix('.epg').name
     epg = EPG(epgPath, probe_data['serviceId'], epgStation.GetChannels())
     logoPath = (path.parent / '_tstriage' / f'{epg.Channel()}_{probe_data["width"]}x{probe_data["height"]}').with_suffix('.png')
+    settings = {**item.get('marker', {}), 'seriesPriors': True} if seriesPriors else item.get('marker', {})
+    stamp = StageStamp(destination, path, 'mark', [workingPath, indexPath, epgPath, logoPath], settings, ('tsmarker',))
+    if _UpToDate(stamp, skipUpToDate, path.name) is not None:
+        return
 
-    run_pipe(cli_config.tsmarker(
-        *_pq(quiet), 'mark',
-        '--method', 'subtitles', '--method', 'clipinfo', '--method', 'logo', '--method', 'speech',
-        '--input', str(workingPath),
-        '--index', str(indexPath),
-        '--marker', str(markerPath),
-        '--logo', str(logoPath),
-    ), progress=progress)
+    def _mark(*methods: str):
+        run_pipe(cli_config.tsmarker(
+            *_pq(quiet), 'mark',
+            *(arg for method in methods for arg in ('--method', method)),
+            '--input', str(workingPath),
+            '--index', str(indexPath),
+            '--marker', str(markerPath),
+            '--logo', str(logoPath),
+        ), progress=progress)
+
+    if not seriesPriors:
+        _mark(*CHEAP_METHODS, 'speech')
+    else:
+        _mark(*CHEAP_METHODS)
+        profile = SeriesProfile.Load(SeriesProfile.PathFor(destination))
+        with markerPath.open() as f:
+            markermap = json.load(f)
+        reason = profile.Disagreement(markermap) if profile is not None else 'no confirmed episodes yet'
+        if reason is None:
+            method = profile.Apply(markermap)
+            with markerPath.open('w') as f:
+                json.dump(markermap, f, indent=True)
+            logger.info(f'"{path.name}" fits the series profile, marked by {method} without speech')
+            stamp.Record([markerPath])
+            return
+        logger.info(f'"{path.name}": {reason}, marking speech')
+        _mark('speech')
 
     noEnsemble = item.get('marker', {}).get('noEnsemble', False)
-    outputFolder = Path(item['destination'])
     if not noEnsemble:
-        searchFolder = outputFolder.parent.parent
-        datasetCsv = Path(searchFolder.stem).with_suffix('.csv')
-
-        ds_result = run(cli_config.tsmarker(
-            *_q(quiet), 'ensemble-dataset',
-            '--input', str(searchFolder),
-            '--output', str(datasetCsv),
-        ), capture_stderr=True)
-
-        if 'No metadata' not in ds_result.stderr and 'warning' not in ds_result.stderr.lower():
-            modelPath = datasetCsv.with_suffix('.pkl')
-            run(cli_config.tsmarker(
-                *_q(quiet), 'ensemble-train',
-                '--input', str(datasetCsv),
-                '--output', str(modelPath),
-            ))
-            run(cli_config.tsmarker(
-                *_q(quiet), 'ensemble-predict',
-                '--model', str(modelPath),
-                '--index', str(indexPath),
-                '--marker', str(markerPath),
-            ))
+        # Another run may be training the same series' model; one at a time.
+        with FileLock.For('ensemble', EnsembleFolder(item)), contextlib.ExitStack() as stack:
+            if ensembleModel is not None:
+                modelPath = ensembleModel(EnsembleFolder(item), quiet)
+            else:
+                workFolder = stack.enter_context(tempfile.TemporaryDirectory(prefix='tstriage-ensemble-'))
+                modelPath = EnsembleModel(EnsembleFolder(item), quiet, workFolder=Path(workFolder))
+            if modelPath is not None:
+                run(cli_config.tsmarker(
+                    *_q(quiet), 'ensemble-predict',
+                    '--model', str(modelPath),
+                    '--index', str(indexPath),
+                    '--marker', str(markerPath),
+                ))
+    stamp.Record([markerPath])
+
+
+def EnsembleFolder(item: dict[str, Any]) -> Path:
+    """The folder whose encoded episodes train the ensemble model used for the item."""
+    return Path(item['destination']).parent.parent
+
+
+def EnsembleModel(searchFolder: Path, quiet: bool, workFolder: Path) -> Path | None:
+    """Train the ensemble model on the marked and encoded episodes under searchFolder.
+
+    Returns the model path, or None if there is nothing to train on. Items still
+    being marked have no encoded output yet and take no part in the dataset, so
+    Runner.Mark trains once per folder and passes the model on to every pending
+    item through Mark's ensembleModel. Callers hold the folder's 'ensemble' lock.
+    The dataset and model are written to workFolder.
+    """
+    Path(workFolder).mkdir(parents=True, exist_ok=True)
+    datasetCsv = (Path(workFolder) / searchFolder.stem).with_suffix('.csv')
+    ds_result = run(cli_config.tsmarker(
+        *_q(quiet), 'ensemble-dataset',
+        '--input', str(searchFolder),
+        '--output', str(datasetCsv),
+    ), capture_stderr=True)
+    if 'No metadata' in ds_result.stderr or 'warning' in ds_result.stderr.lower():
+        return None
+    modelPath = datasetCsv.with_suffix('.pkl')
+    run(cli_config.tsmarker(
+        *_q(quiet), 'ensemble-train',
+        '--input', str(datasetCsv),
+        '--output', str(modelPath),
+    ))
+    return modelPath
 
 
-def Cut(item: dict[str, str], outputFolder: Path, quiet: bool, progress: SubprocessProgress | None = None):
+def _BuildManifest(item: dict[str, Any], quiet: bool) -> Path:
+    path = Path(item['path'])
+    destination = Path(item['destination'])
+    manifest = ClipManifest.Build(
+        path,
+        destination / '_metadata' / path.with_suffix('.ptsmap').name,
+        destination / '_metadata' / path.with_suffix('.markermap').name,
+        splitNum=item.get('encoder', {}).get('split', 1),
+        byGroup=item.get('encoder', {}).get('bygroup', False),
+        quiet=quiet)
+    manifestPath = ClipManifest.PathFor(destination, path)
+    manifest.Save(manifestPath)
+    return manifestPath
+
+
+def Cut(item: dict[str, str], outputFolder: Path, quiet: bool, progress: SubprocessProgress | None = None,
+        cutClips: bool = False, skipUpToDate: bool = False):
+    """Write the clip manifest; with cutClips, also cut the clips into outputFolder (and CM/) for review."""
     destination = Path(item['destination'])
     workingPath = Path(item['path'])
 
     indexPath = destination / '_metadata' / workingPath.with_suffix('.ptsmap').name
     markerPath = destination / '_metadata' / workingPath.with_suffix('.markermap').name
 
+    settings = {'split': item.get('encoder', {}).get('split', 1), 'bygroup': item.get('encoder', {}).get('bygroup', False),
+                'cutClips': cutClips}
+    stamp = StageStamp(destination, workingPath, 'cut', [indexPath, markerPath], settings, ('tsmarker',))
+    if _UpToDate(stamp, skipUpToDate, workingPath.name) is not None:
+        return  # also keeps review edits made to the manifest
+
+    manifestPath = _BuildManifest(item, quiet)
+    if not cutClips:
+        logger.info(f'Review by editing the "program" flags in {manifestPath}')
+        stamp.Record([manifestPath])
+        return
+
     run_pipe(cli_config.tsmarker(
         *_pq(quiet), 'cut',
         '--input', str(workingPath),
@@ -169,30 +348,50 @@ def Cut(item: dict[str, str], outputFolder: Path, quiet: bool, progress: Subproc
         '--marker', str(markerPath),
         '--output', str(outputFolder),
     ), progress=progress)
+    stamp.Record([manifestPath, outputFolder])
 
 
-def Confirm(item: dict[str, str], outputFolder: Path):
+def Confirm(item: dict[str, str], outputFolder: Path, quiet: bool = True):
     path = Path(item['path'])
     destination = Path(item['destination'])
 
     markerPath = destination / '_metadata' / (path.stem + '.markermap')
     indexPath = markerPath.with_suffix('.ptsmap')
+    manifestPath = ClipManifest.PathFor(destination, path)
 
-    result = run(cli_config.tsmarker(
-        'groundtruth',
-        '--input', str(path),
-        '--index', str(indexPath),
-        '--marker', str(markerPath),
-        '--clips', str(outputFolder),
-    ))
-    re_encode = json.loads(result.stdout.strip()) if result.stdout.strip() else {'re_encode_needed': False}
-    isReEncodingNeeded = re_encode.get('re_encode_needed', False)
+    if outputFolder.is_dir() or not manifestPath.exists():
+        # Clip files were cut for review (or the item predates manifests)
+        result = run(cli_config.tsmarker(
+            'groundtruth',
+            '--input', str(path),
+            '--index', str(indexPath),
+            '--marker', str(markerPath),
+            '--clips', str(outputFolder),
+        ))
+        re_encode = json.loads(result.stdout.strip()) if result.stdout.strip() else {'re_encode_needed': False}
+        isReEncodingNeeded = re_encode.get('re_encode_needed', False)
+    else:
+        reviewed = ClipManifest.Load(manifestPath)
+        changed = reviewed.Changes(ClipManifest.Build(path, indexPath, markerPath,
+                                                      splitNum=item.get('encoder', {}).get('split', 1),
+                                                      byGroup=item.get('encoder', {}).get('bygroup', False),
+                                                      quiet=quiet))
+        for clip in changed:
+            logger.info(f'[{clip.start:.1f}, {clip.end:.1f}] marked as {"program" if clip.program else "CM"}')
+        WriteGroundTruth(markerPath, reviewed)
+        isReEncodingNeeded = bool(changed)
     if isReEncodingNeeded:
         logger.warning("*** Re-encoding is needed! ***")
+    profile = SeriesProfile.Learn(destination / '_metadata')
+    if profile is not None:
+        profile.Save(SeriesProfile.PathFor(destination))
+    _BuildManifest(item, quiet)  # regroup by the new _groundtruth markers
     return isReEncodingNeeded
 
 
-def Encode(item: dict[str, Any], encoder: str, presets: dict, quiet: bool, progress: SubprocessProgress | None = None):
+def Encode(item: dict[str, Any], encoder: str, presets: dict, quiet: bool, progress: SubprocessProgress | None = None, threads: int = 0,
+           predictor: EncodePredictor | None = None, nativeExtract: bool = True, pidFilter: bool = False,
+           captions: str = 'auto', segmentLength: float = 0, skipUpToDate: bool = False):
     path = Path(item['path'])
     destination = Path(item['destination'])
     byGroup = item.get('encoder', {}).get('bygroup', False)
@@ -201,6 +400,7 @@ def Encode(item: dict[str, Any], encoder: str, presets: dict, quiet: bool, progr
     cropdetect = item['encoder'].get('cropdetect')
     fixAudio = item['encoder'].get('fixaudio')
     noStrip = item['encoder'].get('nostrip')
+    splitStrip = item['encoder'].get('splitstrip', False)
 
     workingPath = Path(item['path'])
 
@@ -211,42 +411,82 @@ def Encode(item: dict[str, Any], encoder: str, presets: dict, quiet: bool, progr
     outSubtitles.mkdir(parents=True, exist_ok=True)
 
     outFile = destination / workingPath.with_suffix('.mkv').name
+    manifestPath = ClipManifest.PathFor(destination, path)
+
+    # Only what changes the output: the extraction and filtering switches do not.
+    settings = {'encoder': item['encoder'], 'preset': presets[presetName], 'codec': encoder, 'captions': captions}
+    inputs = [workingPath, ptsmap_path, manifestPath if manifestPath.exists() else markermap_path]
+    stamp = StageStamp(destination, path, 'encode', inputs, settings, ('tsmarker',))
+    with FileLock.For('output', outFile):
+        if _UpToDate(stamp, skipUpToDate, path.name) is not None:
+            return outFile
+
+        outputs = EncodePipeline(
+            inFile=workingPath,
+            ptsmap_path=ptsmap_path,
+            markermap_path=markermap_path,
+            outFile=outFile,
+            outSubtitles=outSubtitles,
+            byGroup=byGroup,
+            splitNum=splitNum,
+            preset=presets[presetName],
+            presetName=presetName,
+            predictor=predictor,
+            cropdetect=cropdetect,
+            encoder=encoder,
+            threads=threads,
+            fixAudio=fixAudio,
+            noStrip=noStrip,
+            splitStrip=splitStrip,
+            manifest=ClipManifest.Load(manifestPath) if manifestPath.exists() else None,
+            nativeExtract=nativeExtract,
+            pidFilter=pidFilter,
+            captions=captions,
+            segmentLength=segmentLength,
+            settingsHash=SettingsHash(settings),
+            quiet=quiet,
+            progress=progress)
+
+        srtPath = destination / 'Subtitles' / workingPath.with_suffix('.srt').name
+        if srtPath.exists():
+            newSrtPath = srtPath.with_suffix('.ssrrtt')
+            shutil.copy(srtPath, newSrtPath)
+            srtPath.unlink()
+        else:
+            try:
+                outSubtitles.rmdir()
+            except OSError:
+                pass
+        stamp.Record(outputs)
+        return outFile
+
+
+def EstimateEncode(item: dict[str, Any], encoder: str, presets: dict, predictor: EncodePredictor, quiet: bool) -> dict[str, EncodeEstimate]:
+    """Predict output size and encode time of the item for every preset."""
+    path = Path(item['path'])
+    destination = Path(item['destination'])
+    ptsmap_path = destination / '_metadata' / path.with_suffix('.ptsmap').name
+    markermap_path = destination / '_metadata' / path.with_suffix('.markermap').name
 
-    EncodePipeline(
-        inFile=workingPath,
-        ptsmap_path=ptsmap_path,
-        markermap_path=markermap_path,
-        outFile=outFile,
-        outSubtitles=outSubtitles,
-        byGroup=byGroup,
-        splitNum=splitNum,
-        preset=presets[presetName],
-        cropdetect=cropdetect,
-        encoder=encoder,
-        fixAudio=fixAudio,
-        noStrip=noStrip,
-        quiet=quiet,
-        progress=progress)
-
-    srtPath = destination / 'Subtitles' / workingPath.with_suffix('.srt').name
-    if srtPath.exists():
-        newSrtPath = srtPath.with_suffix('.ssrrtt')
-        shutil.copy(srtPath, newSrtPath)
-        srtPath.unlink()
+    manifestPath = ClipManifest.PathFor(destination, path)
+    if manifestPath.exists():
+        duration = ClipManifest.Load(manifestPath).Duration()
     else:
-        try:
-            outSubtitles.rmdir()
-        except OSError:
-            pass
-    return outFile
+        duration = ProgramDuration(ptsmap_path, markermap_path, quiet)
+    info = InputFile(path).GetInfo()
+    return {e.preset: e for e in predictor.EstimateAll(presets, encoder, duration, info)}
 
 
 def Cleanup(item: dict[str, Any]):
+    """Remove what is left of the item in _tstriage: its action item and clip folder.
+
+    Tracked intermediates are reclaimed by the runner (see scratch.py); matching whole
+    names rather than substrings keeps `show` from taking `show2` along.
+    """
     logger.info('Cleaning up ...')
-    files = list((Path(item['path']).parent / '_tstriage').glob('*'))
     originalPath = Path(item['path'])
-    for path in files:
-        if path.stem in originalPath.stem or originalPath.stem in path.stem:
+    for path in list((originalPath.parent / '_tstriage').glob('*')):
+        if path.name == originalPath.stem or path.name.startswith(f'{originalPath.stem}.'):
             logger.info(f'removing {path.name} ...')
             if path.is_dir():
                 shutil.rmtree(path)
@@ -1,7 +1,9 @@
-import logging
+import logging, queue, threading
 
 logger = logging.getLogger('tstriage.tee')
 
+_SUBTITLES_BROKEN = 'Subtitle process pipe broken — subtitles may not be generated'
+
 
 class Tee:
     """Write data from a stream to multiple pipes.
@@ -9,11 +11,34 @@ class Tee:
     Usage:
         tee = Tee(strip.stdin, subtitles.stdin, broken_ok=(subtitles.stdin,))
         tee.pump(extract_proc.stdout)
+
+    broken_ok lists pipes whose consumer may exit early; it can also be a dict
+    mapping each such pipe to the warning to log (None logs nothing, e.g. for
+    consumers that only read the head of the stream).
+
+    With threaded=True every pipe gets its own writer thread and a queue of up
+    to queue_chunks chunks, so consumers run concurrently and a momentarily
+    slow one does not stall the others. Write errors of required pipes are
+    raised from the next write() or from close().
     """
 
-    def __init__(self, *pipes, broken_ok: tuple = ()):
+    def __init__(self, *pipes, broken_ok=(), threaded: bool = False, queue_chunks: int = 16):
         self.pipes = pipes
-        self.broken_ok = set(broken_ok)
+        if isinstance(broken_ok, dict):
+            self.broken_ok = dict(broken_ok)
+        else:
+            self.broken_ok = {p: _SUBTITLES_BROKEN for p in broken_ok}
+        self._broken = set()
+        self._error = None
+        self._queues = []
+        self._threads = []
+        if threaded:
+            for p in pipes:
+                q = queue.Queue(maxsize=queue_chunks)
+                t = threading.Thread(target=self._writer, args=(p, q), name='tee', daemon=True)
+                t.start()
+                self._queues.append(q)
+                self._threads.append(t)
 
     def pump(self, stream, buf_size: int = 1024 * 1024, on_chunk=None):
         while chunk := stream.read(buf_size):
@@ -23,19 +48,47 @@ class Tee:
         self.close()
 
     def write(self, data):
-        broken = set()
+        if self._queues:
+            if self._error is not None:
+                raise self._error
+            for q in self._queues:
+                q.put(data)
+            return
         for p in self.pipes:
-            if p in broken:
+            if p not in self._broken:
+                self._write(p, data)
+
+    def _write(self, p, data):
+        try:
+            p.write(data)
+        except (BrokenPipeError, OSError):
+            if p not in self.broken_ok:
+                raise
+            if self.broken_ok[p]:
+                logger.warning(self.broken_ok[p])
+            self._broken.add(p)
+
+    def _writer(self, p, q: queue.Queue):
+        # Keeps draining after a failure so that write() never blocks on a dead consumer.
+        while (data := q.get()) is not None:
+            if p in self._broken or self._error is not None and p not in self.broken_ok:
                 continue
             try:
-                p.write(data)
-            except (BrokenPipeError, OSError):
-                if p in self.broken_ok:
-                    logger.warning('Subtitle process pipe broken — subtitles may not be generated')
-                    broken.add(p)
-                else:
-                    raise
+                self._write(p, data)
+            except (BrokenPipeError, OSError) as e:
+                self._error = e
+                self._broken.add(p)
 
     def close(self):
+        for q in self._queues:
+            q.put(None)
+        for t in self._threads:
+            t.join()
         for p in self.pipes:
-            p.close()
+            try:
+                p.close()
+            except (BrokenPipeError, OSError):
+                if p not in self.broken_ok:
+                    raise
+        if self._error is not None:
+            raise self._error
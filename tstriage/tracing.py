@@ -0,0 +1,126 @@
+"""OpenTelemetry-style spans for runs, stages, items and child processes.
+
+Spans are kept in memory and written as OTLP/JSON (the format of the
+OpenTelemetry collector's file exporter), so any OTLP-aware viewer can load
+them. No OpenTelemetry SDK is needed.
+"""
+
+import contextvars, json, logging, os, socket, threading, time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+logger = logging.getLogger('tstriage.tracing')
+
+_current: contextvars.ContextVar[Optional['Span']] = contextvars.ContextVar('tstriage_span', default=None)
+_finished: list['Span'] = []
+_lock = threading.Lock()
+_enabled = False
+
+
+@dataclass
+class Span:
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    start_ns: int
+    end_ns: Optional[int] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def end(self, error: Optional[str] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        self.error = error
+        if _enabled:
+            with _lock:
+                _finished.append(self)
+
+    def to_otlp(self) -> dict:
+        span = {
+            'traceId': self.trace_id,
+            'spanId': self.span_id,
+            'name': self.name,
+            'kind': 1,
+            'startTimeUnixNano': str(self.start_ns),
+            'endTimeUnixNano': str(self.end_ns),
+            'attributes': [_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            'status': {'code': 2, 'message': self.error} if self.error else {'code': 1},
+        }
+        if self.parent_id:
+            span['parentSpanId'] = self.parent_id
+        return span
+
+
+def _attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {'key': key, 'value': {'boolValue': value}}
+    if isinstance(value, int):
+        return {'key': key, 'value': {'intValue': str(value)}}
+    if isinstance(value, float):
+        return {'key': key, 'value': {'doubleValue': value}}
+    return {'key': key, 'value': {'stringValue': str(value)}}
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def start_span(name: str, **attributes) -> Span:
+    """Start a child of the current span without making it current (e.g. a subprocess)."""
+    parent = _current.get()
+    return Span(name=name,
+                trace_id=parent.trace_id if parent else os.urandom(16).hex(),
+                span_id=os.urandom(8).hex(),
+                parent_id=parent.span_id if parent else None,
+                start_ns=time.time_ns(),
+                attributes=attributes)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Span]:
+    """Run the block inside a new current span."""
+    s = start_span(name, **attributes)
+    token = _current.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.end(error=f'{type(e).__name__}: {e}')
+        raise
+    else:
+        s.end()
+    finally:
+        _current.reset(token)
+
+
+def export(path: Path) -> Optional[Path]:
+    """Write finished spans to path (a .json file, or a directory to create one in) and clear them."""
+    with _lock:
+        spans = list(_finished)
+        _finished.clear()
+    if not spans:
+        return None
+    path = Path(path).expanduser()
+    if path.suffix != '.json':
+        path.mkdir(parents=True, exist_ok=True)
+        path = path / f'{time.strftime("%Y%m%d-%H%M%S")}-{spans[0].trace_id[:8]}.json'
+    document = {'resourceSpans': [{
+        'resource': {'attributes': [_attribute('service.name', 'tstriage'),
+                                    _attribute('host.name', socket.gethostname())]},
+        'scopeSpans': [{'scope': {'name': 'tstriage'}, 'spans': [s.to_otlp() for s in spans]}],
+    }]}
+    with path.open('w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False)
+    logger.info(f'Trace written to {path}')
+    return path
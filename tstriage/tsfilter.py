@@ -0,0 +1,225 @@
+"""In-process MPEG-TS PID filter (optional, needs numpy).
+
+Keeps PAT, the program's PMT, its video/audio elementary streams and its PCR
+PID, and drops everything else (EIT/SDT/NIT/TOT, captions, data broadcasting,
+other services, null packets). The PAT is rewritten to list only the program
+and the PMT to list only the kept streams, so the encoder sees a plain AV
+stream. Packets are classified with numpy over whole chunks; only PSI packets
+(a few per second) are handled in Python.
+"""
+
+import logging
+from typing import Optional
+
+try:
+    import numpy as np
+except ImportError:  # optional dependency
+    np = None
+
+logger = logging.getLogger('tstriage.tsfilter')
+
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+PAT_PID = 0x0000
+NULL_PID = 0x1FFF
+
+# ISO/IEC 13818-1 stream_type values kept by the filter.
+VIDEO_STREAM_TYPES = {0x01, 0x02, 0x10, 0x1B, 0x24}      # MPEG-1/2, MPEG-4, H.264, HEVC
+AUDIO_STREAM_TYPES = {0x03, 0x04, 0x0F, 0x11, 0x81}      # MPEG audio, AAC (ADTS/LATM), AC-3
+
+
+def _crc32_table() -> list[int]:
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else (crc << 1)
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc32_table()
+
+
+def crc32_mpeg(data: bytes) -> int:
+    """CRC-32/MPEG-2 as used by PSI sections."""
+    crc = 0xFFFFFFFF
+    for b in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[((crc >> 24) ^ b) & 0xFF]
+    return crc
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _payload_offset(packet: bytes) -> Optional[int]:
+    control = (packet[3] >> 4) & 0x3
+    if control == 0x1:
+        return 4
+    if control == 0x3:
+        return 5 + packet[4]
+    return None
+
+
+def _single_section(packet: bytes) -> Optional[tuple[int, bytes]]:
+    """(offset of the section, section bytes incl. CRC) if a PSI section starts at the
+    beginning of the payload and fits in this packet; None otherwise."""
+    if not packet[1] & 0x40:  # payload_unit_start_indicator
+        return None
+    offset = _payload_offset(packet)
+    if offset is None or offset >= PACKET_SIZE or packet[offset] != 0:  # pointer_field
+        return None
+    start = offset + 1
+    if start + 3 > PACKET_SIZE:
+        return None
+    length = ((packet[start + 1] & 0x0F) << 8) | packet[start + 2]
+    end = start + 3 + length
+    if end > PACKET_SIZE or length < 9:
+        return None
+    section = packet[start:end]
+    if crc32_mpeg(section[:-4]) != int.from_bytes(section[-4:], 'big'):
+        return None
+    return start, section
+
+
+def _rebuild(packet: bytes, start: int, section: bytes) -> bytes:
+    """Replace the section in a packet; section_length and CRC are recomputed."""
+    length = len(section) + 4 - 3
+    body = bytes([section[0], (section[1] & 0xF0) | (length >> 8), length & 0xFF]) + section[3:]
+    body += crc32_mpeg(body).to_bytes(4, 'big')
+    out = packet[:start] + body
+    return out + b'\xff' * (PACKET_SIZE - len(out))
+
+
+class PidFilter:
+    """Stateful filter over an MPEG-TS byte stream split into arbitrary chunks.
+
+    Until the program's PMT has been parsed every packet is passed through.
+    """
+
+    def __init__(self, program: Optional[int] = None):
+        if np is None:
+            raise RuntimeError('numpy is required for the in-process TS filter (pip install numpy)')
+        self.program = program
+        self.pmt_pid: Optional[int] = None
+        self.kept: set[int] = set()
+        self._keep = None                   # numpy bool[8192], None → pass everything
+        self._psi: dict[bytes, bytes] = {}  # original packet payload → rewritten packet
+        self._rest = b''
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def _on_pat(self, packet: bytes) -> Optional[bytes]:
+        parsed = _single_section(packet)
+        if parsed is None or parsed[1][0] != 0x00:
+            return None
+        start, section = parsed
+        entries = section[8:-4]
+        programs = [(int.from_bytes(entries[i:i + 2], 'big'), int.from_bytes(entries[i + 2:i + 4], 'big') & 0x1FFF)
+                    for i in range(0, len(entries) - 3, 4)]
+        chosen = next(((n, pid) for n, pid in programs if n != 0 and (self.program is None or n == self.program)), None)
+        if chosen is None:
+            return None
+        if self.pmt_pid != chosen[1]:
+            self.pmt_pid, self.kept, self._keep = chosen[1], set(), None
+            logger.debug(f'program {chosen[0]}: PMT PID 0x{chosen[1]:04x}')
+        return _rebuild(packet, start, section[:8] + chosen[0].to_bytes(2, 'big') + (0xE000 | chosen[1]).to_bytes(2, 'big'))
+
+    def _on_pmt(self, packet: bytes) -> Optional[bytes]:
+        parsed = _single_section(packet)
+        if parsed is None or parsed[1][0] != 0x02:
+            return None
+        start, section = parsed
+        pcr_pid = int.from_bytes(section[8:10], 'big') & 0x1FFF
+        info_length = int.from_bytes(section[10:12], 'big') & 0x0FFF
+        pos, end = 12 + info_length, len(section) - 4
+        es, kept = b'', {PAT_PID, self.pmt_pid, pcr_pid}
+        while pos + 5 <= end:
+            stream_type = section[pos]
+            pid = int.from_bytes(section[pos + 1:pos + 3], 'big') & 0x1FFF
+            es_length = int.from_bytes(section[pos + 3:pos + 5], 'big') & 0x0FFF
+            if stream_type in VIDEO_STREAM_TYPES or stream_type in AUDIO_STREAM_TYPES:
+                es += section[pos:pos + 5 + es_length]
+                kept.add(pid)
+            pos += 5 + es_length
+        if kept != self.kept:
+            self.kept = kept
+            self._keep = np.zeros(8192, dtype=bool)
+            self._keep[list(kept)] = True
+            logger.debug(f'keeping PIDs {", ".join(f"0x{p:04x}" for p in sorted(kept))}')
+        return _rebuild(packet, start, section[:12 + info_length] + es)
+
+    def _rewrite(self, packet: bytes) -> bytes:
+        key = packet[1:3] + packet[4:]  # CC excluded so repeats hit the cache
+        rewritten = self._psi.get(key)
+        if rewritten is None:
+            pid = ((packet[1] & 0x1F) << 8) | packet[2]
+            rewritten = (self._on_pat(packet) if pid == PAT_PID else self._on_pmt(packet)) or packet
+            if len(self._psi) > 64:
+                self._psi.clear()
+            self._psi[key] = rewritten
+        # keep the continuity counter of this occurrence
+        return rewritten[:3] + bytes([(rewritten[3] & 0xF0) | (packet[3] & 0x0F)]) + rewritten[4:]
+
+    def _filter_packets(self, data) -> memoryview:
+        packets = np.frombuffer(data, dtype=np.uint8).reshape(-1, PACKET_SIZE)
+        if not (packets[:, 0] == SYNC_BYTE).all():
+            # Lost packet alignment (corrupt input): pass through rather than guess.
+            return memoryview(data)
+        pids = ((packets[:, 1].astype(np.uint16) & 0x1F) << 8) | packets[:, 2]
+        # PAT first: it may reveal (or change) the PMT PID.
+        rewritten = {row: self._rewrite(packets[row].tobytes()) for row in np.flatnonzero(pids == PAT_PID)}
+        if self.pmt_pid is not None:
+            rewritten.update((row, self._rewrite(packets[row].tobytes())) for row in np.flatnonzero(pids == self.pmt_pid))
+        keep = (pids != NULL_PID) if self._keep is None else self._keep[pids]
+        if rewritten:
+            keep[list(rewritten)] = True
+        out = packets[keep]  # a copy, so PSI rows can be replaced in place
+        if rewritten:
+            position = np.cumsum(keep) - 1
+            for row, packet in rewritten.items():
+                out[position[row]] = np.frombuffer(packet, dtype=np.uint8)
+        return memoryview(out.reshape(-1))
+
+    def filter(self, data) -> list[memoryview]:
+        """Filter a chunk and return the kept packets as buffers; an incomplete
+        trailing packet is held back until the next call."""
+        view = memoryview(data).cast('B')
+        self.bytes_in += len(view)
+        out = []
+        if self._rest:
+            need = PACKET_SIZE - len(self._rest)
+            self._rest += bytes(view[:need])
+            view = view[need:]
+            if len(self._rest) < PACKET_SIZE:
+                return out
+            out.append(self._filter_packets(self._rest))
+            self._rest = b''
+        n = len(view) // PACKET_SIZE * PACKET_SIZE
+        if n:
+            out.append(self._filter_packets(view[:n]))
+        self._rest = bytes(view[n:])
+        self.bytes_out += sum(len(b) for b in out)
+        return [b for b in out if len(b)]
+
+
+class FilteredPipe:
+    """Writable wrapper that passes everything written through a PidFilter.
+
+    Drop-in for a pipe in Tee:
+        Tee(FilteredPipe(encode.stdin, PidFilter()), subtitles.stdin)
+    """
+
+    def __init__(self, pipe, pidFilter: PidFilter):
+        self.pipe = pipe
+        self.filter = pidFilter
+
+    def write(self, data):
+        for out in self.filter.filter(data):
+            self.pipe.write(out)
+
+    def close(self):
+        if self.filter.bytes_in:
+            logger.debug(f'TS filter kept {self.filter.bytes_out / self.filter.bytes_in:.0%} of the stream')
+        self.pipe.close()